@@ -1,38 +1,177 @@
-import boto3
-from flask import Flask, render_template, g, request, redirect, url_for
+import os
+import time
+from flask import Flask, Response, render_template, g, request, redirect, url_for
+from markupsafe import Markup
 from flask.ext.misaka import Misaka
-from .model import NavGroup, Nav, SectionGroup, Section, Couple, RSVP, Accommodation, Meal
+from .model import NavGroup, Nav, SectionGroup, Section, Couple, RSVP, AccommodationGroup, Meal, batch_get_many, on_change
+from .pagecache import PageCache
+from .render import MarkdownCache
+from .fanout import FanOut
+from .spool import WriteSpool
+from . import assets
+from .backends import open_backend
+from .metrics import metrics
+from .sharedcache import open_store, serializers
+from .streams import ChangeConsumer, FileFeed, open_feed, publish_writes
 
 app = Flask(__name__)
 app.config.from_object('websiteconfig')
-Misaka(app)
+misaka = Misaka(app)
+
+# shared by the worker processes on this host, or None to cache in each one
+cache_store = open_store(app.config['DAO_CACHE_BACKEND'])
+if cache_store is not None:
+    os.register_at_fork(after_in_child=cache_store.reset)
+
+# Near-static content, cached and (with a CHANGE_FEED) invalidated as it changes
+content_classes = (NavGroup, SectionGroup, Couple, Meal, AccommodationGroup)
+
+if app.config['DAO_CACHE_TTL']:
+    for dao_class in content_classes:
+        dao_class.enable_cache(ttl=app.config['DAO_CACHE_TTL'], max_entries=app.config['DAO_CACHE_MAX_ENTRIES'],
+                               store=cache_store, serializer=serializers[app.config['DAO_CACHE_SERIALIZER']],
+                               local_ttl=app.config['DAO_CACHE_LOCAL_TTL'])
+
+dynamodb_manager = open_backend(app.config['STORAGE_BACKEND'],
+                                region_name=app.config['AWS_REGION'],
+                                max_pool_connections=app.config['DYNAMODB_MAX_POOL_CONNECTIONS'])
+# a lock held by another thread at fork time would otherwise stay held forever in the child
+os.register_at_fork(after_in_child=dynamodb_manager.reset)
+
+# each worker's metrics are a series of their own, labelled with its pid
+os.register_at_fork(after_in_child=metrics.reset)
+
+fan_out = FanOut(max_workers=app.config['FAN_OUT_MAX_WORKERS'])
+os.register_at_fork(after_in_child=fan_out.reset)
+
+rsvp_spool = None
+if app.config['RSVP_SPOOL_DIR']:
+    rsvp_spool = WriteSpool(app.config['RSVP_SPOOL_DIR'], dynamodb_manager)
+    os.register_at_fork(after_in_child=rsvp_spool.reset)
+
+# Items every page renders through layout.html
+common_sources = [(NavGroup, 'header_nav'), (NavGroup, 'footer_nav'), (Couple, '0')]
+
+# path -> the items the route renders (besides common_sources).  A bare DAO class means the whole table.
+page_sources = {
+    '/': [],
+    '/story/': [(SectionGroup, 'story')],
+    '/event/': [(SectionGroup, 'event')],
+    '/travel/': [(SectionGroup, 'travel'), (SectionGroup, 'area'), (AccommodationGroup, AccommodationGroup.ALL)],
+    '/area/': [(SectionGroup, 'area')],
+    '/party/': [(SectionGroup, 'party')],
+    '/registry/': [(SectionGroup, 'registry')],
+    '/save-the-date/': [(SectionGroup, 'save-the-date'), (AccommodationGroup, AccommodationGroup.ALL)],
+    '/rsvp/': [(SectionGroup, 'rsvp'), Meal],
+}
+
+
+def affected_paths(dao_class, keys):
+    '''
+    The paths of the pages that render the item of dao_class with keys, or with keys None any of its items.
+    '''
+    hash_key = None if keys is None else keys.get(dao_class.get_hash_key_name())
+
+    def renders(sources):
+        return any(source is dao_class
+                   or (isinstance(source, tuple) and source[0] is dao_class and (keys is None or source[1] == hash_key))
+                   for source in sources)
+
+    if renders(common_sources):
+        return sorted(page_sources)
+    return sorted(path for (path, sources) in page_sources.items() if renders(sources))
+
+
+# Pages that render the same HTML for every visitor
+cached_endpoints = ('story', 'event', 'area', 'party', 'registry', 'travel') if app.config['PAGE_CACHE_TTL'] else ()
+page_cache = PageCache(ttl=app.config['PAGE_CACHE_TTL'], max_age=app.config['PAGE_CACHE_MAX_AGE'])
+on_change(lambda dao_class, keys: page_cache.invalidate(affected_paths(dao_class, keys)), content_classes)
+
+# pushes changes made by other processes into this one's caches, see streams.py
+change_consumer = None
+if app.config['CHANGE_FEED']:
+    change_feed = open_feed(app.config['CHANGE_FEED'], content_classes, dynamodb_manager,
+                            region_name=app.config['AWS_REGION'])
+    if isinstance(change_feed, FileFeed):
+        publish_writes(change_feed, content_classes)
+    change_consumer = ChangeConsumer(change_feed, poll_interval=app.config['CHANGE_FEED_POLL_SECONDS'])
+    os.register_at_fork(after_in_child=change_consumer.reset)
+
+# written by build_assets.py; without it static files are served under their plain names
+asset_manifest = assets.load_manifest(app.static_folder)
+responsive_images = assets.load_images(app.static_folder)
+
+
+def render_section_text(text):
+    return Markup(assets.rewrite_images(misaka.render(text), responsive_images, app.static_url_path + '/'))
+
+# same filter name, so templates keep using section.text|markdown
+markdown = MarkdownCache(render_section_text, max_entries=app.config['MARKDOWN_CACHE_MAX_ENTRIES'], store=cache_store)
+app.jinja_env.filters['markdown'] = markdown
 
 meal_prefix = 'meal_preference_'
 
 if not app.debug:
     import logging
-    from logging import Formatter
     from logging.handlers import TimedRotatingFileHandler
+    from .logs import BackgroundHandler, JsonFormatter
 
     file_handler = TimedRotatingFileHandler('apothecary.log')
     file_handler.setLevel(logging.INFO)
-    file_handler.setFormatter(Formatter(
-        ' | '.join(['%(asctime)s',
-                    '%(levelname)s',
-                    '%(message)s',
-                    '%(pathname)s',
-                    '%(funcName)s',
-                    '%(lineno)d'])
-    ))
-    app.logger.addHandler(file_handler)
+    file_handler.setFormatter(JsonFormatter())
+    # the file is written from a background thread, so a slow disk never stalls a request
+    log_handler = BackgroundHandler(file_handler)
+    os.register_at_fork(after_in_child=log_handler.reset)
+    app.logger.addHandler(log_handler)
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.time()
+    metrics.set_route(request.endpoint)
+
+
+@app.before_request
+def consume_changes():
+    # started in each worker on its first request, not in the uWSGI master
+    if change_consumer is not None:
+        change_consumer.ensure_worker()
+
+
+@app.before_request
+def drain_spool():
+    # likewise, so what a previous worker left spooled is written without waiting for the next submission
+    if rsvp_spool is not None:
+        rsvp_spool.ensure_worker()
+
+
+@app.before_request
+def serve_cached_page():
+    # registered before bind_common, so a cache hit (or 304) never touches DynamoDB
+    if request.method != 'GET' or request.endpoint not in cached_endpoints:
+        return None
+    # before any content is read, so a render overtaken by a change isn't cached (see PageCache.store)
+    g.page_token = page_cache.token(request.path)
+    page = page_cache.get(request.path)
+    if page is None:
+        return None
+    g.cached_page = page
+    return page_cache.respond(page, request)
+
+
+# Endpoints that don't render the layout, so don't need its nav and couple data
+unbound_endpoints = ('ping', 'metrics', 'static')
 
 
 @app.before_request
 def bind_common():
-    g.dynamodb = boto3.resource('dynamodb', region_name=app.config['AWS_REGION'])
-    header_nav = NavGroup.get(g.dynamodb, 'header_nav')
-    footer_nav = NavGroup.get(g.dynamodb, 'footer_nav')
-    couple = Couple.get(g.dynamodb, '0')
+    if request.endpoint in unbound_endpoints:
+        return
+    g.dynamodb = dynamodb_manager.resource()
+    header_nav, footer_nav, couple = batch_get_many(g.dynamodb, [(NavGroup, 'header_nav'),
+                                                                 (NavGroup, 'footer_nav'),
+                                                                 (Couple, '0')])
 
     g.nav_bar = header_nav.navs
     g.toes = footer_nav.navs
@@ -42,6 +181,50 @@ def bind_common():
     g.title = g.her.split(' ')[0] + ' & ' + g.him.split(' ')[0]
 
 
+@app.after_request
+def cache_page(response):
+    if request.method != 'GET' or request.endpoint not in cached_endpoints or response.status_code != 200:
+        return response
+    if g.get('cached_page'):
+        return response
+    page = page_cache.store(request.path, response, g.get('page_token'))
+    return page_cache.respond(page, request, response)
+
+
+def save_rsvp(rsvp, operation):
+    if rsvp_spool is None:
+        getattr(rsvp, operation)(g.dynamodb)
+    else:
+        rsvp_spool.submit(operation, rsvp)
+
+
+def sorted_accommodations(dynamodb):
+    return AccommodationGroup.sorted_accommodations(dynamodb)
+
+
+@app.after_request
+def record_request_metrics(response):
+    if 'request_start' in g:
+        metrics.observe('apothecary_request_latency_seconds',
+                        {'route': request.endpoint or 'none', 'status': str(response.status_code)},
+                        time.time() - g.request_start)
+    metrics.set_route(None)
+    return response
+
+
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    if endpoint == 'static' and values.get('filename') in asset_manifest:
+        values['filename'] = asset_manifest[values['filename']]
+
+
+@app.after_request
+def cache_static(response):
+    if request.endpoint == 'static' and request.view_args.get('filename', '').startswith(assets.DIST + '/'):
+        response.headers['Cache-Control'] = assets.IMMUTABLE_CACHE_CONTROL
+    return response
+
+
 @app.errorhandler(500)
 def internal_server_error(e):
     error_message = 'Oh no!  Something went terribly wrong!'
@@ -58,8 +241,16 @@ def index():
 
 @app.route('/ping')
 def ping():
+    # a worker whose warm-up failed (e.g. DynamoDB was unreachable) tries again before reporting healthy
+    if not warmed_up and not warm_up():
+        return 'warming up', 503
     return 'healthy'
 
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/story/')
 def story():
     active_page = 'story'
@@ -79,11 +270,12 @@ def event():
 @app.route('/travel/')
 def travel():
     active_page = 'travel'
-    travel = SectionGroup.get(g.dynamodb, active_page)
+    show_accommodations = g.accommodations
+    (travel, area), accommodations = fan_out.run(
+        lambda: SectionGroup.batch_get(dynamodb_manager.resource(), [active_page, 'area']),
+        lambda: sorted_accommodations(dynamodb_manager.resource()) if show_accommodations else None
+    )
     sections = travel.sections
-    if g.accommodations:
-        accommodations = sorted([accommodation for accommodation in Accommodation.scan(g.dynamodb)], key=lambda x: x.miles_to_reception)
-    area = SectionGroup.get(g.dynamodb, 'area')
     area_sections = area.sections
     return render_template('travel.html', **locals())
 
@@ -116,9 +308,11 @@ def registry():
 def save_the_date():
     if request.method == 'GET':
         active_page = 'save-the-date'
-        save = SectionGroup.get(g.dynamodb, active_page)
+        save, accommodations = fan_out.run(
+            lambda: SectionGroup.get(dynamodb_manager.resource(), active_page),
+            lambda: sorted_accommodations(dynamodb_manager.resource())
+        )
         sections = save.sections
-        accommodations = sorted([accommodation for accommodation in Accommodation.scan(g.dynamodb)], key=lambda x: x.miles_to_reception)
         return render_template('save-the-date.html', **locals())
     elif request.method == 'POST':
         rsvp = RSVP(request.form['name'],
@@ -130,7 +324,7 @@ def save_the_date():
         )
         if 'decline' in request.form:
             rsvp.declined = True
-        rsvp.put(g.dynamodb)
+        save_rsvp(rsvp, 'put')
         return render_template('save-the-date-submit.html', **locals())
 
 
@@ -138,9 +332,11 @@ def save_the_date():
 def rsvp():
     if request.method == 'GET':
         active_page = 'rsvp'
-        rsvp_sections = SectionGroup.get(g.dynamodb, active_page)
+        rsvp_sections, meals = fan_out.run(
+            lambda: SectionGroup.get(dynamodb_manager.resource(), active_page),
+            lambda: sorted([meal for meal in Meal.scan(dynamodb_manager.resource())], key=lambda x: x.name)
+        )
         sections = rsvp_sections.sections
-        meals = sorted([meal for meal in Meal.scan(g.dynamodb)], key=lambda x: x.name)
         return render_template('rsvp.html', **locals())
     elif request.method == 'POST':
         print(request.form)
@@ -157,5 +353,47 @@ def rsvp():
                     )
         if 'decline' in request.form:
             rsvp.declined = True
-        rsvp.update_for_rsvp(g.dynamodb)
+        save_rsvp(rsvp, 'update_for_rsvp')
         return render_template('rsvp-submit.html', **locals())
+
+
+# Content loaded by warm_up() besides nav, couple, meals and accommodations
+warm_section_groups = ('story', 'event', 'travel', 'area', 'party', 'registry', 'save-the-date', 'rsvp')
+warmed_up = False
+
+
+def warm_up():
+    '''
+    Load the near-static content into the DAO caches, compile every template and render every section's markdown.
+    Returns whether it succeeded; /ping reports unhealthy until it has.
+    '''
+    global warmed_up
+    try:
+        dynamodb = dynamodb_manager.resource()
+        loaded = batch_get_many(dynamodb, [(NavGroup, 'header_nav'), (NavGroup, 'footer_nav'), (Couple, '0'),
+                                           (AccommodationGroup, AccommodationGroup.ALL)]
+                                + [(SectionGroup, section_group_id) for section_group_id in warm_section_groups])
+        list(Meal.scan(dynamodb))
+        for template in app.jinja_env.list_templates():
+            app.jinja_env.get_template(template)
+        markdown.prerender([section.text for group in loaded if isinstance(group, SectionGroup) for section in group.sections])
+    except Exception:
+        app.logger.exception('Warm-up failed')
+        return False
+    warmed_up = True
+    app.logger.info('Warmed up')
+    return True
+
+
+try:
+    import uwsgi
+except ImportError:
+    # not under uWSGI (e.g. run.py or a script importing the model), so there's nothing to warm for
+    warmed_up = True
+else:
+    # uWSGI imports the app in the master, before forking workers (no --lazy-apps), so everything warm_up() loads
+    # is shared copy-on-write with every worker
+    if app.config['WARM_UP']:
+        warm_up()
+    else:
+        warmed_up = True
@@ -0,0 +1,150 @@
+'''
+asyncio counterparts of the DAO API, backed by aioboto3's non-blocking DynamoDB resource.  They share the DAO
+classes' schemas, codec and caches with the blocking API, so both can be used side by side:
+
+    async with AsyncDynamoDB(region_name='us-east-1') as dynamodb:
+        story, couple = await get_many(dynamodb, [(SectionGroup, 'story'), (Couple, '0')])
+        meals = [meal async for meal in scan(Meal, dynamodb)]
+
+aioboto3 is only needed by this module, so it's imported lazily.
+'''
+
+import asyncio
+import logging
+import time
+from botocore.config import Config
+from .metrics import metrics
+from .model import OPERATION_METHODS, SLEEP
+
+missing = object()
+
+
+class AsyncDynamoDB(object):
+    '''
+    Async context manager for an aioboto3 DynamoDB resource.  Enter it once per event loop and share the resource
+    between coroutines; it keeps its connection pool open until exit.
+    '''
+
+    def __init__(self, region_name=None, max_pool_connections=10):
+        try:
+            import aioboto3
+        except ImportError:
+            raise ImportError('The async DAO API needs aioboto3: pip install aioboto3')
+        self._session = aioboto3.Session(region_name=region_name)
+        self._config = Config(max_pool_connections=max_pool_connections)
+        self._resource = None
+
+    async def __aenter__(self):
+        self._resource = self._session.resource('dynamodb', config=self._config)
+        return await self._resource.__aenter__()
+
+    async def __aexit__(self, *exc_info):
+        return await self._resource.__aexit__(*exc_info)
+
+
+async def call_dynamo(operation, table_name, call, **kwargs):
+    start = time.time()
+    try:
+        from_dynamo = await call(**kwargs)
+    except Exception as e:
+        metrics.record_dynamodb(operation, table_name, time.time() - start, error=e)
+        raise
+    metrics.record_dynamodb(operation, table_name, time.time() - start, from_dynamo)
+    logging.info('DynamoDB consumed capacity from %s: %s', operation, from_dynamo.get('ConsumedCapacity'))
+    return from_dynamo
+
+
+async def table(dao_class, dynamodb):
+    return await dynamodb.Table(dao_class.schema['TableName'])
+
+
+async def get(dao_class, dynamodb, hash_key, range_key=None):
+    if dao_class.cache is not None:
+        cached = dao_class.cache.get(dao_class.cache_key(hash_key, range_key), missing)
+        if cached is not missing:
+            return cached
+        invalidations = dao_class.cache.invalidations()
+
+    from_dynamo = await call_dynamo('GetItem', dao_class.schema['TableName'], (await table(dao_class, dynamodb)).get_item,
+        Key=dao_class.key_dict(hash_key, range_key),
+        ReturnConsumedCapacity='INDEXES'
+    )
+    loaded = dao_class.decode_item(from_dynamo['Item'])
+    if dao_class.cache is not None:
+        dao_class.cache.set(dao_class.cache_key(hash_key, range_key), loaded, invalidations)
+    return loaded
+
+
+async def get_many(dynamodb, requests):
+    '''
+    Fetch (dao_class, hash_key[, range_key]) requests concurrently, returning the objects in the same order.
+    '''
+    return await asyncio.gather(*[get(request[0], dynamodb, *request[1:]) for request in requests])
+
+
+async def scan(dao_class, dynamodb, **kwargs):
+    if dao_class.cache is not None and not kwargs:
+        cached = dao_class.cache.get(('scan',), missing)
+        if cached is missing:
+            invalidations = dao_class.cache.invalidations()
+            cached = [loaded async for loaded in scan_table(dao_class, dynamodb)]
+            dao_class.cache.set(('scan',), cached, invalidations)
+        for loaded in cached:
+            yield loaded
+        return
+
+    async for loaded in scan_table(dao_class, dynamodb, **kwargs):
+        yield loaded
+
+
+async def scan_table(dao_class, dynamodb, **kwargs):
+    dao_table = await table(dao_class, dynamodb)
+    kwargs.setdefault('ReturnConsumedCapacity', 'INDEXES')
+    while True:
+        from_dynamo = await call_dynamo('Scan', dao_class.schema['TableName'], dao_table.scan, **kwargs)
+        for item in from_dynamo.get('Items'):
+            yield dao_class.decode_item(item)
+        last_key = from_dynamo.get('LastEvaluatedKey')
+        if not last_key:
+            break
+        kwargs['ExclusiveStartKey'] = last_key
+
+
+async def run_steps(dynamodb, steps):
+    '''
+    model.run_steps on aioboto3: the same steps, so a write and what follows it (DAO.after_write, e.g. RSVP totals or
+    the AccommodationGroup) are the blocking API's.
+    '''
+    (resume, value) = (steps.send, None)
+    while True:
+        try:
+            (operation, dao_class, request) = resume(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            if operation == SLEEP:
+                await asyncio.sleep(request)
+                value = None
+            else:
+                dao_table = await table(dao_class, dynamodb)
+                value = await call_dynamo(operation, dao_class.schema['TableName'],
+                                          getattr(dao_table, OPERATION_METHODS[operation]), **request)
+            resume = steps.send
+        except Exception as e:
+            (resume, value) = (steps.throw, e)
+
+
+async def put(dao, dynamodb, condition=None, return_values='NONE'):
+    return await run_steps(dynamodb, dao.put_steps(condition, return_values))
+
+
+async def update(dao, dynamodb, fields=None, condition=None, add=None, return_values='NONE'):
+    return await run_steps(dynamodb, dao.update_steps(fields, condition, add, return_values))
+
+
+async def delete(dao, dynamodb, return_values='NONE'):
+    return await run_steps(dynamodb, dao.delete_steps(return_values))
+
+
+async def update_for_rsvp(rsvp, dynamodb):
+    await run_steps(dynamodb, rsvp.update_for_rsvp_steps())
@@ -0,0 +1,180 @@
+import gzip
+import hashlib
+import io
+import logging
+import os
+import re
+import simplejson as json
+
+DIST = 'dist'
+MANIFEST_NAME = 'manifest.json'
+IMAGES_NAME = 'images.json'
+# Assets whose names carry a content hash can be cached by browsers forever
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.html', '.txt')
+
+# Responsive variants are generated for photos at these widths (never wider than the original)
+IMAGE_WIDTHS = (480, 960, 1600)
+RESPONSIVE = ('.jpg', '.jpeg', '.png')
+# Sections are at most one page wide (--page-width in style.css)
+IMAGE_SIZES = '(max-width: 960px) 100vw, 960px'
+image_save_options = {
+    'JPEG': {'quality': 82, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 80},
+}
+
+
+def minify_css(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.DOTALL)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    text = re.sub(r'([{;])([-\w]+)\s*:\s*', r'\1\2:', text)
+    return text.replace(';}', '}').strip()
+
+
+def minify_js(text):
+    # rJSmin is optional; without it scripts are shipped as written
+    try:
+        import rjsmin
+    except ImportError:
+        logging.warning('rjsmin is not installed; not minifying javascript')
+        return text
+    return rjsmin.jsmin(text)
+
+
+minifiers = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+
+def fingerprinted_name(filename, data):
+    (base, ext) = os.path.splitext(filename)
+    return '{0}.{1}{2}'.format(base, hashlib.sha1(data).hexdigest()[:12], ext)
+
+
+def write_asset(static_folder, name, data):
+    filename = os.path.join(static_folder, name)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb') as f:
+        f.write(data)
+    if os.path.splitext(name)[1] in COMPRESSIBLE:
+        with open(filename + '.gz', 'wb') as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+
+
+def build(static_folder):
+    '''
+    Copy every file in static_folder into static_folder/dist/ under a name carrying a hash of its contents, minifying
+    CSS and JS and writing precompressed .gz variants of text assets.  Returns the manifest mapping each original
+    name (as passed to url_for('static', filename=...)) to its fingerprinted one, which is also written to
+    dist/manifest.json.  Resized and WebP variants of photos are described in dist/images.json.
+    '''
+    manifest = {}
+    images = {}
+    for (dirpath, dirnames, filenames) in os.walk(static_folder):
+        if os.path.relpath(dirpath, static_folder) == '.':
+            dirnames[:] = [dirname for dirname in dirnames if dirname != DIST]
+        for filename in filenames:
+            source = os.path.join(dirpath, filename)
+            name = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            minify = minifiers.get(os.path.splitext(name)[1])
+            if minify:
+                data = minify(data.decode('utf-8')).encode('utf-8')
+            manifest[name] = DIST + '/' + fingerprinted_name(name, data)
+            write_asset(static_folder, manifest[name], data)
+            logging.info('Built %s as %s', name, manifest[name])
+            if os.path.splitext(name)[1].lower() in RESPONSIVE:
+                image = build_image_variants(static_folder, name, data)
+                if image:
+                    images[name] = image
+
+    with open(os.path.join(static_folder, DIST, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    with open(os.path.join(static_folder, DIST, IMAGES_NAME), 'w') as f:
+        json.dump(images, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def build_image_variants(static_folder, name, data):
+    '''
+    Write resized copies of an image at each of IMAGE_WIDTHS in its own format and as WebP.  Returns its dimensions and
+    variants for images.json, or None if Pillow isn't installed.
+    '''
+    try:
+        from PIL import Image
+    except ImportError:
+        logging.warning('Pillow is not installed; not building responsive variants of %s', name)
+        return None
+
+    original = Image.open(io.BytesIO(data))
+    (width, height) = original.size
+    (base, ext) = os.path.splitext(name)
+    save_format = original.format
+    variants = []
+    for variant_width in sorted(set([w for w in IMAGE_WIDTHS if w < width] + [width])):
+        resized = original if variant_width == width else \
+            original.resize((variant_width, round(height * variant_width / width)), Image.LANCZOS)
+        for (variant_format, variant_ext, mimetype) in ((save_format, ext, None), ('WEBP', '.webp', 'image/webp')):
+            out = io.BytesIO()
+            (resized.convert('RGB') if variant_format == 'JPEG' else resized).save(
+                out, variant_format, **image_save_options.get(variant_format, {}))
+            variant_data = out.getvalue()
+            variant_name = DIST + '/' + fingerprinted_name('{0}-{1}w{2}'.format(base, variant_width, variant_ext), variant_data)
+            write_asset(static_folder, variant_name, variant_data)
+            variants.append({'width': variant_width, 'src': variant_name, 'type': mimetype})
+    logging.info('Built %s responsive variants of %s', len(variants), name)
+    return {'width': width, 'height': height, 'variants': variants}
+
+
+def load_manifest(static_folder):
+    filename = os.path.join(static_folder, DIST, MANIFEST_NAME)
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+def load_images(static_folder):
+    filename = os.path.join(static_folder, DIST, IMAGES_NAME)
+    if not os.path.exists(filename):
+        return {}
+    with open(filename) as f:
+        return json.load(f)
+
+
+img_tag = re.compile(r'<img\s([^>]*?)\s*/?>', re.IGNORECASE)
+src_attribute = re.compile(r'\bsrc="([^"]+)"', re.IGNORECASE)
+
+
+def srcset(static_url, variants):
+    return ', '.join(['{0}{1} {2}w'.format(static_url, variant['src'], variant['width']) for variant in variants])
+
+
+def rewrite_images(html, images, static_url='/static/'):
+    '''
+    Make the <img> tags in rendered section HTML responsive: images with variants in images.json get srcset, sizes,
+    width and height, with a WebP <source> in a <picture>.  Every image is lazy-loaded.
+    '''
+    def rewrite(match):
+        attributes = match.group(1)
+        if 'loading=' not in attributes:
+            attributes += ' loading="lazy" decoding="async"'
+        src = src_attribute.search(attributes)
+        name = src.group(1)[len(static_url):] if src and src.group(1).startswith(static_url) else None
+        image = images.get(name)
+        if not image:
+            return '<img {0}/>'.format(attributes)
+
+        fallback = [variant for variant in image['variants'] if variant['type'] is None]
+        webp = [variant for variant in image['variants'] if variant['type'] == 'image/webp']
+        attributes = src_attribute.sub('src="{0}{1}"'.format(static_url, fallback[-1]['src']), attributes)
+        img = '<img {0} srcset="{1}" sizes="{2}" width="{3}" height="{4}"/>'.format(
+            attributes, srcset(static_url, fallback), IMAGE_SIZES, image['width'], image['height'])
+        return '<picture><source type="image/webp" srcset="{0}" sizes="{1}">{2}</picture>'.format(
+            srcset(static_url, webp), IMAGE_SIZES, img)
+
+    return img_tag.sub(rewrite, html)
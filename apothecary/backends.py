@@ -0,0 +1,910 @@
+'''
+Storage backends for the DAO.
+
+The DAO talks to storage through the part of boto3's DynamoDB service resource it uses: Table(name) with get_item,
+put_item, update_item, delete_item, scan and query, plus batch_get_item, batch_write_item, create_table,
+describe_table and update_table (to add or remove global secondary indexes).  The DynamoDB
+backend is boto3's resource itself, handed out by DynamoDBManager.  MemoryBackend and SQLiteBackend implement the
+same calls locally: they take and return items in the same form (Decimal numbers, sets, Binary) and raise the same
+botocore ClientErrors, so DAO code, caches, change listeners and metrics work unchanged on any of them.
+
+Filter and condition expressions must be boto3.dynamodb.conditions objects (Attr, Key), which is how the DAO
+builds them; update and projection expressions are parsed from their strings.  Consumed capacity isn't reported.
+Secondary indexes aren't stored separately: a query on one reads the whole table and picks out the items the index
+would hold, which is plenty for the table sizes these backends are for.
+'''
+
+import base64
+import copy
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from decimal import Decimal
+import botocore.exceptions
+import simplejson as json
+from boto3.dynamodb.conditions import AttributeBase, ConditionBase
+from boto3.dynamodb.types import DYNAMODB_CONTEXT, Binary, TypeDeserializer, TypeSerializer
+from .connection import DynamoDBManager
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+missing = object()
+
+
+def open_backend(url, region_name=None, max_pool_connections=10):
+    '''
+    Open the backend named by url: 'dynamodb', 'memory' or 'sqlite:///<file>'.  Like DynamoDBManager, the result's
+    resource() hands out the backend for the current process and reset() is registered to run after a fork.
+    '''
+    if url == 'dynamodb':
+        return DynamoDBManager(region_name=region_name, max_pool_connections=max_pool_connections)
+    if url == 'memory':
+        return MemoryBackend()
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):])
+    raise ValueError('Unknown storage backend {0!r}; expected dynamodb, memory or sqlite:///<file>'.format(url))
+
+
+def client_error(operation, code, message):
+    return botocore.exceptions.ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+def normalize(value):
+    # the same conversions (and the same TypeError for floats) boto3 applies on the way to DynamoDB and back
+    return deserializer.deserialize(serializer.serialize(value))
+
+
+def normalize_item(item):
+    return {name: normalize(value) for (name, value) in item.items()}
+
+
+def type_of(value):
+    return next(iter(serializer.serialize(value)))
+
+
+class Backend(object):
+    '''
+    Base class of the local backends.  Subclasses store each table's schema and items; this class (and LocalTable)
+    implement the DynamoDB calls on top of that.
+    '''
+
+    def resource(self):
+        return self
+
+    def client(self):
+        return self
+
+    def reset(self):
+        pass
+
+    def Table(self, name):
+        return LocalTable(self, name)
+
+    def create_table(self, **schema):
+        name = schema['TableName']
+        types = { definition['AttributeName']: definition['AttributeType'] for definition in schema['AttributeDefinitions'] }
+        indexes = schema.get('GlobalSecondaryIndexes', []) + schema.get('LocalSecondaryIndexes', [])
+        if any(key['AttributeName'] not in types for key_schema in [schema] + indexes for key in key_schema['KeySchema']):
+            raise client_error('CreateTable', 'ValidationException', 'Every key attribute needs an AttributeDefinition')
+        with self.writing():
+            if self.load_schema(name) is not None:
+                raise client_error('CreateTable', 'ResourceInUseException', 'Table already exists: {0}'.format(name))
+            self.save_schema(name, schema)
+        return {'TableDescription': describe(schema)}
+
+    def describe_table(self, TableName, **kwargs):
+        return {'Table': describe(self.Table(TableName).schema('DescribeTable'))}
+
+    def update_table(self, TableName, AttributeDefinitions=None, GlobalSecondaryIndexUpdates=None,
+                     StreamSpecification=None, **kwargs):
+        with self.writing():
+            schema = copy.deepcopy(self.Table(TableName).schema('UpdateTable'))
+            definitions = { definition['AttributeName']: definition for definition in schema['AttributeDefinitions'] }
+            for definition in AttributeDefinitions or []:
+                definitions[definition['AttributeName']] = definition
+            schema['AttributeDefinitions'] = list(definitions.values())
+            indexes = schema.get('GlobalSecondaryIndexes', [])
+            for update in GlobalSecondaryIndexUpdates or []:
+                if 'Create' in update:
+                    index = update['Create']
+                    if any(existing['IndexName'] == index['IndexName'] for existing in indexes):
+                        raise client_error('UpdateTable', 'ValidationException',
+                                           'Index already exists: {0}'.format(index['IndexName']))
+                    if any(key['AttributeName'] not in definitions for key in index['KeySchema']):
+                        raise client_error('UpdateTable', 'ValidationException',
+                                           'Every key attribute needs an AttributeDefinition')
+                    indexes.append(index)
+                elif 'Delete' in update:
+                    indexes = [index for index in indexes if index['IndexName'] != update['Delete']['IndexName']]
+            schema['GlobalSecondaryIndexes'] = indexes
+            if StreamSpecification is not None:
+                # recorded only: a local backend has no stream to read (see streams.FileFeed)
+                schema['StreamSpecification'] = StreamSpecification
+            self.replace_schema(TableName, schema)
+        return {'TableDescription': describe(schema)}
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        for (name, request) in RequestItems.items():
+            table = self.Table(name)
+            found = [table.get_item(Key=key,
+                                    ProjectionExpression=request.get('ProjectionExpression'),
+                                    ExpressionAttributeNames=request.get('ExpressionAttributeNames'))
+                     for key in request['Keys']]
+            responses[name] = [from_table['Item'] for from_table in found if 'Item' in from_table]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        for (name, requests) in RequestItems.items():
+            table = self.Table(name)
+            for request in requests:
+                if 'PutRequest' in request:
+                    table.put_item(Item=request['PutRequest']['Item'])
+                else:
+                    table.delete_item(Key=request['DeleteRequest']['Key'])
+        return {'UnprocessedItems': {}}
+
+    # Storage, implemented by subclasses.  Keys are (hash, range) tuples, with None for a table without a range key.
+
+    def load_schema(self, name):
+        raise NotImplementedError
+
+    def save_schema(self, name, schema):
+        raise NotImplementedError
+
+    def replace_schema(self, name, schema):
+        '''
+        Change the schema of an existing table, keeping its items (only indexes and attribute definitions change).
+        '''
+        raise NotImplementedError
+
+    def drop(self, name):
+        raise NotImplementedError
+
+    def load(self, name, key):
+        raise NotImplementedError
+
+    def store(self, name, key, item):
+        raise NotImplementedError
+
+    def remove(self, name, key):
+        raise NotImplementedError
+
+    def scan_items(self, name, start_key=None):
+        '''
+        Yield (key, item) in key order, starting after start_key.
+        '''
+        raise NotImplementedError
+
+    def writing(self):
+        '''
+        Context manager that makes a read-modify-write atomic.
+        '''
+        raise NotImplementedError
+
+
+class LocalTable(object):
+    '''
+    A table of a local backend, with the boto3 Table methods the DAO calls.
+    '''
+
+    def __init__(self, backend, name):
+        self.backend = backend
+        self.name = name
+
+    @property
+    def table_name(self):
+        return self.name
+
+    def schema(self, operation):
+        schema = self.backend.load_schema(self.name)
+        if schema is None:
+            raise client_error(operation, 'ResourceNotFoundException',
+                               'Requested resource not found: Table: {0} not found'.format(self.name))
+        return schema
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, **kwargs):
+        key = key_of(self.schema('GetItem'), Key, 'GetItem')
+        item = self.backend.load(self.name, key)
+        if item is None:
+            return {}
+        return {'Item': project(item, ProjectionExpression, ExpressionAttributeNames, 'GetItem')}
+
+    def put_item(self, Item, ConditionExpression=None, ReturnValues='NONE', **kwargs):
+        schema = self.schema('PutItem')
+        item = normalize_item(Item)
+        key = key_of(schema, item, 'PutItem', exact=False)
+        with self.backend.writing():
+            old = self.backend.load(self.name, key)
+            check(ConditionExpression, old, 'PutItem')
+            self.backend.store(self.name, key, item)
+        return returned(old if ReturnValues == 'ALL_OLD' else None)
+
+    def update_item(self, Key, UpdateExpression=None, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        schema = self.schema('UpdateItem')
+        key = key_of(schema, Key, 'UpdateItem')
+        actions = parse_update(UpdateExpression or '', ExpressionAttributeNames or {},
+                               normalize_item(ExpressionAttributeValues or {}), 'UpdateItem')
+        for (action, path, operand) in actions:
+            if path[0] in key_names(schema):
+                raise client_error('UpdateItem', 'ValidationException',
+                                   'Cannot update attribute {0}. This attribute is part of the key'.format(path[0]))
+
+        with self.backend.writing():
+            old = self.backend.load(self.name, key)
+            check(ConditionExpression, old, 'UpdateItem')
+            new = apply_update(actions, old if old is not None else normalize_item(Key), 'UpdateItem')
+            self.backend.store(self.name, key, new)
+
+        updated = [path for (action, path, operand) in actions]
+        if ReturnValues == 'ALL_OLD':
+            return returned(old)
+        if ReturnValues == 'ALL_NEW':
+            return returned(new)
+        if ReturnValues == 'UPDATED_OLD':
+            return returned(project_paths(old or {}, updated))
+        if ReturnValues == 'UPDATED_NEW':
+            return returned(project_paths(new, updated))
+        return {}
+
+    def delete_item(self, Key, ConditionExpression=None, ReturnValues='NONE', **kwargs):
+        key = key_of(self.schema('DeleteItem'), Key, 'DeleteItem')
+        with self.backend.writing():
+            old = self.backend.load(self.name, key)
+            check(ConditionExpression, old, 'DeleteItem')
+            if old is not None:
+                self.backend.remove(self.name, key)
+        return returned(old if ReturnValues == 'ALL_OLD' else None)
+
+    def scan(self, FilterExpression=None, ExclusiveStartKey=None, Limit=None, Segment=None, TotalSegments=None,
+             ProjectionExpression=None, ExpressionAttributeNames=None, Select=None, **kwargs):
+        schema = self.schema('Scan')
+        start_key = key_of(schema, ExclusiveStartKey, 'Scan') if ExclusiveStartKey else None
+        check_filter(FilterExpression, 'Scan')
+        items = []
+        scanned = 0
+        last_key = None
+        for (key, item) in self.backend.scan_items(self.name, start_key):
+            if TotalSegments and segment_of(key, TotalSegments) != Segment:
+                continue
+            scanned += 1
+            if FilterExpression is None or evaluate(FilterExpression, item):
+                items.append(project(item, ProjectionExpression, ExpressionAttributeNames, 'Scan'))
+            if Limit and scanned >= Limit:
+                last_key = key_dict(schema, key)
+                break
+
+        from_table = {'Count': len(items), 'ScannedCount': scanned}
+        if Select != 'COUNT':
+            from_table['Items'] = items
+        if last_key is not None:
+            from_table['LastEvaluatedKey'] = last_key
+        return from_table
+
+    def query(self, KeyConditionExpression, IndexName=None, FilterExpression=None, ExclusiveStartKey=None, Limit=None,
+              ScanIndexForward=True, ProjectionExpression=None, ExpressionAttributeNames=None, Select=None, **kwargs):
+        schema = self.schema('Query')
+        index_schema = index_of(schema, IndexName, 'Query')
+        if not isinstance(KeyConditionExpression, ConditionBase):
+            raise client_error('Query', 'ValidationException',
+                               'Local backends only evaluate key conditions built with boto3.dynamodb.conditions')
+        check_filter(FilterExpression, 'Query')
+        types = { definition['AttributeName']: definition['AttributeType'] for definition in schema['AttributeDefinitions'] }
+        index_keys = [name for name in key_names(index_schema) if name is not None]
+
+        # the items the index holds (those with its key attributes, of the right types) that match, in its order
+        matched = []
+        for (key, item) in self.backend.scan_items(self.name):
+            if any(name not in item or type_of(item[name]) != types[name] for name in index_keys):
+                continue
+            if evaluate(KeyConditionExpression, item):
+                matched.append((query_position(index_keys, item, key), key, item))
+        matched.sort(key=lambda entry: entry[0], reverse=not ScanIndexForward)
+        if ExclusiveStartKey:
+            start = query_position(index_keys, normalize_item(ExclusiveStartKey),
+                                   key_of(schema, ExclusiveStartKey, 'Query', exact=False))
+            matched = [entry for entry in matched if (entry[0] > start if ScanIndexForward else entry[0] < start)]
+
+        items = []
+        scanned = 0
+        last_key = None
+        for (position, key, item) in matched:
+            scanned += 1
+            if FilterExpression is None or evaluate(FilterExpression, item):
+                items.append(project(item, ProjectionExpression, ExpressionAttributeNames, 'Query'))
+            if Limit and scanned >= Limit:
+                last_key = dict(key_dict(schema, key), **{ name: item[name] for name in index_keys })
+                break
+
+        from_table = {'Count': len(items), 'ScannedCount': scanned}
+        if Select != 'COUNT':
+            from_table['Items'] = items
+        if last_key is not None:
+            from_table['LastEvaluatedKey'] = last_key
+        return from_table
+
+    def delete(self):
+        self.schema('DeleteTable')
+        self.backend.drop(self.name)
+
+    def wait_until_exists(self):
+        self.schema('DescribeTable')
+
+    def wait_until_not_exists(self):
+        pass
+
+
+def describe(schema):
+    description = dict(schema, TableStatus='ACTIVE')
+    if schema.get('GlobalSecondaryIndexes'):
+        description['GlobalSecondaryIndexes'] = [dict(index, IndexStatus='ACTIVE')
+                                                 for index in schema['GlobalSecondaryIndexes']]
+    return description
+
+
+def index_of(schema, index_name, operation):
+    '''
+    The table's schema, or with index_name that secondary index's, for its KeySchema.
+    '''
+    if index_name is None:
+        return schema
+    for index in schema.get('GlobalSecondaryIndexes', []) + schema.get('LocalSecondaryIndexes', []):
+        if index['IndexName'] == index_name:
+            return index
+    raise client_error(operation, 'ValidationException',
+                       'The table does not have the specified index: {0}'.format(index_name))
+
+
+def query_position(index_keys, item, key):
+    # items with the same index keys follow table key order
+    return sort_key(tuple(item[name] for name in index_keys)) + sort_key(key)
+
+
+def key_names(schema):
+    hash_key = next(key['AttributeName'] for key in schema['KeySchema'] if key['KeyType'] == 'HASH')
+    range_key = next((key['AttributeName'] for key in schema['KeySchema'] if key['KeyType'] == 'RANGE'), None)
+    return (hash_key, range_key)
+
+
+def key_of(schema, item, operation, exact=True):
+    '''
+    The (hash, range) key of item, checked against the table's KeySchema.  exact requires item to be only the key.
+    '''
+    names = [name for name in key_names(schema) if name is not None]
+    types = { definition['AttributeName']: definition['AttributeType'] for definition in schema['AttributeDefinitions'] }
+    if any(name not in item for name in names) or (exact and len(item) != len(names)) \
+            or any(type_of(item[name]) != types[name] for name in names):
+        raise client_error(operation, 'ValidationException', 'The provided key element does not match the schema')
+    return tuple(normalize(item[name]) for name in names) + (None,) * (2 - len(names))
+
+
+def key_dict(schema, key):
+    return { name: value for (name, value) in zip(key_names(schema), key) if name is not None }
+
+
+def sort_key(key):
+    return tuple(bytes(part) if isinstance(part, Binary) else part for part in key if part is not None)
+
+
+def segment_of(key, total_segments):
+    return zlib.crc32(repr(sort_key(key)[0]).encode('utf-8')) % total_segments
+
+
+def returned(attributes):
+    return {'Attributes': attributes} if attributes else {}
+
+
+# Document paths: a list of attribute names and list indexes, e.g. meal_preference.Beef -> ['meal_preference', 'Beef']
+
+def tokenize(expression):
+    return re.findall(r'[#:]?[A-Za-z_][A-Za-z0-9_]*|\d+|\S', expression)
+
+
+def parse_path(tokens, index, names, operation):
+    path = []
+    while True:
+        if index >= len(tokens) or not re.match(r'#?[A-Za-z_]', tokens[index]):
+            raise client_error(operation, 'ValidationException', 'Invalid document path in expression')
+        name = tokens[index]
+        if name.startswith('#'):
+            if name not in names:
+                raise client_error(operation, 'ValidationException',
+                                   'An expression attribute name used in the document path is not defined: {0}'.format(name))
+            name = names[name]
+        path.append(name)
+        index += 1
+        while index + 2 < len(tokens) and tokens[index] == '[' and tokens[index + 2] == ']':
+            path.append(int(tokens[index + 1]))
+            index += 3
+        if index < len(tokens) and tokens[index] == '.':
+            index += 1
+            continue
+        return (path, index)
+
+
+def attribute_path(name):
+    (path, index) = parse_path(tokenize(name), 0, {}, 'Condition')
+    return path
+
+
+def resolve(item, path):
+    value = item
+    for part in path:
+        if isinstance(part, int):
+            if not isinstance(value, list) or part >= len(value):
+                return missing
+        elif not isinstance(value, dict) or part not in value:
+            return missing
+        value = value[part]
+    return value
+
+
+def assign(item, path, value, operation):
+    parent = resolve(item, path[:-1])
+    part = path[-1]
+    if isinstance(part, int) and isinstance(parent, list):
+        if part < len(parent):
+            parent[part] = value
+        else:
+            parent.append(value)
+    elif not isinstance(part, int) and isinstance(parent, dict):
+        parent[part] = value
+    else:
+        raise client_error(operation, 'ValidationException',
+                           'The document path provided in the update expression is invalid for update')
+
+
+def discard(item, path):
+    parent = resolve(item, path[:-1])
+    part = path[-1]
+    if isinstance(part, int) and isinstance(parent, list) and part < len(parent):
+        del parent[part]
+    elif not isinstance(part, int) and isinstance(parent, dict):
+        parent.pop(part, None)
+
+
+def project(item, expression, names, operation):
+    if not expression:
+        return item
+    paths = []
+    tokens = tokenize(expression)
+    index = 0
+    while index < len(tokens):
+        (path, index) = parse_path(tokens, index, names or {}, operation)
+        paths.append(path)
+        if index < len(tokens) and tokens[index] == ',':
+            index += 1
+    return project_paths(item, paths)
+
+
+def project_paths(item, paths):
+    projected = {}
+    for path in paths:
+        value = resolve(item, path)
+        if value is missing:
+            continue
+        parent = projected
+        for (part, next_part) in zip(path, path[1:]):
+            if isinstance(parent, list):
+                parent.append({} if not isinstance(next_part, int) else [])
+                parent = parent[-1]
+            else:
+                parent = parent.setdefault(part, {} if not isinstance(next_part, int) else [])
+        if isinstance(parent, list):
+            parent.append(value)
+        else:
+            parent[path[-1]] = value
+    return projected
+
+
+# Update expressions: SET, REMOVE, ADD and DELETE clauses, with if_not_exists(), list_append() and + / -
+
+UPDATE_CLAUSES = ('SET', 'REMOVE', 'ADD', 'DELETE')
+UPDATE_FUNCTIONS = ('if_not_exists', 'list_append')
+
+
+def parse_update(expression, names, values, operation):
+    '''
+    Parse an UpdateExpression into a list of (action, path, operand) tuples.
+    '''
+    tokens = tokenize(expression)
+    actions = []
+    index = 0
+    while index < len(tokens):
+        clause = tokens[index].upper()
+        if clause not in UPDATE_CLAUSES:
+            raise client_error(operation, 'ValidationException', 'Invalid UpdateExpression: unexpected {0!r}'.format(tokens[index]))
+        index += 1
+        while True:
+            (path, index) = parse_path(tokens, index, names, operation)
+            operand = None
+            if clause == 'SET':
+                if index >= len(tokens) or tokens[index] != '=':
+                    raise client_error(operation, 'ValidationException', 'Invalid UpdateExpression: expected =')
+                (operand, index) = parse_operand(tokens, index + 1, names, values, operation)
+                if index < len(tokens) and tokens[index] in ('+', '-'):
+                    sign = tokens[index]
+                    (right, index) = parse_operand(tokens, index + 1, names, values, operation)
+                    operand = (sign, operand, right)
+            elif clause in ('ADD', 'DELETE'):
+                (operand, index) = parse_operand(tokens, index, names, values, operation)
+            actions.append((clause, path, operand))
+            if index < len(tokens) and tokens[index] == ',':
+                index += 1
+                continue
+            break
+    return actions
+
+
+def parse_operand(tokens, index, names, values, operation):
+    if index >= len(tokens):
+        raise client_error(operation, 'ValidationException', 'Invalid UpdateExpression: missing operand')
+    token = tokens[index]
+    if token.startswith(':'):
+        if token not in values:
+            raise client_error(operation, 'ValidationException',
+                               'An expression attribute value used in expression is not defined: {0}'.format(token))
+        return (('value', values[token]), index + 1)
+    if token in UPDATE_FUNCTIONS and index + 1 < len(tokens) and tokens[index + 1] == '(':
+        (first, index) = parse_operand(tokens, index + 2, names, values, operation)
+        if index >= len(tokens) or tokens[index] != ',':
+            raise client_error(operation, 'ValidationException', 'Invalid UpdateExpression: {0} takes two operands'.format(token))
+        (second, index) = parse_operand(tokens, index + 1, names, values, operation)
+        if index >= len(tokens) or tokens[index] != ')':
+            raise client_error(operation, 'ValidationException', 'Invalid UpdateExpression: expected )')
+        return ((token, first, second), index + 1)
+    (path, index) = parse_path(tokens, index, names, operation)
+    return (('path', path), index)
+
+
+def operand_value(item, operand, operation):
+    kind = operand[0]
+    if kind == 'value':
+        return copy.deepcopy(operand[1])
+    if kind == 'path':
+        value = resolve(item, operand[1])
+        return copy.deepcopy(value) if value is not missing else missing
+    if kind == 'if_not_exists':
+        existing = operand_value(item, operand[1], operation)
+        return existing if existing is not missing else operand_value(item, operand[2], operation)
+    (left, right) = (operand_value(item, operand[1], operation), operand_value(item, operand[2], operation))
+    if kind == 'list_append':
+        if not isinstance(left, list) or not isinstance(right, list):
+            raise client_error(operation, 'ValidationException', 'list_append needs two lists')
+        return left + right
+    if not isinstance(left, Decimal) or not isinstance(right, Decimal):
+        raise client_error(operation, 'ValidationException', 'An operand in the update expression has an incorrect data type')
+    return DYNAMODB_CONTEXT.add(left, right) if kind == '+' else DYNAMODB_CONTEXT.subtract(left, right)
+
+
+def apply_update(actions, old, operation):
+    # every operand is read from the item as it was before the update, as DynamoDB does
+    new = copy.deepcopy(old)
+    for (action, path, operand) in actions:
+        value = operand_value(old, operand, operation) if operand is not None else None
+        if value is missing:
+            raise client_error(operation, 'ValidationException',
+                               'The provided expression refers to an attribute that does not exist in the item')
+        if action == 'SET':
+            assign(new, path, value, operation)
+        elif action == 'REMOVE':
+            discard(new, path)
+        elif action == 'ADD':
+            current = resolve(old, path)
+            if isinstance(value, Decimal) and (current is missing or isinstance(current, Decimal)):
+                assign(new, path, DYNAMODB_CONTEXT.add(Decimal(0) if current is missing else current, value), operation)
+            elif isinstance(value, set) and (current is missing or isinstance(current, set)):
+                assign(new, path, (set() if current is missing else current) | value, operation)
+            else:
+                raise client_error(operation, 'ValidationException',
+                                   'An operand in the update expression has an incorrect data type')
+        elif action == 'DELETE':
+            current = resolve(old, path)
+            if not isinstance(value, set) or (current is not missing and not isinstance(current, set)):
+                raise client_error(operation, 'ValidationException',
+                                   'An operand in the update expression has an incorrect data type')
+            if current is not missing:
+                if current - value:
+                    assign(new, path, current - value, operation)
+                else:
+                    discard(new, path)
+    return normalize_item(new)
+
+
+# Conditions built with boto3.dynamodb.conditions
+
+def check_filter(condition, operation):
+    if condition is not None and not isinstance(condition, ConditionBase):
+        raise client_error(operation, 'ValidationException',
+                           'Local backends only evaluate conditions built with boto3.dynamodb.conditions')
+
+
+def check(condition, item, operation):
+    check_filter(condition, operation)
+    if condition is not None and not evaluate(condition, item or {}):
+        raise client_error(operation, 'ConditionalCheckFailedException', 'The conditional request failed')
+
+
+def evaluate(condition, item):
+    expression = condition.get_expression()
+    operator = expression['operator']
+    values = expression['values']
+    if operator == 'AND':
+        return all(evaluate(value, item) for value in values)
+    if operator == 'OR':
+        return any(evaluate(value, item) for value in values)
+    if operator == 'NOT':
+        return not evaluate(values[0], item)
+
+    operands = [condition_operand(item, value) for value in values]
+    if operator == 'attribute_exists':
+        return operands[0] is not missing
+    if operator == 'attribute_not_exists':
+        return operands[0] is missing
+    if any(operand is missing for operand in operands):
+        return False
+    try:
+        if operator == 'attribute_type':
+            return type_of(operands[0]) == operands[1]
+        if operator == '=':
+            return operands[0] == operands[1]
+        if operator == '<>':
+            return operands[0] != operands[1]
+        if operator == '<':
+            return operands[0] < operands[1]
+        if operator == '<=':
+            return operands[0] <= operands[1]
+        if operator == '>':
+            return operands[0] > operands[1]
+        if operator == '>=':
+            return operands[0] >= operands[1]
+        if operator == 'BETWEEN':
+            return operands[1] <= operands[0] <= operands[2]
+        if operator == 'IN':
+            return operands[0] in operands[1]
+        if operator == 'begins_with':
+            return isinstance(operands[0], type(operands[1])) and operands[0].startswith(operands[1])
+        if operator == 'contains':
+            if isinstance(operands[0], str):
+                return isinstance(operands[1], str) and operands[1] in operands[0]
+            return isinstance(operands[0], (set, list)) and operands[1] in operands[0]
+    except TypeError:
+        # comparing different types is false, not an error
+        return False
+    raise ValueError('Unsupported condition operator {0}'.format(operator))
+
+
+def condition_operand(item, value):
+    if isinstance(value, ConditionBase):
+        # size(), the only condition that's also an operand
+        sized = condition_operand(item, value.get_expression()['values'][0])
+        if sized is missing or isinstance(sized, (bool, Decimal)):
+            return missing
+        return Decimal(len(bytes(sized) if isinstance(sized, Binary) else sized))
+    if isinstance(value, AttributeBase):
+        return resolve(item, attribute_path(value.name))
+    if isinstance(value, (list, tuple)):
+        return [normalize(element) for element in value]
+    return normalize(value)
+
+
+class MemoryBackend(Backend):
+    '''
+    Keeps every table in dicts in this process.  Nothing is persisted, and each forked worker ends up with its own
+    copy, so it's for tests, benchmarks and trying the site out offline.
+    '''
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._schemas = {}
+        self._tables = {}
+
+    def reset(self):
+        self._lock = threading.RLock()
+
+    def load_schema(self, name):
+        return self._schemas.get(name)
+
+    def save_schema(self, name, schema):
+        with self._lock:
+            self._schemas[name] = copy.deepcopy(schema)
+            self._tables[name] = {}
+
+    def replace_schema(self, name, schema):
+        with self._lock:
+            self._schemas[name] = copy.deepcopy(schema)
+
+    def drop(self, name):
+        with self._lock:
+            self._schemas.pop(name, None)
+            self._tables.pop(name, None)
+
+    def load(self, name, key):
+        item = self._tables[name].get(key)
+        return copy.deepcopy(item) if item is not None else None
+
+    def store(self, name, key, item):
+        with self._lock:
+            self._tables[name][key] = item
+
+    def remove(self, name, key):
+        with self._lock:
+            self._tables[name].pop(key, None)
+
+    def scan_items(self, name, start_key=None):
+        with self._lock:
+            entries = sorted(self._tables[name].items(), key=lambda entry: sort_key(entry[0]))
+        for (key, item) in entries:
+            if start_key is None or sort_key(key) > sort_key(start_key):
+                yield (key, copy.deepcopy(item))
+
+    def writing(self):
+        return self._lock
+
+
+class SQLiteBackend(Backend):
+    '''
+    Keeps each table in a SQLite file, so a small single-host deployment serves reads from local disk (usually
+    straight from the OS page cache) rather than over the network.  Each table's primary key is built from its
+    KeySchema, and items are stored as DynamoDB's typed JSON.
+
+    Every thread gets its own connection, opened again after a fork.  The file is in WAL mode, so readers carry on
+    while a write commits, and writes are serialized by SQLite's own lock, so several workers can share the file.
+    '''
+
+    affinities = {'S': 'TEXT', 'N': 'NUMERIC', 'B': 'BLOB'}
+
+    def __init__(self, filename, timeout=30):
+        self.filename = filename
+        self.timeout = timeout
+        self._local = threading.local()
+        self._pid = None
+        # name -> (schema as stored, parsed), so an unchanged schema isn't parsed again
+        self._schemas = {}
+
+    def reset(self):
+        self._local = threading.local()
+        self._pid = None
+
+    def connection(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            self._local = threading.local()
+            self._pid = pid
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.filename, timeout=self.timeout, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS apothecary_tables (name TEXT PRIMARY KEY, schema TEXT NOT NULL)')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def table_sql(name):
+        return '"{0}"'.format(('items_' + name).replace('"', '""'))
+
+    def load_schema(self, name):
+        # read every time, as another process may have updated or dropped the table; only the parsing is cached
+        row = self.connection().execute('SELECT schema FROM apothecary_tables WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        (text, schema) = self._schemas.get(name, (None, None))
+        if text != row[0]:
+            schema = json.loads(row[0])
+            self._schemas[name] = (row[0], schema)
+        return schema
+
+    def save_schema(self, name, schema):
+        types = { definition['AttributeName']: definition['AttributeType'] for definition in schema['AttributeDefinitions'] }
+        (hash_key, range_key) = key_names(schema)
+        columns = ['hash_key {0} NOT NULL'.format(self.affinities[types[hash_key]])]
+        primary_key = ['hash_key']
+        if range_key is not None:
+            columns.append('range_key {0} NOT NULL'.format(self.affinities[types[range_key]]))
+            primary_key.append('range_key')
+        connection = self.connection()
+        connection.execute('CREATE TABLE {0} ({1}, item TEXT NOT NULL, PRIMARY KEY ({2})) WITHOUT ROWID'.format(
+            self.table_sql(name), ', '.join(columns), ', '.join(primary_key)))
+        connection.execute('INSERT INTO apothecary_tables (name, schema) VALUES (?, ?)', (name, json.dumps(schema)))
+
+    def replace_schema(self, name, schema):
+        self.connection().execute('UPDATE apothecary_tables SET schema = ? WHERE name = ?', (json.dumps(schema), name))
+
+    def drop(self, name):
+        with self.writing():
+            self.connection().execute('DROP TABLE IF EXISTS {0}'.format(self.table_sql(name)))
+            self.connection().execute('DELETE FROM apothecary_tables WHERE name = ?', (name,))
+
+    def key_clause(self, key, operator='='):
+        parameters = [sql_value(part) for part in key if part is not None]
+        if len(parameters) == 1:
+            return ('hash_key {0} ?'.format(operator), parameters)
+        return ('(hash_key, range_key) {0} (?, ?)'.format(operator), parameters)
+
+    def load(self, name, key):
+        (clause, parameters) = self.key_clause(key)
+        row = self.connection().execute('SELECT item FROM {0} WHERE {1}'.format(self.table_sql(name), clause),
+                                        parameters).fetchone()
+        return load_item(row[0]) if row is not None else None
+
+    def store(self, name, key, item):
+        parameters = [sql_value(part) for part in key if part is not None]
+        self.connection().execute('INSERT OR REPLACE INTO {0} VALUES ({1}, ?)'.format(
+            self.table_sql(name), ', '.join('?' * len(parameters))), parameters + [dump_item(item)])
+
+    def remove(self, name, key):
+        (clause, parameters) = self.key_clause(key)
+        self.connection().execute('DELETE FROM {0} WHERE {1}'.format(self.table_sql(name), clause), parameters)
+
+    def scan_items(self, name, start_key=None):
+        schema = self.load_schema(name)
+        (hash_key, range_key) = key_names(schema)
+        order = 'hash_key, range_key' if range_key is not None else 'hash_key'
+        (clause, parameters) = self.key_clause(start_key, '>') if start_key is not None else ('1', [])
+        rows = self.connection().execute('SELECT item FROM {0} WHERE {1} ORDER BY {2}'.format(
+            self.table_sql(name), clause, order), parameters)
+        for (text,) in rows:
+            item = load_item(text)
+            yield (key_of(schema, item, 'Scan', exact=False), item)
+
+    @contextmanager
+    def writing(self):
+        connection = self.connection()
+        if connection.in_transaction:
+            yield
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+
+def sql_value(value):
+    if isinstance(value, Binary):
+        return bytes(value)
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def dump_item(item):
+    return json.dumps({ name: to_json(serializer.serialize(value)) for (name, value) in item.items() })
+
+
+def load_item(text):
+    return { name: deserializer.deserialize(from_json(value)) for (name, value) in json.loads(text).items() }
+
+
+def to_json(typed):
+    # typed JSON as DynamoDB's wire format has it, with binary values base64 encoded
+    ((kind, value),) = typed.items()
+    if kind == 'B':
+        value = base64.b64encode(value).decode('ascii')
+    elif kind == 'BS':
+        value = [base64.b64encode(element).decode('ascii') for element in value]
+    elif kind == 'M':
+        value = { name: to_json(element) for (name, element) in value.items() }
+    elif kind == 'L':
+        value = [to_json(element) for element in value]
+    return {kind: value}
+
+
+def from_json(typed):
+    ((kind, value),) = typed.items()
+    if kind == 'B':
+        value = base64.b64decode(value)
+    elif kind == 'BS':
+        value = [base64.b64decode(element) for element in value]
+    elif kind == 'M':
+        value = { name: from_json(element) for (name, element) in value.items() }
+    elif kind == 'L':
+        value = [from_json(element) for element in value]
+    return {kind: value}
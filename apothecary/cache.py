@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+# Every live cache, for reporting hit rates
+registry = weakref.WeakSet()
+
+
+class LocalCache(object):
+    '''
+    A process-local cache with per-entry TTL and LRU eviction.
+
+    get_or_load() is single-flight: when several threads miss on the same key at once, only the first calls the
+    loader and the rest wait for its result.  A load that an invalidate() or clear() overtakes isn't cached, as it
+    may have read what was invalidated.  A ttl of None means entries never expire (they can still be evicted).
+    '''
+
+    def __init__(self, name, ttl=60, max_entries=1024):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+        # counts invalidate() and clear() calls, so a load can tell whether one happened while it ran
+        self._invalidations = 0
+        registry.add(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def invalidations(self):
+        # a token for set(): subclasses may add to it
+        return self._invalidations
+
+    def set(self, key, value, invalidations=None):
+        '''
+        Cache value, unless invalidations (from invalidations() before value was loaded) is given and the cache has
+        been invalidated since.  Returns whether it was cached.
+        '''
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if invalidations is not None and invalidations != self._invalidations:
+                return False
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def get_or_load(self, key, loader):
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        with self._lock:
+            flight = self._loading.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._loading[key] = _Flight()
+                invalidations = self.invalidations()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+            self.set(key, flight.value, invalidations)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._loading.get(key) is flight:
+                    del self._loading[key]
+            flight.done.set()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            # later misses load afresh rather than wait for a load that started before
+            self._loading.pop(key, None)
+            self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._loading.clear()
+            self._invalidations += 1
+        logging.info('Cleared cache %s', self.name)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
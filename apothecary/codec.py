@@ -0,0 +1,139 @@
+'''
+Maps model objects to DynamoDB items and back, directly from each class's field declarations.
+
+Items keep the layout jsonpickle gave them, so everything already stored still loads and anything written here
+still loads with jsonpickle: each object is a map holding its fields plus a 'py/object' attribute naming its
+class.  Numbers load as int or float, as they did through jsonpickle.  Anything this codec doesn't know how to
+map (e.g. jsonpickle's py/id references, or a class that isn't a Record) goes through jsonpickle as before.
+'''
+
+import jsonpickle
+import simplejson as json
+from decimal import Decimal
+
+# 'py/object' name -> Record subclass
+record_classes = {}
+
+
+class Record(object):
+    '''
+    Base of the classes stored in DynamoDB, either as items (DAO) or nested in them (e.g. Nav, Section).  Each
+    subclass lists its attributes in fields and uses them as its __slots__:
+
+        class Nav(Record):
+            fields = ('nav_id', 'href', 'caption')
+            __slots__ = fields
+
+    Attributes a stored item has that aren't declared are kept, so they survive being loaded and put back.
+
+    Once an object has been loaded or saved, assigning to one of its fields marks that field dirty, so
+    DAO.update() can send just the changed ones.  Changing a list or dict in place isn't noticed; mark_dirty() it.
+    '''
+    __slots__ = ('_extra', '_dirty')
+    fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super(Record, cls).__init_subclass__(**kwargs)
+        cls.py_object = cls.__module__ + '.' + cls.__name__
+        record_classes[cls.py_object] = cls
+
+    def __getattr__(self, name):
+        # only reached when the attribute isn't set: look in the undeclared attributes loaded with the item
+        if name in Record.__slots__:
+            raise AttributeError(name)
+        extra = getattr(self, '_extra', None)
+        if extra is not None and name in extra:
+            return extra[name]
+        raise AttributeError("'{0}' object has no attribute '{1}'".format(type(self).__name__, name))
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in self.fields:
+            dirty = getattr(self, '_dirty', None)
+            if dirty is not None:
+                dirty.add(name)
+
+    def mark_dirty(self, *fields):
+        self._dirty = set(getattr(self, '_dirty', None) or ()) | set(fields)
+
+    def mark_clean(self, *fields):
+        # just those fields with any given, as after an update() of some of them
+        if not fields:
+            self._dirty = set()
+            return
+        self._dirty = set(self.dirty_fields()) - set(fields)
+
+    def dirty_fields(self):
+        # everything, for an object that's never been loaded or saved
+        dirty = getattr(self, '_dirty', None)
+        return sorted(dirty) if dirty is not None else [field for field in self.fields if hasattr(self, field)]
+
+    def as_dict(self):
+        attributes = { field: getattr(self, field) for field in self.fields if hasattr(self, field) }
+        attributes.update(getattr(self, '_extra', None) or {})
+        return attributes
+
+    def encode_item(self):
+        item = {'py/object': self.py_object}
+        for (field, value) in self.as_dict().items():
+            item[field] = encode_value(value)
+        return item
+
+    def __reduce__(self):
+        # pickled as the stored item, so an unpickled copy (e.g. from a shared cache) loads like one read from the table
+        return (decode_item, (self.encode_item(),))
+
+    @classmethod
+    def from_item(cls, item):
+        record = cls.__new__(cls)
+        extra = {}
+        for (name, value) in item.items():
+            if name in cls.fields:
+                object.__setattr__(record, name, decode_value(value))
+            elif name != 'py/object':
+                extra[name] = decode_value(value)
+        object.__setattr__(record, '_extra', extra or None)
+        object.__setattr__(record, '_dirty', set())
+        return record
+
+
+class NotDirect(Exception):
+    pass
+
+
+def encode_value(value):
+    if isinstance(value, Record):
+        return value.encode_item()
+    if isinstance(value, list):
+        return [encode_value(element) for element in value]
+    if isinstance(value, dict) and all(isinstance(key, str) for key in value):
+        return { key: encode_value(element) for (key, element) in value.items() }
+    if value is None or isinstance(value, (str, bool, int, Decimal)):
+        return value
+    if isinstance(value, float):
+        return Decimal(repr(value))
+    return json.loads(jsonpickle.encode(value), use_decimal=True)
+
+
+def decode_item(item):
+    try:
+        return decode_value(item)
+    except NotDirect:
+        return jsonpickle.decode(json.dumps(item, use_decimal=True))
+
+
+def decode_value(value):
+    if isinstance(value, dict):
+        record_class = record_classes.get(value.get('py/object'))
+        if record_class is not None:
+            return record_class.from_item(value)
+        if any(key.startswith('py/') for key in value):
+            raise NotDirect()
+        return { key: decode_value(element) for (key, element) in value.items() }
+    if isinstance(value, list):
+        return [decode_value(element) for element in value]
+    if isinstance(value, Decimal):
+        return int(value) if value.as_tuple().exponent == 0 else float(value)
+    if isinstance(value, set):
+        raise NotDirect()
+    return value
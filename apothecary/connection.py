@@ -0,0 +1,63 @@
+import logging
+import os
+import threading
+import boto3
+from boto3.resources.base import ServiceResource
+from botocore.config import Config
+
+
+class DynamoDBManager(object):
+    '''
+    Hands out boto3 DynamoDB resources built on one client per worker process, so the session, credential
+    resolution, endpoint and HTTP keep-alive pool are set up once and reused by every request the worker serves.
+    Clients are thread-safe but resources aren't, so each thread (request, fan-out, spool or change feed) gets a
+    resource of its own on that client.
+
+    The client is rebuilt on first use after a fork, so one created in the uWSGI master (e.g. while loading the
+    app) is never shared with the workers.
+    '''
+
+    def __init__(self, region_name=None, max_pool_connections=10):
+        self.region_name = region_name
+        self.max_pool_connections = max_pool_connections
+        self._lock = threading.Lock()
+        self._pid = None
+        self._resource = None
+        self._local = threading.local()
+
+    def resource(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    session = boto3.session.Session(region_name=self.region_name)
+                    self._resource = session.resource(
+                        'dynamodb',
+                        config=Config(max_pool_connections=self.max_pool_connections)
+                    )
+                    self._local = threading.local()
+                    self._pid = pid
+                    logging.info('Created DynamoDB resource for process %s', pid)
+        local = self._local
+        if getattr(local, 'resource', None) is None:
+            local.resource = thread_resource(self._resource)
+        return local.resource
+
+    def client(self):
+        return self.resource().meta.client
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._resource = None
+        self._local = threading.local()
+
+
+def thread_resource(dynamodb):
+    '''
+    A resource of its own for another thread, on dynamodb's client (and so its connection pool).  A local backend
+    (see backends.py) is thread-safe, so it's returned as is.
+    '''
+    if isinstance(dynamodb, ServiceResource):
+        return dynamodb.__class__(client=dynamodb.meta.client)
+    return dynamodb
@@ -0,0 +1,113 @@
+'''
+Streams DAO objects (e.g. straight from DAO.scan) to CSV, gzipped CSV or Parquet, a row at a time, so exporting
+a table takes the same memory however big it is.
+
+    columns = export.columns(model.RSVP, ['rsvp_id', 'guests', 'meal_preference'])
+    export.export(model.RSVP.scan(dynamodb), columns, 'rsvps.csv.gz', 'csv.gz')
+
+Parquet needs pyarrow, which is only imported when it's asked for.
+'''
+
+import csv
+import gzip
+import io
+import sys
+import simplejson as json
+
+FORMATS = ('csv', 'csv.gz', 'parquet')
+# Rows buffered per Parquet row group
+PARQUET_BATCH_ROWS = 4096
+# Written for a column the object doesn't have, as DAO.dump_csv does
+MISSING = 'N/A'
+
+
+def columns(dao_class, names=None):
+    '''
+    The columns to export: names if given, checked against the class's fields, otherwise every field with the key
+    attributes first and the rest in alphabetical order (the layout of DAO.dump_csv).
+    '''
+    if names:
+        unknown = [name for name in names if name not in dao_class.fields]
+        if unknown:
+            raise ValueError('{0} has no field {1}'.format(dao_class.__name__, ', '.join(unknown)))
+        return list(names)
+    keys = [key['AttributeName'] for key in sorted(dao_class.schema['KeySchema'], key=lambda key: key['KeyType'])]
+    return keys + sorted(field for field in dao_class.fields if field not in keys)
+
+
+def cell(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, use_decimal=True, default=str)
+    return str(value)
+
+
+def rows(records, column_names):
+    for record in records:
+        yield [cell(getattr(record, name, MISSING)) for name in column_names]
+
+
+def export(records, column_names, output='-', format='csv'):
+    '''
+    Write records to output, a filename or '-' for stdout, in format (one of FORMATS).  Returns the number of rows.
+    '''
+    if format not in FORMATS:
+        raise ValueError('Unknown export format {0}; expected one of {1}'.format(format, ', '.join(FORMATS)))
+    if format == 'parquet':
+        return write_parquet(records, column_names, output)
+
+    binary = open(output, 'wb') if output != '-' else sys.stdout.buffer
+    try:
+        if format == 'csv.gz':
+            with gzip.GzipFile(fileobj=binary, mode='wb') as compressed:
+                return write_csv(records, column_names, compressed)
+        return write_csv(records, column_names, binary)
+    finally:
+        if output != '-':
+            binary.close()
+        else:
+            binary.flush()
+
+
+def write_csv(records, column_names, binary):
+    text = io.TextIOWrapper(binary, encoding='utf-8', newline='', write_through=True)
+    try:
+        writer = csv.writer(text, quoting=csv.QUOTE_ALL)
+        writer.writerow(column_names)
+        count = 0
+        for row in rows(records, column_names):
+            writer.writerow(row)
+            count += 1
+        return count
+    finally:
+        # leave the underlying stream open for the caller
+        text.detach()
+
+
+def write_parquet(records, column_names, output):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('Exporting Parquet needs pyarrow: pip install pyarrow')
+
+    # every column is a string, as in the CSV, so the schema is fixed before the first row
+    schema = pyarrow.schema([(name, pyarrow.string()) for name in column_names])
+    sink = output if output != '-' else sys.stdout.buffer
+    count = 0
+    with pyarrow.parquet.ParquetWriter(sink, schema, compression='snappy') as writer:
+        batch = []
+        for row in rows(records, column_names):
+            batch.append(row)
+            if len(batch) >= PARQUET_BATCH_ROWS:
+                writer.write_table(parquet_table(pyarrow, schema, column_names, batch))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(parquet_table(pyarrow, schema, column_names, batch))
+            count += len(batch)
+    return count
+
+
+def parquet_table(pyarrow, schema, column_names, batch):
+    return pyarrow.Table.from_arrays([pyarrow.array([row[index] for row in batch], type=pyarrow.string())
+                                      for index in range(len(column_names))], schema=schema)
@@ -0,0 +1,59 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import metrics
+
+
+class FanOut(object):
+    '''
+    Runs independent reads (e.g. a SectionGroup get and the AccommodationGroup get) in parallel, so a page waits for its
+    slowest read rather than the sum of them.
+
+    The thread pool is created per process on first use, so it's never inherited across a uWSGI fork.  The calls run
+    outside the request context: bind anything they need from g to a local first, except g.dynamodb, which (like any
+    boto3 resource) mustn't be shared between threads; take one from dynamodb_manager.resource() in the call.
+    '''
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+    def executor(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                    self._pid = pid
+        return self._executor
+
+    def run(self, *calls):
+        '''
+        Call each zero-argument callable concurrently and return their results in order.  The first exception raised
+        by any of them is re-raised once they've all finished.
+        '''
+        if len(calls) < 2 or not self.max_workers:
+            return [call() for call in calls]
+        route = metrics.route()
+        futures = [self.executor().submit(with_route, route, call) for call in calls]
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+        return [future.result() for future in futures]
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+
+def with_route(route, call):
+    # so DynamoDB metrics from the pool are still attributed to the request's route
+    metrics.set_route(route)
+    try:
+        return call()
+    finally:
+        metrics.set_route(None)
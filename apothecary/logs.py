@@ -0,0 +1,78 @@
+import atexit
+import copy
+import logging
+import os
+import queue
+import threading
+import simplejson as json
+from logging.handlers import QueueHandler, QueueListener
+
+
+class JsonFormatter(logging.Formatter):
+    '''
+    Formats each record as one JSON object per line, so the log can be filtered and aggregated without regexes.
+    '''
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'path': record.pathname,
+            'function': record.funcName,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+traceback_formatter = logging.Formatter()
+
+
+class BackgroundHandler(QueueHandler):
+    '''
+    Hands records to a queue and returns immediately; a listener thread writes them out through the wrapped handlers,
+    so a slow disk never stalls the thread that logged.
+
+    The queue and listener are created per process on first use, so records logged in the uWSGI master before a
+    fork aren't written twice and each worker gets its own writer thread.
+    '''
+
+    def __init__(self, *handlers):
+        super(BackgroundHandler, self).__init__(None)
+        self.target_handlers = handlers
+        self._lock = threading.Lock()
+        self._pid = None
+        self._listener = None
+
+    def enqueue(self, record):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self.queue = queue.Queue(-1)
+                    self._listener = QueueListener(self.queue, *self.target_handlers, respect_handler_level=True)
+                    self._listener.start()
+                    self._pid = pid
+                    atexit.register(self._listener.stop)
+        super(BackgroundHandler, self).enqueue(record)
+
+    def prepare(self, record):
+        # the message is merged now, since its args could change once this returns, but the traceback is kept apart
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._pid = None
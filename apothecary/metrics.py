@@ -0,0 +1,131 @@
+import os
+import threading
+import botocore.exceptions
+from . import cache
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+READ_OPERATIONS = ('GetItem', 'BatchGetItem', 'Scan', 'Query')
+THROTTLING_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+
+
+class Metrics(object):
+    '''
+    In-process counters and latency histograms, rendered in the Prometheus text format.  Each uWSGI worker keeps its
+    own, so a scrape of /metrics sees the worker that served it; every sample is labelled with that worker's pid, so
+    each worker's counters are a series of their own rather than one that jumps between workers.  Sum over workers
+    after taking rates, e.g. sum without (worker) (rate(apothecary_dynamodb_calls_total[5m])).
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.counters = {}
+        self.histograms = {}
+        self.descriptions = {}
+
+    def describe(self, name, description):
+        self.descriptions[name] = description
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(LATENCY_BUCKETS), 'sum': 0.0, 'count': 0}
+            for (index, bound) in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][index] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+    def reset(self):
+        # a forked worker starts its own series from zero, rather than carrying on the master's counts
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.counters = {}
+        self.histograms = {}
+
+    def set_route(self, route):
+        self._local.route = route
+
+    def route(self):
+        return getattr(self._local, 'route', None) or 'none'
+
+    def record_dynamodb(self, operation, table_name, seconds, from_dynamo=None, error=None):
+        labels = {'table': table_name, 'operation': operation, 'route': self.route()}
+        self.inc('apothecary_dynamodb_calls_total', labels)
+        self.observe('apothecary_dynamodb_latency_seconds', labels, seconds)
+        if error is not None:
+            code = error.response.get('Error', {}).get('Code') if isinstance(error, botocore.exceptions.ClientError) else None
+            self.inc('apothecary_dynamodb_errors_total', labels)
+            if code in THROTTLING_ERRORS:
+                self.inc('apothecary_dynamodb_throttles_total', labels)
+            return
+
+        consumed = (from_dynamo or {}).get('ConsumedCapacity') or []
+        capacity_name = 'apothecary_dynamodb_consumed_rcu_total' if operation in READ_OPERATIONS \
+            else 'apothecary_dynamodb_consumed_wcu_total'
+        for capacity in (consumed if isinstance(consumed, list) else [consumed]):
+            capacity_labels = dict(labels, table=capacity.get('TableName', table_name))
+            self.inc(capacity_name, capacity_labels, float(capacity.get('CapacityUnits', 0)))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        for (name, metric_type, samples) in self.grouped(counters, histograms):
+            if name in self.descriptions:
+                lines.append('# HELP {0} {1}'.format(name, self.descriptions[name]))
+            lines.append('# TYPE {0} {1}'.format(name, metric_type))
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    def grouped(self, counters, histograms):
+        worker = (('worker', str(os.getpid())),)
+        groups = {}
+        for ((name, labels), value) in counters:
+            labels = worker + labels
+            groups.setdefault((name, 'counter'), []).append(sample(name, labels, value))
+        for ((name, labels), histogram) in histograms:
+            labels = worker + labels
+            samples = groups.setdefault((name, 'histogram'), [])
+            for (bound, count) in zip(LATENCY_BUCKETS, histogram['buckets']):
+                samples.append(sample(name + '_bucket', labels + (('le', repr(bound)),), count))
+            samples.append(sample(name + '_bucket', labels + (('le', '+Inf'),), histogram['count']))
+            samples.append(sample(name + '_sum', labels, histogram['sum']))
+            samples.append(sample(name + '_count', labels, histogram['count']))
+        for local_cache in sorted(cache.registry, key=lambda c: c.name):
+            labels = worker + (('cache', local_cache.name),)
+            groups.setdefault(('apothecary_cache_hits_total', 'counter'), []).append(
+                sample('apothecary_cache_hits_total', labels, local_cache.hits))
+            groups.setdefault(('apothecary_cache_misses_total', 'counter'), []).append(
+                sample('apothecary_cache_misses_total', labels, local_cache.misses))
+            groups.setdefault(('apothecary_cache_entries', 'gauge'), []).append(
+                sample('apothecary_cache_entries', labels, len(local_cache)))
+        return [(name, metric_type, samples) for ((name, metric_type), samples) in sorted(groups.items())]
+
+
+def sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join(['{0}="{1}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for (k, v) in labels]) + '}'
+    return '{0} {1}'.format(name, value)
+
+
+metrics = Metrics()
+metrics.describe('apothecary_dynamodb_calls_total', 'DynamoDB API calls by table, operation and route.')
+metrics.describe('apothecary_dynamodb_latency_seconds', 'DynamoDB API call latency.')
+metrics.describe('apothecary_dynamodb_errors_total', 'DynamoDB API calls that raised an error.')
+metrics.describe('apothecary_dynamodb_throttles_total', 'DynamoDB API calls rejected for exceeding throughput.')
+metrics.describe('apothecary_dynamodb_consumed_rcu_total', 'Read capacity units consumed.')
+metrics.describe('apothecary_dynamodb_consumed_wcu_total', 'Write capacity units consumed.')
+metrics.describe('apothecary_request_latency_seconds', 'HTTP request latency by route.')
+metrics.describe('apothecary_cache_hits_total', 'Cache lookups that found a live entry.')
+metrics.describe('apothecary_cache_misses_total', 'Cache lookups that found nothing or an expired entry.')
+metrics.describe('apothecary_cache_entries', 'Entries currently held by a cache.')
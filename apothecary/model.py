@@ -1,29 +1,36 @@
-#!/usr/bin/env python
 """
-Usage:
-  model.py [options]
-
-Utility for setting up data model in persistent storage (currently DynamoDB)
-
-Options:
-  --fresh-tables            Recreate fresh tables.  Will blow away any existing data.
-  --fresh-data              Add all of the data from setup.
-  -p --prefix <prefix>      Prefix table names.  Useful for dev environments.
-
+The data model: DAO classes over DynamoDB tables (or a local backend, see backends.py), and setup() to create the
+tables and seed them.  Run setup() with setup_tables.py.
 """
 
 import jsonpickle
-import simplejson as json
+import copy
+import functools
 import logging
 import re
+import time
 import boto3
 import botocore.exceptions
-from boto3.dynamodb.conditions import Attr
-from docopt import docopt
+from boto3.dynamodb.conditions import Attr, Key
+from boto3.dynamodb.types import TypeSerializer
 from decimal import Decimal
+from .cache import LocalCache
+from .codec import Record, decode_item, decode_value, encode_value
+from .connection import thread_resource
+from .metrics import metrics
+from .parallelscan import CapacityBudget, merge_segments
+from .sharedcache import TieredCache, serializers
+
+# Content tables publish the keys of every item written, which streams.py turns into cache invalidations
+CONTENT_STREAM = {
+    'StreamEnabled': True,
+    'StreamViewType': 'KEYS_ONLY'
+}
 
 
-class DAO(object):
+class DAO(Record):
+    __slots__ = ()
+
     schema = {
         'AttributeDefinitions': [
             {
@@ -86,10 +93,52 @@ class DAO(object):
         }
     }
 
+    # Opt-in read-through cache for get() and unfiltered scan().  See enable_cache()
+    cache = None
+    # Whether puts may be batched (see spool.py), i.e. put() does nothing more than write the item: no after_write()
+    batch_put = True
+
     @classmethod
     def create_table(cls, client):
         client.create_table(**cls.schema)
 
+    @classmethod
+    def ensure_indexes(cls, client):
+        '''
+        Add any global secondary index in the schema that the existing table doesn't have yet.  DynamoDB builds it
+        from the items already in the table in the background; queries on it fail until it's ACTIVE.  A missing
+        local secondary index can only be added by recreating the table.
+        '''
+        table = client.describe_table(TableName=cls.schema['TableName'])['Table']
+        existing = set(index['IndexName'] for index
+                       in table.get('GlobalSecondaryIndexes', []) + table.get('LocalSecondaryIndexes', []))
+        for index in cls.schema.get('LocalSecondaryIndexes', []):
+            if index['IndexName'] not in existing:
+                logging.warning('Table for %s has no local secondary index %s; recreate it (--fresh-tables) to add one',
+                                cls, index['IndexName'])
+        for index in cls.schema.get('GlobalSecondaryIndexes', []):
+            if index['IndexName'] not in existing:
+                client.update_table(TableName=cls.schema['TableName'],
+                                    AttributeDefinitions=cls.schema['AttributeDefinitions'],
+                                    GlobalSecondaryIndexUpdates=[{'Create': index}])
+                logging.info('Creating index %s for %s', index['IndexName'], cls)
+                # DynamoDB builds one new index per table at a time; setup() again adds the next
+                return
+
+    @classmethod
+    def ensure_stream(cls, client):
+        '''
+        Turn on the schema's stream for an existing table that doesn't have it yet.
+        '''
+        stream = cls.schema.get('StreamSpecification')
+        if not stream or not stream['StreamEnabled']:
+            return
+        table = client.describe_table(TableName=cls.schema['TableName'])['Table']
+        if table.get('StreamSpecification', {}).get('StreamEnabled'):
+            return
+        client.update_table(TableName=cls.schema['TableName'], StreamSpecification=stream)
+        logging.info('Enabled stream for %s', cls)
+
     @classmethod
     def delete_table(cls, dynamodb):
         cls.table(dynamodb).delete()
@@ -125,32 +174,165 @@ class DAO(object):
         return keys
 
     @classmethod
-    def get(cls, dynamodb, hash_key, range_key=None):
+    def key_dict(cls, hash_key, range_key=None):
         keys = { cls.get_hash_key_name(): hash_key }
-        if range_key and cls.get_range_key_schema():
+        if range_key is not None and cls.get_range_key_schema():
             keys[cls.get_range_key_name()] = range_key
+        return keys
 
-        from_dynamo = cls.table(dynamodb).get_item(
-            Key=keys,
+    @classmethod
+    def item_identity(cls, item):
+        range_key = item.get(cls.get_range_key_name()) if cls.get_range_key_schema() else None
+        return (cls.schema['TableName'], item[cls.get_hash_key_name()], range_key)
+
+    @classmethod
+    def enable_cache(cls, ttl=60, max_entries=1024, store=None, serializer=None, local_ttl=5):
+        '''
+        Cache get() and unfiltered scan() results for ttl seconds, in this process or, given a store (see
+        sharedcache.py), in a cache shared by every process on the host with each keeping its own copies for
+        local_ttl seconds.  serializer is how objects are kept in the store (pickle by default).
+        '''
+        if store is None:
+            cls.cache = LocalCache(cls.__name__, ttl=ttl, max_entries=max_entries)
+        else:
+            cls.cache = TieredCache(cls.__name__, store, serializer or serializers['pickle'], ttl=ttl,
+                                    local_ttl=local_ttl, max_entries=max_entries, namespace=cls.schema['TableName'])
+
+    @classmethod
+    def disable_cache(cls):
+        cls.cache = None
+
+    @classmethod
+    def cache_key(cls, hash_key, range_key=None):
+        if not cls.get_range_key_schema():
+            range_key = None
+        return ('get', hash_key, range_key)
+
+    @classmethod
+    def invalidate_cached(cls, keys=None):
+        '''
+        Drop the cached copy of the item with keys (a dict, as from get_keys()) and the cached scan, or with keys None
+        everything cached for the class.
+        '''
+        if cls.cache is None:
+            return
+        if keys is None:
+            cls.cache.clear()
+            return
+        range_key = keys.get(cls.get_range_key_name()) if cls.get_range_key_schema() else None
+        cls.cache.invalidate(cls.cache_key(keys[cls.get_hash_key_name()], range_key))
+        cls.cache.invalidate(('scan',))
+
+    def changed(self):
+        notify_changed(self.__class__, self.get_keys())
+
+    @classmethod
+    def get(cls, dynamodb, hash_key, range_key=None):
+        if cls.cache is None:
+            return cls._get(dynamodb, hash_key, range_key)
+        return cls.cache.get_or_load(cls.cache_key(hash_key, range_key),
+                                     lambda: cls._get(dynamodb, hash_key, range_key))
+
+    @classmethod
+    def _get(cls, dynamodb, hash_key, range_key=None):
+        from_dynamo = call_dynamo('GetItem', cls.schema['TableName'], cls.table(dynamodb).get_item,
+            Key=cls.key_dict(hash_key, range_key),
             ReturnConsumedCapacity='INDEXES'
         )
-        logging.info('DynamoDB consumed capacity from GetItem: %s', from_dynamo['ConsumedCapacity'])
 
-        return jsonpickle.decode(json.dumps(from_dynamo['Item'], use_decimal=True))
+        return cls.decode_item(from_dynamo['Item'])
+
+    @classmethod
+    def batch_get(cls, dynamodb, keys):
+        '''
+        Fetch several items of this class with BatchGetItem.  keys is a list of hash keys, or (hash, range) tuples.
+        Returns the decoded objects in the same order, with None for items that don't exist.
+        '''
+        return batch_get_many(dynamodb, [(cls,) + (key if isinstance(key, tuple) else (key,)) for key in keys])
+
+    @staticmethod
+    def decode_item(item):
+        return decode_item(item)
+
+    @classmethod
+    def scan(cls, dynamodb, segments=1, ordered=False, capacity_per_second=None, prefetch=4, **kwargs):
+        '''
+        Iterate over the table's items, decoded.  kwargs are passed on to Scan, e.g. FilterExpression.
+
+        segments > 1 scans that many Segments of the table at once, each in its own thread and at most prefetch
+        pages ahead of the caller.  Items arrive as the segments produce them, or segment by segment with
+        ordered=True.  capacity_per_second caps the read capacity units the whole scan consumes per second.
+        '''
+        budget = CapacityBudget(capacity_per_second) if capacity_per_second else None
+        if segments > 1:
+            # a resource per segment's thread, see connection.thread_resource
+            return merge_segments([functools.partial(cls._pages, thread_resource(dynamodb), 'Scan', budget,
+                                                     Segment=segment, TotalSegments=segments, **kwargs)
+                                   for segment in range(segments)],
+                                  prefetch=prefetch, ordered=ordered)
+        # only the plain full-table scan is cached; filtered or paged scans always go to the table
+        if cls.cache is None or kwargs or budget is not None:
+            return cls._items(dynamodb, 'Scan', budget, **kwargs)
+        return iter(cls.cache.get_or_load(('scan',), lambda: list(cls._items(dynamodb, 'Scan'))))
 
     @classmethod
-    def scan(cls, dynamodb, **kwargs):
+    def query(cls, dynamodb, key_condition, index_name=None, projection=None, capacity_per_second=None, **kwargs):
+        '''
+        Iterate over the items matching key_condition, a boto3.dynamodb.conditions Key expression on the table's
+        keys or, with index_name, on that secondary index's, decoded.  kwargs are passed on to Query, e.g.
+        FilterExpression, ScanIndexForward=False or Limit (items per page; every page is read).
+
+        projection lists the fields to read, so the objects come back with just those.  capacity_per_second caps
+        the read capacity units the query consumes per second, as for scan().
+        '''
+        kwargs['KeyConditionExpression'] = key_condition
+        if index_name is not None:
+            kwargs['IndexName'] = index_name
+        if projection:
+            kwargs.update(projection_request(projection))
+        budget = CapacityBudget(capacity_per_second) if capacity_per_second else None
+        return cls._items(dynamodb, 'Query', budget, **kwargs)
+
+    @classmethod
+    def scan_steps(cls, **kwargs):
+        '''
+        Steps (see run_steps) reading every item of the table, returning them decoded.
+        '''
+        kwargs.setdefault('ReturnConsumedCapacity', 'INDEXES')
+        items = []
+        while True:
+            from_dynamo = yield ('Scan', cls, dict(kwargs))
+            items.extend(cls.decode_item(item) for item in from_dynamo.get('Items', []))
+            if not from_dynamo.get('LastEvaluatedKey'):
+                return items
+            kwargs['ExclusiveStartKey'] = from_dynamo['LastEvaluatedKey']
+
+    @classmethod
+    def _items(cls, dynamodb, operation, budget=None, **kwargs):
+        for page in cls._pages(dynamodb, operation, budget, **kwargs):
+            for unpickled in page:
+                yield unpickled
+
+    @classmethod
+    def _pages(cls, dynamodb, operation, budget=None, **kwargs):
+        '''
+        Yield each page of a Scan or Query (operation) as a list of decoded items.
+        '''
         table = cls.table(dynamodb)
+        read = table.scan if operation == 'Scan' else table.query
+        kwargs.setdefault('ReturnConsumedCapacity', 'INDEXES')
         while True:
-            from_dynamo = table.scan(**kwargs)
+            from_dynamo = call_dynamo(operation, cls.schema['TableName'], read, **kwargs)
+            if budget is not None:
+                budget.consume(from_dynamo)
             last_key = from_dynamo.get('LastEvaluatedKey')
+            page = []
             for item in from_dynamo.get('Items'):
-                logging.debug('loaded: {0}'.format(item))
-                dumped = json.dumps(item, use_decimal=True)
-                logging.debug('dumped: {0}'.format(dumped))
-                unpickled = jsonpickle.decode(dumped)
-                logging.debug('unpickled: {0}'.format(unpickled))
-                yield unpickled
+                logging.debug('loaded: %s', item)
+                unpickled = cls.decode_item(item)
+                logging.debug('unpickled: %s', unpickled)
+                page.append(unpickled)
+            yield page
             if not last_key:
                 break
             else:
@@ -160,56 +342,181 @@ class DAO(object):
     def table(cls, dynamodb):
         return dynamodb.Table(cls.schema['TableName'])
 
-    def put(self, dynamodb):
-        logging.debug('self: {0}'.format(self))
-        pickled = jsonpickle.encode(self)
-        logging.debug('pickled: {0}'.format(pickled))
-        re_jsoned = json.loads(pickled, use_decimal=True)
-        logging.debug('re-jsoned: {0}'.format(re_jsoned))
-        from_dynamo = self.table(dynamodb).put_item(
-            Item=re_jsoned,
+    def put(self, dynamodb, condition=None, return_values='NONE'):
+        '''
+        Write the whole item.  condition is a boto3.dynamodb.conditions expression the stored item has to meet, as
+        for update().  Returns the Attributes DynamoDB sends back for return_values ('ALL_OLD'), decoded.
+        '''
+        return run_steps(dynamodb, self.put_steps(condition, return_values))
+
+    def put_steps(self, condition=None, return_values='NONE'):
+        # put(), as steps (see run_steps) so aio.put runs the same ones
+        request = {}
+        if condition is not None:
+            request['ConditionExpression'] = condition
+        from_dynamo = yield ('PutItem', type(self), dict(request,
+            Item=self.encode_item(),
+            # the item it replaces, for after_write()
+            ReturnValues=return_values if self.batch_put else 'ALL_OLD',
             ReturnConsumedCapacity='INDEXES'
-        )
-        logging.info('DynamoDB consumed capacity from PutItem: %s', from_dynamo['ConsumedCapacity'])
+        ))
+        self.mark_clean()
+        self.changed()
+        old = decode_attributes(from_dynamo)
+        yield from self.after_write(old, self.as_dict())
+        return old if return_values == 'ALL_OLD' else {}
+
+    def after_write(self, old, new):
+        '''
+        Steps (see run_steps) that keep anything derived from this table in step once put(), update() or delete() has
+        changed an item from old to new, dicts of its attributes (empty or None when there wasn't or isn't one).  A
+        class that has some sets batch_put = False, so its writes fetch the old item.
+        '''
+        return iter(())
 
     @staticmethod
     def format_for_dynamo(item):
         '''
-        TODO: implement this as a function that takes an item, and converts it into the DynamoDB representation.
-        For example, "hello" would become {"S": "hello"}, 2.6 would become {"N": "2.6"}, ["foo", "bar"] would
-        become {"SS": ["foo", "bar"]}, and so forth.
+        Convert a value to its DynamoDB AttributeValue, for use with the low-level client.  For example, "hello"
+        becomes {"S": "hello"}, 2.6 becomes {"N": "2.6"}, ["foo", "bar"] becomes {"L": [{"S": "foo"}, {"S": "bar"}]}
+        and a model object becomes an {"M": ...} of its fields and 'py/object', the same as put() stores them.
 
         See http://docs.aws.amazon.com/amazondynamodb/latest/APIReference/API_AttributeValue.html
         '''
-        pass
+        return type_serializer.serialize(encode_value(item))
 
-    def update(self, dynamodb, fields):
-        keys = self.get_keys()
-        update_expression = 'SET ' + ' , '.join(['{0} = :{0}'.format(field) for field in fields])
-        expression_values = { ':{0}'.format(field) : self.format_for_dynamo(getattr(self, field)) for field in fields }
+    def update(self, dynamodb, fields=None, condition=None, add=None, return_values='NONE'):
+        '''
+        Write some of this item's attributes, rather than the whole item as put() does.
 
-        from_dynamo = self.table(dynamodb).update_item(
-            Key=keys,
-            UpdateExpression=update_expression,
-            ExpressionAttributeValues=expression_values,
-            ReturnConsumedCapacity='INDEXES'
-        )
-        logging.info('DynamoDB consumed capacity from UpdateItem: %s', from_dynamo['ConsumedCapacity'])
+        fields defaults to the ones assigned since the object was loaded or saved, or all but the key attributes for one
+        that hasn't been; naming a key attribute is a ValueError.  Each is an attribute name or a document path into
+        one, e.g. 'sections[2]' or 'meal_preference.Beef', to rewrite just that part.  condition is a
+        boto3.dynamodb.conditions expression the stored item has to meet, or the update fails with
+        ConditionalCheckFailedException.  add maps attributes to amounts DynamoDB adds to them atomically (e.g.
+        {'guests': 1}); the new totals are set on this object.  As with put(), the class's after_write() follows.
 
-    def delete(self, dynamodb):
+        Returns the Attributes DynamoDB sends back for return_values (e.g. 'UPDATED_OLD'), decoded.
+        '''
+        return run_steps(dynamodb, self.update_steps(fields, condition, add, return_values))
+
+    def update_steps(self, fields=None, condition=None, add=None, return_values='NONE'):
+        # update(), as steps (see run_steps) so aio.update runs the same ones
+        written = fields if fields is not None else self.update_fields()
+        request = self.update_request(written, condition, add, return_values)
+        return_values = request['ReturnValues']
+        if not self.batch_put:
+            # the item it changes, for after_write()
+            request['ReturnValues'] = 'ALL_OLD'
+        from_dynamo = yield ('UpdateItem', type(self), request)
+        attributes = decode_attributes(from_dynamo)
+        if not self.batch_put:
+            old = attributes
+            new = self.after_update(old, written, add)
+            updated = set(field_path(field)[0] for field in list(written) + list(add or ()))
+            attributes = {
+                'NONE': {},
+                'ALL_OLD': old,
+                'ALL_NEW': new,
+                'UPDATED_OLD': { name: value for (name, value) in old.items() if name in updated },
+                'UPDATED_NEW': { name: value for (name, value) in new.items() if name in updated }
+            }[return_values]
+        if add and return_values in ('UPDATED_NEW', 'ALL_NEW'):
+            for field in add:
+                if field in attributes:
+                    object.__setattr__(self, field, attributes[field])
+        if fields is None:
+            self.mark_clean()
+        else:
+            # fields assigned but not written here stay dirty for the next update()
+            self.mark_clean(*set(field_path(field)[0] for field in fields))
+        self.changed()
+        if not self.batch_put:
+            yield from self.after_write(old, new)
+        return attributes
+
+    def after_update(self, old, fields, add=None):
+        '''
+        The attributes an update() of fields (and add) leaves the item with, given old, the ones it had before.
+        '''
+        new = dict(copy.deepcopy(old), **self.get_keys())
+        for field in fields:
+            path = field_path(field)
+            assign_path(new, path, copy.deepcopy(resolve_path(self, path)))
+        for (field, amount) in (add or {}).items():
+            path = field_path(field)
+            try:
+                current = resolve_path(new, path)
+            except (KeyError, IndexError):
+                current = None
+            if current is None:
+                assign_path(new, path, amount)
+            else:
+                assign_path(new, path, current | amount if isinstance(current, set) else current + amount)
+        return new
+
+    def update_fields(self):
+        # the key is what's being written to, so it's never among the defaults
         keys = self.get_keys()
-        from_dynamo = self.table(dynamodb).delete_item(
-            Key=keys,
-            ReturnConsumedCapacity='INDEXES'
-        )
-        logging.info('DynamoDB consumed capacity from DeleteItem: %s', from_dynamo['ConsumedCapacity'])
+        return [field for field in self.dirty_fields() if field not in keys]
+
+    def update_request(self, fields=None, condition=None, add=None, return_values='NONE'):
+        if fields is None:
+            fields = self.update_fields()
+        keys = self.get_keys()
+        names = {'#py': 'py/object'}
+        values = {':py_object': self.py_object}
+        # py/object too, so an update that creates the item still loads as this class
+        sets = ['#py = :py_object']
+        for (index, field) in enumerate(fields):
+            path = field_path(field)
+            if path[0] in keys:
+                raise ValueError('Can\'t update key attribute {0}; put() the item instead'.format(path[0]))
+            sets.append('{0} = :v{1}'.format(path_expression(path, names), index))
+            values[':v{0}'.format(index)] = encode_value(resolve_path(self, path))
+        update_expression = 'SET ' + ' , '.join(sets)
+
+        if add:
+            adds = []
+            for (index, (field, amount)) in enumerate(sorted(add.items(), key=lambda entry: str(entry[0]))):
+                adds.append('{0} :a{1}'.format(path_expression(field_path(field), names), index))
+                values[':a{0}'.format(index)] = encode_value(amount)
+            update_expression += ' ADD ' + ' , '.join(adds)
+            if return_values == 'NONE':
+                return_values = 'UPDATED_NEW'
+
+        request = {
+            'Key': keys,
+            'UpdateExpression': update_expression,
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values,
+            'ReturnValues': return_values,
+            'ReturnConsumedCapacity': 'INDEXES'
+        }
+        if condition is not None:
+            request['ConditionExpression'] = condition
+        return request
+
+    def delete(self, dynamodb, return_values='NONE'):
+        return run_steps(dynamodb, self.delete_steps(return_values))
+
+    def delete_steps(self, return_values='NONE'):
+        from_dynamo = yield ('DeleteItem', type(self), {
+            'Key': self.get_keys(),
+            'ReturnValues': return_values if self.batch_put else 'ALL_OLD',
+            'ReturnConsumedCapacity': 'INDEXES'
+        })
+        self.changed()
+        old = decode_attributes(from_dynamo)
+        yield from self.after_write(old, None)
+        return old if return_values == 'ALL_OLD' else {}
 
     @staticmethod
     def quotes_csv(values):
         return ','.join(['"{0}"'.format(v) for v in values])
 
     def field_names(self):
-        field_names = sorted([field for field in vars(self)])
+        field_names = sorted(self.as_dict())
         hash_key = self.get_hash_key_name()
         field_names.remove(hash_key)
         field_names.insert(0, hash_key)
@@ -220,7 +527,7 @@ class DAO(object):
         return field_names
 
     def module_name(self):
-        return '.'.join([self.__module__, self.__class__.__name__])
+        return self.py_object
 
     def dump_csv_header(self, ref_obj=None):
         if not ref_obj:
@@ -233,10 +540,13 @@ class DAO(object):
         return DAO.quotes_csv([getattr(self, field, non_null(None)) for field in ref_obj.field_names()])
 
     def __str__(self):
-        return self.__dict__.__str__()
+        return self.as_dict().__str__()
 
 
 class NavGroup(DAO):
+    fields = ('nav_group_id', 'navs')
+    __slots__ = fields
+
     schema = {
         'AttributeDefinitions': [
             {
@@ -254,7 +564,8 @@ class NavGroup(DAO):
         'ProvisionedThroughput': {
             'ReadCapacityUnits': 2,
             'WriteCapacityUnits': 1
-        }
+        },
+        'StreamSpecification': CONTENT_STREAM
     }
 
     def __init__(self, nav_group_id):
@@ -262,7 +573,10 @@ class NavGroup(DAO):
         self.navs = []
 
 
-class Nav(object):
+class Nav(Record):
+    fields = ('nav_id', 'href', 'caption')
+    __slots__ = fields
+
     def __init__(self, nav_id, href, caption):
         self.nav_id = nav_id
         self.href = href
@@ -270,6 +584,9 @@ class Nav(object):
 
 
 class SectionGroup(DAO):
+    fields = ('section_group_id', 'sections')
+    __slots__ = fields
+
     schema = {
         'AttributeDefinitions': [
             {
@@ -287,7 +604,8 @@ class SectionGroup(DAO):
         'ProvisionedThroughput': {
             'ReadCapacityUnits': 2,
             'WriteCapacityUnits': 1
-        }
+        },
+        'StreamSpecification': CONTENT_STREAM
     }
 
     def __init__(self, section_group_id):
@@ -295,7 +613,10 @@ class SectionGroup(DAO):
         self.sections = []
 
 
-class Section(object):
+class Section(Record):
+    fields = ('section_id', 'title', 'text')
+    __slots__ = fields
+
     def __init__(self, section_id, title, text):
         self.section_id = section_id
         self.title = title
@@ -303,6 +624,9 @@ class Section(object):
 
 
 class Couple(DAO):
+    fields = ('couple_id', 'her', 'him', 'accommodations')
+    __slots__ = fields
+
     schema = {
         'AttributeDefinitions': [
             {
@@ -320,7 +644,8 @@ class Couple(DAO):
         'ProvisionedThroughput': {
             'ReadCapacityUnits': 2,
             'WriteCapacityUnits': 1
-        }
+        },
+        'StreamSpecification': CONTENT_STREAM
     }
 
     def __init__(self, couple_id, her, him, accommodations=False):
@@ -331,6 +656,9 @@ class Couple(DAO):
 
 
 class Guest(DAO):
+    fields = ('user_id',)
+    __slots__ = fields
+
     schema = {
         'AttributeDefinitions': [
             {
@@ -356,12 +684,20 @@ class Guest(DAO):
 
 
 class RSVP(DAO):
+    fields = ('rsvp_id', 'name', 'email', 'address', 'guests', 'hotel_preference', 'notes', 'declined', 'meal_preference',
+              'rsvp_notes', 'response_status')
+    __slots__ = fields
+
     schema = {
         'AttributeDefinitions': [
             {
                 'AttributeName': 'rsvp_id',
                 'AttributeType': 'S'
             },
+            {
+                'AttributeName': 'response_status',
+                'AttributeType': 'S'
+            },
         ],
         'TableName': 'RSVP',
         'KeySchema': [
@@ -370,12 +706,40 @@ class RSVP(DAO):
                 'KeyType': 'HASH'
             },
         ],
+        # Sparse: only RSVPs that have responded have a response_status, so save-the-dates never reach the index
+        'GlobalSecondaryIndexes': [
+            {
+                'IndexName': 'response_status-index',
+                'KeySchema': [
+                    {
+                        'AttributeName': 'response_status',
+                        'KeyType': 'HASH'
+                    },
+                    {
+                        'AttributeName': 'rsvp_id',
+                        'KeyType': 'RANGE'
+                    },
+                ],
+                'Projection': {
+                    'ProjectionType': 'ALL'
+                },
+                'ProvisionedThroughput': {
+                    'ReadCapacityUnits': 1,
+                    'WriteCapacityUnits': 1
+                }
+            },
+        ],
         'ProvisionedThroughput': {
             'ReadCapacityUnits': 1,
             'WriteCapacityUnits': 1
         }
     }
 
+    # response_status of an RSVP that has responded; one that hasn't (just a save-the-date) has none
+    ATTENDING = 'attending'
+    DECLINED = 'declined'
+    RESPONSE_STATUSES = (ATTENDING, DECLINED)
+
     def __init__(self, name, email, address, guests, hotel_preference, notes, declined=False, meal_preference={}, rsvp_notes=None):
         self.rsvp_id = re.sub(' +', ' ', name.lower().strip())
         self.name = non_null(name)
@@ -388,15 +752,140 @@ class RSVP(DAO):
         self.meal_preference = meal_preference
         self.rsvp_notes = non_null(rsvp_notes)
 
+    @classmethod
+    def status_of(cls, attributes):
+        '''
+        The response_status of an RSVP with attributes (a dict): declined, attending if it has a meal preference,
+        otherwise None.
+        '''
+        if attributes.get('declined') is True:
+            return cls.DECLINED
+        meal_preference = attributes.get('meal_preference')
+        if meal_preference and isinstance(meal_preference, dict):
+            return cls.ATTENDING
+        return None
+
+    def encode_item(self):
+        # response_status always follows the rest of the item, however it was changed
+        item = super(RSVP, self).encode_item()
+        status = self.status_of(item)
+        if status is None:
+            item.pop('response_status', None)
+        else:
+            item['response_status'] = status
+        return item
+
+    def update_request(self, fields=None, condition=None, add=None, return_values='NONE'):
+        # likewise for an update() of what it follows from: SET or REMOVE it to match
+        if fields is None:
+            fields = self.update_fields()
+        request = super(RSVP, self).update_request(fields, condition, add, return_values)
+        (follows, status) = self.status_after(fields)
+        if follows:
+            request['ExpressionAttributeNames']['#response_status'] = 'response_status'
+            if status is None:
+                request['UpdateExpression'] += ' REMOVE #response_status'
+            else:
+                request['UpdateExpression'] = request['UpdateExpression'].replace(
+                    'SET ', 'SET #response_status = :response_status , ', 1)
+                request['ExpressionAttributeValues'][':response_status'] = status
+        return request
+
+    def after_update(self, old, fields, add=None):
+        new = super(RSVP, self).after_update(old, fields, add)
+        (follows, status) = self.status_after(fields)
+        if follows:
+            new.pop('response_status', None)
+            if status is not None:
+                new['response_status'] = status
+        return new
+
+    def status_after(self, fields):
+        '''
+        Whether an update() of fields changes what response_status follows from (and doesn't set it itself), and if
+        so, what it becomes.
+        '''
+        written = set(field_path(field)[0] for field in fields)
+        if 'response_status' in written or not written & {'declined', 'meal_preference'}:
+            return (False, None)
+        return (True, self.status_of(self.as_dict()))
+
+    @classmethod
+    def responses(cls, dynamodb, statuses=RESPONSE_STATUSES, **kwargs):
+        '''
+        Iterate over the RSVPs that have responded, optionally only those with one of statuses, from the
+        response_status index.  kwargs are passed on to query(), e.g. projection.
+        '''
+        for status in statuses:
+            for rsvp in cls.query(dynamodb, Key('response_status').eq(status), index_name='response_status-index',
+                                  **kwargs):
+                yield rsvp
+
+    @classmethod
+    def backfill_response_status(cls, dynamodb, **kwargs):
+        '''
+        Set response_status on RSVPs written before there was one, so responses() finds them.  kwargs are passed to
+        scan_for_rsvp().  Returns how many were updated.
+        '''
+        count = 0
+        for rsvp in cls.scan_for_rsvp(dynamodb, FilterExpression=Attr('response_status').not_exists(), **kwargs):
+            if not isinstance(rsvp, RSVP):
+                logging.warning('Skipping RSVP that isn\'t an RSVP object: "%s"', rsvp)
+                continue
+            status = cls.status_of(rsvp.as_dict())
+            if status is None:
+                continue
+            rsvp.response_status = status
+            try:
+                # unless it was resubmitted since the scan, which set it already
+                rsvp.update(dynamodb, fields=['response_status'], condition=Attr('response_status').not_exists())
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                continue
+            count += 1
+        return count
+
     @classmethod
     def scan_for_rsvp(cls, dynamodb, **kwargs):
+        '''
+        The RSVPs that have responded, by scanning the whole table, including any written before response_status
+        (see backfill_response_status()).  responses() reads only the ones it returns.
+        '''
         if 'FilterExpression' in kwargs:
             kwargs['FilterExpression'] = kwargs['FilterExpression'] & (Attr('meal_preference').exists() | Attr('declined').eq(True))
         else:
             kwargs['FilterExpression'] = Attr('meal_preference').exists() | Attr('declined').eq(True)
         return cls.scan(dynamodb, **kwargs)
 
+    # put() keeps RSVPTotals up to date from the item it replaces, which BatchWriteItem can't return
+    batch_put = False
+
+    def after_write(self, old, new):
+        return RSVPTotals.record_change(old, new)
+
     def update_for_rsvp(self, dynamodb):
+        run_steps(dynamodb, self.update_for_rsvp_steps())
+
+    def update_for_rsvp_steps(self):
+        from_dynamo = yield ('UpdateItem', type(self), self.update_for_rsvp_request())
+        self.changed()
+        old = decode_attributes(from_dynamo)
+        yield from self.after_write(old, self.after_rsvp(old))
+
+    def after_rsvp(self, old):
+        '''
+        The attributes update_for_rsvp() leaves the item with, given the ones it had before.
+        '''
+        attributes = dict(old or {}, meal_preference=self.meal_preference, guests=self.guests, declined=self.declined,
+                          rsvp_notes=self.rsvp_notes or ' ')
+        attributes.pop('response_status', None)
+        status = self.status_of(attributes)
+        if status is not None:
+            attributes['response_status'] = status
+        return attributes
+
+    def update_for_rsvp_request(self):
         keys = self.get_keys()
         update_expression = 'SET meal_preference = :meal_preference' \
             + ' , guests = :guests' \
@@ -413,18 +902,158 @@ class RSVP(DAO):
             ':rsvp_notes': self.rsvp_notes or ' ',
             ':py_object': self.module_name()
         }
+        status = self.status_of({'declined': self.declined, 'meal_preference': self.meal_preference})
+        if status is None:
+            update_expression += ' REMOVE response_status'
+        else:
+            update_expression += ' , response_status = :response_status'
+            expression_values[':response_status'] = status
+        return {
+            'Key': keys,
+            'UpdateExpression': update_expression,
+            'ExpressionAttributeNames': expression_names,
+            'ExpressionAttributeValues': expression_values,
+            # the item as it was, to work out what the update changes in RSVPTotals
+            'ReturnValues': 'ALL_OLD',
+            'ReturnConsumedCapacity': 'INDEXES'
+        }
 
-        from_dynamo = self.table(dynamodb).update_item(
-            Key=keys,
-            UpdateExpression=update_expression,
-            ExpressionAttributeNames=expression_names,
-            ExpressionAttributeValues=expression_values,
-            ReturnConsumedCapacity='INDEXES'
-        )
-        logging.info('DynamoDB consumed capacity from UpdateItem: %s', from_dynamo['ConsumedCapacity'])
+
+class RSVPTotals(DAO):
+    '''
+    Running totals over every RSVP: how many have responded, how many declined, how many guests are coming and how
+    many of them chose each meal.  RSVP.put, update, update_for_rsvp and delete keep it up to date by adding what
+    each write changed, worked out from the item the write replaced, so a resubmitted RSVP replaces its earlier
+    answer rather than counting twice, and reading the totals is one GetItem rather than a scan of every RSVP.
+
+    Each write to an RSVP and the addition to the totals are separate atomic writes, so a failure between the two
+    (logged) leaves the totals off until recount().
+    '''
+    fields = ('totals_id', 'responses', 'declined', 'guests', 'meals')
+    __slots__ = fields
+
+    schema = {
+        'AttributeDefinitions': [
+            {
+                'AttributeName': 'totals_id',
+                'AttributeType': 'S'
+            },
+        ],
+        'TableName': 'RSVPTotals',
+        'KeySchema': [
+            {
+                'AttributeName': 'totals_id',
+                'KeyType': 'HASH'
+            },
+        ],
+        'ProvisionedThroughput': {
+            'ReadCapacityUnits': 1,
+            'WriteCapacityUnits': 1
+        }
+    }
+
+    def __init__(self, totals_id='0', responses=0, declined=0, guests=0, meals=None):
+        self.totals_id = totals_id
+        self.responses = responses
+        self.declined = declined
+        self.guests = guests
+        self.meals = meals if meals is not None else {}
+
+    @classmethod
+    def get(cls, dynamodb, hash_key='0', range_key=None):
+        try:
+            return super(RSVPTotals, cls).get(dynamodb, hash_key, range_key)
+        except KeyError:
+            # no RSVP has been written since the table was created
+            return cls(hash_key)
+
+    @staticmethod
+    def contribution(rsvp):
+        '''
+        What an RSVP, given as a dict of its attributes (or None if there isn't one), adds to the totals, e.g.
+        {'responses': 1, 'guests': 2, ('meals', 'Beef'): 2}.  Only a response counts, i.e. a decline or a meal
+        preference; an RSVP that's just a save-the-date adds nothing.
+        '''
+        status = RSVP.status_of(rsvp) if rsvp else None
+        if status is None:
+            return {}
+        if status == RSVP.DECLINED:
+            return {'responses': 1, 'declined': 1}
+        counts = {('meals', name): whole_number(number) for (name, number) in rsvp['meal_preference'].items()}
+        counts.update(responses=1, guests=whole_number(rsvp.get('guests')))
+        return counts
+
+    @classmethod
+    def delta(cls, old, new):
+        '''
+        What to add to the totals when an RSVP's attributes go from old to new (either may be None), without zeros.
+        '''
+        delta = cls.contribution(new)
+        for (field, amount) in cls.contribution(old).items():
+            delta[field] = delta.get(field, 0) - amount
+        return { field: amount for (field, amount) in delta.items() if amount }
+
+    @classmethod
+    def record_change(cls, old, new):
+        '''
+        Steps (see run_steps) adding what an RSVP's write from old to new changed to the stored totals; RSVP's
+        after_write().
+        '''
+        delta = cls.delta(old, new)
+        if not delta:
+            return
+        try:
+            yield from cls.add(delta)
+        except Exception:
+            logging.exception('Failed to add %s to the RSVP totals; they\'re off until util.py dump_meal_rsvps --recount',
+                              delta)
+
+    @classmethod
+    def add(cls, delta):
+        '''
+        Steps atomically adding delta (as from delta()) to the stored totals.
+        '''
+        totals = cls()
+        request = totals.update_request(fields=[], add=delta)
+        try:
+            yield ('UpdateItem', cls, request)
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ValidationException':
+                raise
+            # ADD can't reach into the meals map of an item that doesn't exist yet, so create it and go again
+            yield from cls.create()
+            yield ('UpdateItem', cls, request)
+        totals.changed()
+
+    @classmethod
+    def create(cls):
+        try:
+            yield from cls().put_steps(condition=Attr('totals_id').not_exists())
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    @classmethod
+    def recount(cls, dynamodb, **kwargs):
+        '''
+        Rebuild the totals from every RSVP that has responded (kwargs are passed to RSVP.responses()) and store
+        them.  RSVPs written while it runs may be missed, so run it while nobody is responding.
+        '''
+        totals = cls()
+        for rsvp in RSVP.responses(dynamodb, projection=['declined', 'guests', 'meal_preference'], **kwargs):
+            for (field, amount) in cls.contribution(rsvp.as_dict()).items():
+                if isinstance(field, tuple):
+                    totals.meals[field[1]] = totals.meals.get(field[1], 0) + amount
+                else:
+                    setattr(totals, field, getattr(totals, field) + amount)
+        totals.put(dynamodb)
+        return totals
 
 
 class Meal(DAO):
+    fields = ('name', 'description')
+    __slots__ = fields
+
     schema = {
         'AttributeDefinitions': [
             {
@@ -442,7 +1071,8 @@ class Meal(DAO):
         'ProvisionedThroughput': {
             'ReadCapacityUnits': 1,
             'WriteCapacityUnits': 1
-        }
+        },
+        'StreamSpecification': CONTENT_STREAM
     }
 
     def __init__(self, name, description=None):
@@ -451,6 +1081,9 @@ class Meal(DAO):
 
 
 class Accommodation(DAO):
+    fields = ('name', 'link', 'price', 'miles_to_reception', 'driving_minutes_to_reception')
+    __slots__ = fields
+
     schema = {
         'AttributeDefinitions': [
             {
@@ -471,6 +1104,9 @@ class Accommodation(DAO):
         }
     }
 
+    # put(), update() and delete() also rewrite the AccommodationGroup
+    batch_put = False
+
     def __init__(self, name, link, price, miles_to_reception, driving_minutes_to_reception):
         self.name = name
         self.link = link
@@ -478,11 +1114,325 @@ class Accommodation(DAO):
         self.miles_to_reception = miles_to_reception
         self.driving_minutes_to_reception = driving_minutes_to_reception
 
+    def after_write(self, old, new):
+        if new is None:
+            return AccommodationGroup.discard(self.name)
+        # the item as written, which after an update() of some fields needn't be this object
+        return AccommodationGroup.store(self.from_item(new))
+
+
+class AccommodationGroup(DAO):
+    '''
+    Every Accommodation in one item, in the order pages list them (nearest the reception first), so a page costs a
+    single GetItem rather than a scan and a sort.  Accommodation.put, update and delete (and their aio counterparts)
+    keep it in step with the Accommodation table; rebuild() makes it again from the table.
+    '''
+    fields = ('accommodation_group_id', 'accommodations', 'version')
+    __slots__ = fields
+
+    schema = {
+        'AttributeDefinitions': [
+            {
+                'AttributeName': 'accommodation_group_id',
+                'AttributeType': 'S'
+            },
+        ],
+        'TableName': 'AccommodationGroup',
+        'KeySchema': [
+            {
+                'AttributeName': 'accommodation_group_id',
+                'KeyType': 'HASH'
+            },
+        ],
+        'ProvisionedThroughput': {
+            'ReadCapacityUnits': 2,
+            'WriteCapacityUnits': 1
+        },
+        'StreamSpecification': CONTENT_STREAM
+    }
+
+    ALL = 'all'
+    MAX_RETRIES = 8
+
+    def __init__(self, accommodation_group_id=ALL, accommodations=None, version=0):
+        self.accommodation_group_id = accommodation_group_id
+        self.accommodations = accommodations if accommodations is not None else []
+        self.version = version
+
+    @staticmethod
+    def sort(accommodations):
+        return sorted(accommodations, key=lambda x: (x.miles_to_reception, x.name))
+
+    @classmethod
+    def store(cls, accommodation):
+        return cls.modify(lambda accommodations: [existing for existing in accommodations
+                                                  if existing.name != accommodation.name] + [accommodation])
+
+    @classmethod
+    def discard(cls, name):
+        return cls.modify(lambda accommodations: [existing for existing in accommodations if existing.name != name])
+
+    @classmethod
+    def rebuild(cls, dynamodb):
+        accommodations = list(Accommodation._items(dynamodb, 'Scan', ConsistentRead=True))
+        return run_steps(dynamodb, cls.modify(lambda ignored: accommodations))
+
+    @classmethod
+    def modify(cls, change):
+        '''
+        Steps (see run_steps) replacing the stored list of accommodations with change(the stored list), sorted.  The
+        write is conditional on nobody else having written the group since it was read, and is retried if somebody
+        has.
+        '''
+        for retries in range(cls.MAX_RETRIES + 1):
+            if retries:
+                yield (SLEEP, None, min(0.05 * 2 ** retries, 2))
+            from_dynamo = yield ('GetItem', cls, {
+                'Key': cls.key_dict(cls.ALL),
+                'ConsistentRead': True,
+                'ReturnConsumedCapacity': 'INDEXES'
+            })
+            if 'Item' in from_dynamo:
+                group = cls.decode_item(from_dynamo['Item'])
+                condition = Attr('version').eq(group.version)
+            else:
+                # the first write since the table was created starts from what's already in the Accommodation table
+                group = cls(accommodations=(yield from Accommodation.scan_steps(ConsistentRead=True)))
+                condition = Attr('accommodation_group_id').not_exists()
+            group.accommodations = cls.sort(change(group.accommodations))
+            group.version += 1
+            try:
+                yield from group.put_steps(condition=condition)
+                return group
+            except botocore.exceptions.ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                logging.info('AccommodationGroup changed while being rewritten; retrying')
+        raise RuntimeError('AccommodationGroup still changing after {0} retries'.format(cls.MAX_RETRIES))
+
+    @classmethod
+    def sorted_accommodations(cls, dynamodb):
+        '''
+        Every Accommodation, nearest the reception first: from the group, or if it hasn't been built yet, from a
+        scan of the Accommodation table.
+        '''
+        try:
+            return cls.get(dynamodb, cls.ALL).accommodations
+        except KeyError:
+            logging.warning('No AccommodationGroup yet; scanning Accommodation (setup_tables.py builds it)')
+            return cls.sort(Accommodation.scan(dynamodb))
+
+
+def call_dynamo(operation, table_name, call, **kwargs):
+    '''
+    Make a DynamoDB API call, logging its consumed capacity and recording its latency, capacity and any error in
+    the metrics for the current route.
+    '''
+    start = time.time()
+    try:
+        from_dynamo = call(**kwargs)
+    except Exception as e:
+        metrics.record_dynamodb(operation, table_name, time.time() - start, error=e)
+        raise
+    metrics.record_dynamodb(operation, table_name, time.time() - start, from_dynamo)
+    logging.info('DynamoDB consumed capacity from %s: %s', operation, from_dynamo.get('ConsumedCapacity'))
+    return from_dynamo
+
+
+# How run_steps() makes each operation a step can ask for
+OPERATION_METHODS = {
+    'GetItem': 'get_item',
+    'PutItem': 'put_item',
+    'UpdateItem': 'update_item',
+    'DeleteItem': 'delete_item',
+    'Query': 'query',
+    'Scan': 'scan'
+}
+# A step that waits for its request, in seconds, e.g. to back off before a retry
+SLEEP = 'Sleep'
+
+
+def run_steps(dynamodb, steps):
+    '''
+    Run steps, a generator yielding (operation, dao_class, request) for each DynamoDB call it makes (or (SLEEP,
+    None, seconds)), against dynamodb.  Each call's response is sent back in, or its error raised where it was
+    yielded, and what the generator returns is returned.  aio.run_steps runs the same generators on aioboto3, so a
+    write and what follows it (DAO.after_write) are written once for both APIs.
+    '''
+    (resume, value) = (steps.send, None)
+    while True:
+        try:
+            (operation, dao_class, request) = resume(value)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            if operation == SLEEP:
+                time.sleep(request)
+                value = None
+            else:
+                value = call_dynamo(operation, dao_class.schema['TableName'],
+                                    getattr(dao_class.table(dynamodb), OPERATION_METHODS[operation]), **request)
+            resume = steps.send
+        except Exception as e:
+            (resume, value) = (steps.throw, e)
+
+
+def field_path(field):
+    '''
+    Split a document path like 'sections[2].text' into ['sections', 2, 'text'].  A tuple is taken as the path
+    already split, for map keys that could contain '.' or '['.
+    '''
+    if isinstance(field, tuple):
+        return list(field)
+    return [int(index) if index else name for (name, index) in re.findall(r'([^.\[\]]+)|\[(\d+)\]', field)]
+
+
+def path_expression(path, names):
+    # every name goes through a placeholder, so reserved words and odd characters are safe
+    expression = ''
+    for part in path:
+        if isinstance(part, int):
+            expression += '[{0}]'.format(part)
+            continue
+        placeholder = next((existing for (existing, name) in names.items() if name == part), None)
+        if placeholder is None:
+            placeholder = '#n{0}'.format(len(names))
+            names[placeholder] = part
+        expression += ('.' if expression else '') + placeholder
+    return expression
+
+
+def projection_request(fields):
+    # py/object too, so the items still decode as model objects
+    names = {'#py': 'py/object'}
+    expressions = ['#py']
+    for (index, field) in enumerate(fields):
+        names['#p{0}'.format(index)] = field
+        expressions.append('#p{0}'.format(index))
+    return {'ProjectionExpression': ', '.join(expressions), 'ExpressionAttributeNames': names}
+
+
+def decode_attributes(from_dynamo):
+    # the Attributes a write returned, without the py/object that would make them decode as a model object
+    return { name: decode_value(value) for (name, value) in from_dynamo.get('Attributes', {}).items()
+             if name != 'py/object' }
+
+
+def resolve_path(obj, path):
+    for part in path:
+        obj = getattr(obj, part) if isinstance(obj, Record) else obj[part]
+    return obj
+
+
+def assign_path(obj, path, value):
+    parent = resolve_path(obj, path[:-1])
+    if isinstance(parent, Record):
+        setattr(parent, path[-1], value)
+    else:
+        parent[path[-1]] = value
+
+
+change_listeners = []
+
+
+def on_change(listener, dao_classes=None):
+    '''
+    Call listener(dao_class, keys) after any put, update or delete through the DAO, or one seen on a change feed (keys
+    None if it could be any item).  dao_classes optionally restricts it to a tuple of classes.
+    '''
+    change_listeners.append((listener, dao_classes))
+
+
+def notify_changed(dao_class, keys):
+    '''
+    Invalidate what's cached of the item of dao_class with keys and call the change listeners, for a write through
+    the DAO or one seen on a change feed (see streams.py).  keys None means any of the class's items may have changed.
+    '''
+    dao_class.invalidate_cached(keys)
+    for (listener, dao_classes) in change_listeners:
+        if dao_classes is None or issubclass(dao_class, dao_classes):
+            listener(dao_class, keys)
+
+
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_RETRIES = 8
+
+
+def batch_get_many(dynamodb, requests):
+    '''
+    Fetch items from any number of DAO tables in as few BatchGetItem calls as possible.
+
+    requests is a list of (dao_class, hash_key) or (dao_class, hash_key, range_key) tuples, e.g.
+    [(NavGroup, 'header_nav'), (Couple, '0')].  Returns the decoded objects in the same order, with None for items
+    that don't exist.  Items already in a class's cache are served from it, and loaded items are added to it.
+    Unprocessed keys are retried with exponential backoff.
+    '''
+    results = [None] * len(requests)
+    missing = object()
+    wanted = {}
+    for index, request in enumerate(requests):
+        dao_class, hash_key, range_key = (tuple(request) + (None,))[:3]
+        if dao_class.cache is not None:
+            cached = dao_class.cache.get(dao_class.cache_key(hash_key, range_key), missing)
+            if cached is not missing:
+                results[index] = cached
+                continue
+        keys = dao_class.key_dict(hash_key, range_key)
+        wanted.setdefault(dao_class.item_identity(keys), (dao_class, keys, []))[2].append(index)
+
+    identities = list(wanted)
+    dao_classes = { dao_class.schema['TableName']: dao_class for (dao_class, keys, indexes) in wanted.values() }
+    # taken before reading, so what's read isn't cached if it's invalidated meanwhile
+    invalidations = { dao_class: dao_class.cache.invalidations() for dao_class in dao_classes.values()
+                      if dao_class.cache is not None }
+    for start in range(0, len(identities), BATCH_GET_MAX_KEYS):
+        request_items = {}
+        for identity in identities[start:start + BATCH_GET_MAX_KEYS]:
+            dao_class, keys, indexes = wanted[identity]
+            request_items.setdefault(dao_class.schema['TableName'], {'Keys': []})['Keys'].append(keys)
+
+        retries = 0
+        while request_items:
+            from_dynamo = call_dynamo('BatchGetItem', ','.join(sorted(request_items)), dynamodb.batch_get_item,
+                RequestItems=request_items,
+                ReturnConsumedCapacity='INDEXES'
+            )
+            for table_name, items in from_dynamo['Responses'].items():
+                dao_class = dao_classes[table_name]
+                for item in items:
+                    loaded = dao_class.decode_item(item)
+                    identity = dao_class.item_identity(item)
+                    if dao_class.cache is not None:
+                        dao_class.cache.set(dao_class.cache_key(identity[1], identity[2]), loaded,
+                                            invalidations[dao_class])
+                    for index in wanted[identity][2]:
+                        results[index] = loaded
+
+            request_items = from_dynamo.get('UnprocessedKeys')
+            if request_items:
+                retries += 1
+                if retries > BATCH_GET_MAX_RETRIES:
+                    raise RuntimeError('BatchGetItem still had unprocessed keys after {0} retries'.format(BATCH_GET_MAX_RETRIES))
+                logging.info('Retrying %s unprocessed BatchGetItem keys', sum(len(t['Keys']) for t in request_items.values()))
+                time.sleep(min(0.05 * 2 ** retries, 2))
+    return results
+
+
+type_serializer = TypeSerializer()
+
 
 def all_subclasses(cls):
     return cls.__subclasses__() + [g for s in cls.__subclasses__() for g in all_subclasses(s)]
 
 
+def whole_number(value):
+    # a count from a form or an item, e.g. '2' or Decimal('2'); anything else counts as 0
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
 def non_null(thing):
     return thing or 'N/A'
 
@@ -495,9 +1445,10 @@ class DecimalHandler(jsonpickle.handlers.BaseHandler):
 # jsonpickle.handlers.registry.register(Decimal, DecimalHandler)
 
 
-def setup(fresh_data=False, fresh_tables=False, prefix=''):
-    client = boto3.client('dynamodb')
-    dynamodb = boto3.resource('dynamodb')
+def setup(fresh_data=False, fresh_tables=False, prefix='', dynamodb=None):
+    # a local backend (see backends.py) stands in for both the client and the resource
+    client = dynamodb if dynamodb is not None else boto3.client('dynamodb')
+    dynamodb = dynamodb if dynamodb is not None else boto3.resource('dynamodb')
 
     dao_classes = all_subclasses(DAO)
     for dao_class in dao_classes:
@@ -525,6 +1476,8 @@ def setup(fresh_data=False, fresh_tables=False, prefix=''):
         except botocore.exceptions.ClientError as e:
             if 'Table already exists' in str(e):
                 logging.info('Table for %s already exists', dao_class)
+                dao_class.ensure_indexes(client)
+                dao_class.ensure_stream(client)
             else:
                 raise e
 
@@ -755,8 +1708,6 @@ def setup(fresh_data=False, fresh_tables=False, prefix=''):
         for meal in meals:
             meal.put(dynamodb)
 
-if __name__ == '__main__':
-    options = docopt(__doc__)
-    setup(prefix=options['--prefix'] + '_',
-          fresh_data=options['--fresh-data'],
-          fresh_tables=options['--fresh-tables'])
\ No newline at end of file
+    if AccommodationGroup.batch_get(dynamodb, [AccommodationGroup.ALL])[0] is None:
+        # an Accommodation table from before AccommodationGroup
+        AccommodationGroup.rebuild(dynamodb)
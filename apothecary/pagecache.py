@@ -0,0 +1,76 @@
+import hashlib
+import logging
+import threading
+from collections import namedtuple
+from flask import make_response
+from .cache import LocalCache
+
+
+Page = namedtuple('Page', ['etag', 'body', 'mimetype'])
+
+
+class PageCache(object):
+    '''
+    Caches rendered GET responses keyed on (path, data version).  Pages carry a strong ETag (a hash of the body) and
+    Cache-Control, and conditional requests that match are answered with a 304.
+
+    purge() bumps the data version, which retires every cached page at once; invalidate() drops just the given pages.
+    The ttl bounds how stale a page can get when the data is changed by another process and no change feed (see
+    streams.py) reports it.  A render that a purge or invalidation overtakes isn't stored: take a token() when the
+    request starts and pass it to store().  Requests, fan-out and change-feed threads all use it, so the version and
+    invalidation counts change under a lock.
+    '''
+
+    def __init__(self, ttl=60, max_age=60, max_entries=64):
+        self.max_age = max_age
+        self.version = 0
+        # path -> times it's been invalidated
+        self.invalidations = {}
+        self._lock = threading.Lock()
+        self.pages = LocalCache('pages', ttl=ttl, max_entries=max_entries)
+
+    def get(self, path):
+        with self._lock:
+            version = self.version
+        return self.pages.get((path, version))
+
+    def token(self, path):
+        with self._lock:
+            return (self.version, self.invalidations.get(path, 0))
+
+    def store(self, path, response, token=None):
+        '''
+        Cache the rendered response, unless the page was purged or invalidated since token (from token() before it
+        was rendered) was taken.  Returns the Page either way.
+        '''
+        body = response.get_data()
+        page = Page(hashlib.sha1(body).hexdigest(), body, response.mimetype)
+        with self._lock:
+            # checked and stored together, so an invalidation can't land in between
+            if token is None or token == (self.version, self.invalidations.get(path, 0)):
+                self.pages.set((path, self.version), page)
+        return page
+
+    def purge(self, *args):
+        with self._lock:
+            self.version += 1
+            self.pages.clear()
+            version = self.version
+        logging.info('Purged page cache, now at version %s', version)
+
+    def invalidate(self, paths):
+        with self._lock:
+            for path in paths:
+                self.invalidations[path] = self.invalidations.get(path, 0) + 1
+                self.pages.invalidate((path, self.version))
+        if paths:
+            logging.info('Invalidated cached pages %s', ', '.join(paths))
+
+    def respond(self, page, request, response=None):
+        if response is None:
+            response = make_response(page.body)
+            response.mimetype = page.mimetype
+        response.set_etag(page.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        return response.make_conditional(request)
@@ -0,0 +1,91 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PAGE, DONE, ERROR = range(3)
+
+
+class CapacityBudget(object):
+    '''
+    Caps the read capacity units a scan consumes per second, across all of its segments, so an export or migration
+    leaves most of the table's provisioned throughput to the site.  A page that goes over budget is paid back by
+    sleeping before the next one.
+    '''
+
+    def __init__(self, units_per_second):
+        self.units_per_second = units_per_second
+        self._lock = threading.Lock()
+        self._available = units_per_second
+        self._updated = time.monotonic()
+
+    def consume(self, from_dynamo):
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.units_per_second,
+                                  self._available + (now - self._updated) * self.units_per_second)
+            self._updated = now
+            self._available -= consumed_units(from_dynamo)
+            wait = -self._available / self.units_per_second if self._available < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def consumed_units(from_dynamo):
+    consumed = from_dynamo.get('ConsumedCapacity') or []
+    return sum(float(capacity.get('CapacityUnits', 0)) for capacity in (consumed if isinstance(consumed, list) else [consumed]))
+
+
+def merge_segments(producers, prefetch=4, ordered=False):
+    '''
+    Run each producer (a zero-argument callable returning an iterator of pages, i.e. lists of items) in its own
+    thread and yield every item as a single iterator.
+
+    Each producer runs at most prefetch pages ahead of the caller.  Items are yielded as pages arrive from any
+    producer, or with ordered=True, all of the first producer's, then all of the second's, and so on.  An error in
+    a producer is raised to the caller, and producers stop once the caller stops iterating.
+    '''
+    stop = threading.Event()
+    if ordered:
+        queues = [queue.Queue(maxsize=prefetch) for producer in producers]
+    else:
+        queues = [queue.Queue(maxsize=prefetch * len(producers))] * len(producers)
+
+    def put(out, entry):
+        while not stop.is_set():
+            try:
+                out.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(producer, out):
+        try:
+            for page in producer():
+                if not put(out, (PAGE, page)):
+                    return
+            put(out, (DONE, None))
+        except Exception as e:
+            put(out, (ERROR, e))
+
+    executor = ThreadPoolExecutor(max_workers=len(producers), thread_name_prefix='scan-segment')
+    for (producer, out) in zip(producers, queues):
+        executor.submit(produce, producer, out)
+    try:
+        remaining = len(producers)
+        index = 0
+        while remaining:
+            (kind, value) = queues[index].get()
+            if kind == PAGE:
+                for item in value:
+                    yield item
+            elif kind == ERROR:
+                raise value
+            else:
+                remaining -= 1
+                if ordered:
+                    index += 1
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
@@ -0,0 +1,28 @@
+import hashlib
+from .cache import LocalCache
+from .sharedcache import TieredCache, serializers
+
+
+class MarkdownCache(object):
+    '''
+    Memoizes a markdown renderer by a hash of the source text, so each distinct Section.text is parsed once per
+    worker no matter how many requests render it, or with a shared store (see sharedcache.py), once per host.
+    Memory in each worker is bounded by max_entries (least recently used go first).
+    '''
+
+    def __init__(self, render, max_entries=256, store=None):
+        self.render = render
+        if store is None:
+            self.cache = LocalCache('markdown', ttl=None, max_entries=max_entries)
+        else:
+            # rendered Markup has to stay Markup, which JSON wouldn't keep
+            self.cache = TieredCache('markdown', store, serializers['pickle'], ttl=None, local_ttl=None,
+                                     max_entries=max_entries)
+
+    def __call__(self, text):
+        key = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return self.cache.get_or_load(key, lambda: self.render(text))
+
+    def prerender(self, texts):
+        for text in texts:
+            self(text)
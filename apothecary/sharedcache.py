@@ -0,0 +1,296 @@
+'''
+A cache tier shared by every worker process on a host, so one DynamoDB read (or one markdown render) serves them
+all rather than each worker missing once and keeping its own copy.
+
+TieredCache keeps a short-lived LocalCache in each worker in front of a shared store:
+
+    uwsgi                         the uWSGI cache framework's cache named apothecary (see deploy/start_uwsgi.sh)
+    memcached://<host>:<port>,... a local memcached (or anything speaking its protocol); needs pymemcache
+    memory                        a dict in this process: a stand-in for tests, shared only by its threads
+
+Values are stored serialized, by pickle or as JSON (see serializers), so any worker can load what another stored.
+'''
+
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+import simplejson as json
+from .cache import LocalCache
+from .codec import decode_item, encode_value
+
+missing = object()
+# Seconds before a load started that an invalidation in another process still keeps what was loaded out of the
+# store, to allow for the clocks of the hosts sharing a memcached differing
+CLOCK_SKEW = 1.0
+
+
+class PickleSerializer(object):
+    '''
+    Anything picklable; model objects pickle as their stored items (see codec.Record).  Only for a store nothing
+    else can write to, as loading a pickle can run arbitrary code.
+    '''
+    name = 'pickle'
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class JSONSerializer(object):
+    '''
+    Model objects, lists and dicts of them and plain values, in the layout DynamoDB stores them in.
+    '''
+    name = 'json'
+
+    def dumps(self, value):
+        return json.dumps(encode_value(value), use_decimal=True).encode('utf-8')
+
+    def loads(self, data):
+        return decode_item(json.loads(data.decode('utf-8'), use_decimal=True))
+
+
+serializers = {serializer.name: serializer for serializer in (PickleSerializer(), JSONSerializer())}
+
+
+def open_store(url):
+    '''
+    Open the shared store named by url (see above), or None for 'local', i.e. no shared tier.  'uwsgi' outside
+    uWSGI is None too, so the same configuration runs under run.py and in scripts.
+    '''
+    if url == 'local':
+        return None
+    if url == 'memory':
+        return MemoryStore()
+    if url == 'uwsgi' or url.startswith('uwsgi://'):
+        try:
+            import uwsgi
+        except ImportError:
+            logging.info('Not running under uWSGI, so caches aren\'t shared between processes')
+            return None
+        return UWSGICacheStore(uwsgi, url[len('uwsgi://'):] if url.startswith('uwsgi://') else 'apothecary')
+    if url.startswith('memcached://'):
+        servers = []
+        for server in url[len('memcached://'):].split(','):
+            (host, port) = server.rsplit(':', 1) if ':' in server else (server, 11211)
+            servers.append((host, int(port)))
+        return MemcachedStore(servers)
+    raise ValueError('Unknown cache backend {0!r}; expected local, uwsgi, memcached://<host>:<port> or memory'.format(url))
+
+
+class MemoryStore(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            (data, expires) = entry
+            if expires is not None and expires <= time.time():
+                del self._entries[key]
+                return None
+            return data
+
+    def set(self, key, data, ttl=None):
+        with self._lock:
+            self._entries[key] = (data, time.time() + ttl if ttl else None)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def reset(self):
+        self._lock = threading.Lock()
+
+
+class UWSGICacheStore(object):
+    '''
+    A cache created by uWSGI's --cache2 option, in memory shared by the master and every worker.
+    '''
+
+    def __init__(self, uwsgi, cache_name='apothecary'):
+        self.uwsgi = uwsgi
+        self.cache_name = cache_name
+
+    def get(self, key):
+        return self.uwsgi.cache_get(key, self.cache_name)
+
+    def set(self, key, data, ttl=None):
+        if not self.uwsgi.cache_update(key, data, int(ttl or 0), self.cache_name):
+            # e.g. bigger than the cache's blocks allow
+            logging.info('uWSGI cache %s didn\'t store %s (%s bytes)', self.cache_name, key, len(data))
+
+    def delete(self, key):
+        self.uwsgi.cache_del(key, self.cache_name)
+
+    def reset(self):
+        pass
+
+
+class MemcachedStore(object):
+    '''
+    memcached through pymemcache, imported when first used.  Each process opens its own connections (a pool per
+    server), after a fork too.
+    '''
+
+    def __init__(self, servers, timeout=0.25):
+        self.servers = servers
+        self.timeout = timeout
+        self._client = None
+        self._pid = None
+
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            try:
+                from pymemcache.client.hash import HashClient
+            except ImportError:
+                raise ImportError('A memcached cache backend needs pymemcache: pip install pymemcache')
+            self._client = HashClient(self.servers, use_pooling=True, connect_timeout=self.timeout,
+                                      timeout=self.timeout, ignore_exc=False)
+            self._pid = os.getpid()
+        return self._client
+
+    def get(self, key):
+        return self.client().get(key)
+
+    def set(self, key, data, ttl=None):
+        self.client().set(key, data, expire=int(ttl or 0))
+
+    def delete(self, key):
+        self.client().delete(key)
+
+    def reset(self):
+        self._client = None
+        self._pid = None
+
+
+class TieredCache(LocalCache):
+    '''
+    A LocalCache (kept for local_ttl seconds) in front of a shared store (kept for ttl).  A local miss looks in the
+    store before the loader runs, and what's loaded is stored in both, so get_or_load() runs the loader once per
+    host rather than once per worker.
+
+    invalidate() and clear() reach the store, so they're seen by every worker once its local copy expires, i.e.
+    within local_ttl.  clear() starts a new generation of keys rather than deleting them, which memcached can't
+    do by prefix.  They also leave the time in the store, so a load another process overtook (see
+    LocalCache.set) is taken back out of the store rather than kept there for ttl.  A store that fails is logged
+    and treated as a miss, so the site carries on against DynamoDB.
+
+    namespace prefixes the keys in the store, so caches with the same name from different configurations (e.g.
+    table prefixes) sharing a store don't collide.
+    '''
+
+    def __init__(self, name, store, serializer, ttl=60, local_ttl=5, max_entries=1024, namespace=None):
+        super(TieredCache, self).__init__(name, ttl=local_ttl, max_entries=max_entries)
+        self.store = store
+        self.serializer = serializer
+        self.shared_ttl = ttl
+        self.namespace = namespace or name
+        self.shared_hits = 0
+        self._generation = None
+        self._generation_read = 0
+
+    def generation(self):
+        # re-read at most every local_ttl, the same bound as on a local copy's staleness
+        now = time.time()
+        if self._generation is None or self.ttl is None or now - self._generation_read >= self.ttl:
+            key = 'apothecary:{0}:generation'.format(self.namespace)
+            generation = self.store.get(key)
+            if generation is None:
+                generation = uuid.uuid4().hex.encode('ascii')
+                self.store.set(key, generation)
+            self._generation = generation.decode('ascii') if isinstance(generation, bytes) else generation
+            self._generation_read = now
+        return self._generation
+
+    def shared_key(self, key):
+        return 'apothecary:{0}:{1}:{2}'.format(self.namespace, self.generation(), self.digest(key))
+
+    @staticmethod
+    def digest(key):
+        return hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+    def invalidated_key(self, key):
+        # when key was last invalidated, by any process
+        return 'apothecary:{0}:invalidated:{1}'.format(self.namespace, self.digest(key))
+
+    def cleared_key(self):
+        return 'apothecary:{0}:cleared'.format(self.namespace)
+
+    def invalidations(self):
+        # when the load started too, to compare with the invalidations other processes leave in the store
+        return (super(TieredCache, self).invalidations(), time.time())
+
+    def invalidated_since(self, key, started):
+        for stored in (self.store.get(self.invalidated_key(key)), self.store.get(self.cleared_key())):
+            if stored is not None and float(stored) >= started - CLOCK_SKEW:
+                return True
+        return False
+
+    def mark_invalidated(self, store_key):
+        self.store.set(store_key, repr(time.time()).encode('ascii'), self.shared_ttl)
+
+    def get(self, key, default=None):
+        value = super(TieredCache, self).get(key, missing)
+        if value is not missing:
+            return value
+        invalidations = super(TieredCache, self).invalidations()
+        try:
+            data = self.store.get(self.shared_key(key))
+            if data is None:
+                return default
+            value = self.serializer.loads(data)
+        except Exception:
+            logging.warning('Shared cache %s failed to get %s', self.name, key, exc_info=True)
+            return default
+        # not copied if this process invalidated it while it was read
+        super(TieredCache, self).set(key, value, invalidations)
+        with self._lock:
+            self.misses -= 1
+            self.hits += 1
+            self.shared_hits += 1
+        return value
+
+    def set(self, key, value, invalidations=None):
+        (local, started) = invalidations if invalidations is not None else (None, None)
+        if not super(TieredCache, self).set(key, value, local):
+            return False
+        try:
+            shared_key = self.shared_key(key)
+            self.store.set(shared_key, self.serializer.dumps(value), self.shared_ttl)
+            # checked after storing, and invalidate() marks before deleting, so one of the two always catches a race
+            if started is not None and self.invalidated_since(key, started):
+                logging.info('Shared cache %s: %s was invalidated while it loaded; not sharing it', self.name, key)
+                self.store.delete(shared_key)
+                with self._lock:
+                    self._entries.pop(key, None)
+                return False
+        except Exception:
+            logging.warning('Shared cache %s failed to set %s', self.name, key, exc_info=True)
+        return True
+
+    def invalidate(self, key):
+        super(TieredCache, self).invalidate(key)
+        try:
+            self.mark_invalidated(self.invalidated_key(key))
+            self.store.delete(self.shared_key(key))
+        except Exception:
+            logging.warning('Shared cache %s failed to invalidate %s', self.name, key, exc_info=True)
+
+    def clear(self):
+        super(TieredCache, self).clear()
+        try:
+            self.mark_invalidated(self.cleared_key())
+            self._generation = uuid.uuid4().hex
+            self._generation_read = time.time()
+            self.store.set('apothecary:{0}:generation'.format(self.namespace), self._generation.encode('ascii'))
+        except Exception:
+            logging.warning('Shared cache %s failed to clear', self.name, exc_info=True)
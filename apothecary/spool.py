@@ -0,0 +1,244 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+import botocore.exceptions
+import simplejson as json
+from .model import DAO, call_dynamo
+
+BATCH_WRITE_MAX_ITEMS = 25
+# Errors that go away by themselves, so a write failing with one is retried (as is any 5xx); any other error is the
+# submission's own fault, e.g. a ValidationException for an empty key, and retrying it can't help
+RETRYABLE_ERRORS = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded',
+                    'InternalServerError', 'ServiceUnavailable', 'LimitExceededException')
+
+
+class WriteSpool(object):
+    '''
+    Write-behind queue for DAO writes made while a guest waits (RSVP and save-the-date submissions).
+
+    submit() durably writes the operation to a spool directory and returns straight away.  A background thread in
+    each worker drains the spool, replaying each operation by calling that method on the decoded object.  The app
+    starts it on a worker's first request (see ensure_worker()), so submissions left by a worker that died or was
+    restarted are written without waiting for another.
+
+    RSVP's put() also keeps its totals (RSVP.batch_put is False), so every write the app spools goes out on its own.
+    Only runs of 'put' operations of classes whose put() just writes the item (DAO.batch_put, e.g. Meal) go out
+    together with BatchWriteItem.
+
+    Throttled writes and DynamoDB errors are retried with exponential backoff, and operations that still fail stay in
+    the spool for the next pass; an operation DynamoDB rejects (see RETRYABLE_ERRORS) is set aside in failed/ so it
+    doesn't hold up the rest.
+
+    Layout of the spool directory:
+      tmp/           submissions being written
+      new/           submissions waiting to be written to DynamoDB
+      claimed/<pid>/ submissions a worker is writing; put back in new/ if that worker dies
+      failed/        submissions that couldn't be read back or were rejected, set aside for a human
+    '''
+
+    def __init__(self, directory, dynamodb_manager, batch_size=BATCH_WRITE_MAX_ITEMS, max_retries=8, poll_interval=1.0):
+        self.directory = directory
+        self.dynamodb_manager = dynamodb_manager
+        self.batch_size = min(batch_size, BATCH_WRITE_MAX_ITEMS)
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._wake = None
+        for subdirectory in ('tmp', 'new', 'claimed'):
+            os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+
+    def submit(self, operation, dao):
+        record = {
+            'operation': operation,
+            'table': dao.schema['TableName'],
+            'item': dao.encode_item()
+        }
+        name = '{0:.6f}-{1}-{2}.json'.format(time.time(), os.getpid(), uuid.uuid4().hex)
+        tmp_filename = os.path.join(self.directory, 'tmp', name)
+        with open(tmp_filename, 'w') as f:
+            json.dump(record, f, use_decimal=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_filename, os.path.join(self.directory, 'new', name))
+        logging.info('Spooled %s of %s', operation, dao.get_keys())
+        self.ensure_worker()
+        self._wake.set()
+
+    def ensure_worker(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                self._wake = threading.Event()
+                worker = threading.Thread(target=self.run, name='rsvp-spool')
+                worker.daemon = True
+                worker.start()
+                self._pid = pid
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def run(self):
+        while True:
+            try:
+                self.recover()
+                while self.drain():
+                    pass
+            except Exception:
+                logging.exception('Error draining write spool %s', self.directory)
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def recover(self):
+        claimed_directory = os.path.join(self.directory, 'claimed')
+        for pid in os.listdir(claimed_directory):
+            if int(pid) == os.getpid() or process_alive(int(pid)):
+                continue
+            for name in os.listdir(os.path.join(claimed_directory, pid)):
+                logging.warning('Recovering %s from dead worker %s', name, pid)
+                os.rename(os.path.join(claimed_directory, pid, name), os.path.join(self.directory, 'new', name))
+
+    def claim(self):
+        claimed_directory = os.path.join(self.directory, 'claimed', str(os.getpid()))
+        os.makedirs(claimed_directory, exist_ok=True)
+        claimed = []
+        for name in sorted(os.listdir(os.path.join(self.directory, 'new'))):
+            if len(claimed) >= self.batch_size:
+                break
+            try:
+                os.rename(os.path.join(self.directory, 'new', name), os.path.join(claimed_directory, name))
+            except FileNotFoundError:
+                # another worker claimed it first
+                continue
+            claimed.append(os.path.join(claimed_directory, name))
+        return claimed
+
+    def drain(self):
+        '''
+        Write one batch of spooled operations.  Returns whether there was anything to write.
+        '''
+        claimed = self.claim()
+        if not claimed:
+            return False
+
+        dynamodb = self.dynamodb_manager.resource()
+        records = []
+        for filename in claimed:
+            try:
+                with open(filename) as f:
+                    record = json.load(f, use_decimal=True)
+                records.append((filename, record, DAO.decode_item(record['item'])))
+            except Exception:
+                logging.exception('Moving unreadable spool file %s to failed/', filename)
+                self.set_aside(filename)
+
+        pending_puts = []
+        try:
+            for (filename, record, dao) in records:
+                if record['operation'] == 'put' and dao.batch_put:
+                    pending_puts.append((filename, record, dao))
+                    continue
+                self.write_puts(dynamodb, pending_puts)
+                pending_puts = []
+                self.write(dynamodb, filename, record, dao)
+            self.write_puts(dynamodb, pending_puts)
+        except Exception:
+            logging.exception('Giving up on this batch for now; it stays spooled')
+            for filename in claimed:
+                if os.path.exists(filename):
+                    os.rename(filename, os.path.join(self.directory, 'new', os.path.basename(filename)))
+            return False
+        return True
+
+    def write(self, dynamodb, filename, record, dao):
+        try:
+            self.with_retries(lambda: getattr(dao, record['operation'])(dynamodb))
+        except botocore.exceptions.ClientError as e:
+            if retryable(e):
+                raise
+            logging.error('Moving rejected %s of %s (%s) to failed/: %s', record['operation'], dao.get_keys(),
+                          filename, e)
+            self.set_aside(filename)
+            return
+        os.remove(filename)
+
+    def set_aside(self, filename):
+        os.makedirs(os.path.join(self.directory, 'failed'), exist_ok=True)
+        os.rename(filename, os.path.join(self.directory, 'failed', os.path.basename(filename)))
+
+    def write_puts(self, dynamodb, puts):
+        if not puts:
+            return
+        try:
+            self.batch_write_puts(dynamodb, puts)
+        except botocore.exceptions.ClientError as e:
+            if retryable(e):
+                raise
+            # the whole BatchWriteItem is rejected, so write each put on its own to set aside only the bad ones
+            logging.warning('BatchWriteItem rejected (%s); writing the puts one at a time', e)
+            for (filename, record, dao) in puts:
+                self.write(dynamodb, filename, record, dao)
+
+    def batch_write_puts(self, dynamodb, puts):
+        # BatchWriteItem rejects two writes to the same key, so only the latest put for each item is sent
+        latest = {}
+        for (filename, record, dao) in puts:
+            latest[dao.item_identity(record['item'])] = record
+        request_items = {}
+        for record in latest.values():
+            request_items.setdefault(record['table'], []).append({'PutRequest': {'Item': record['item']}})
+
+        retries = 0
+        while request_items:
+            from_dynamo = self.with_retries(lambda: call_dynamo('BatchWriteItem', ','.join(sorted(request_items)),
+                dynamodb.batch_write_item,
+                RequestItems=request_items,
+                ReturnConsumedCapacity='INDEXES'
+            ))
+            request_items = from_dynamo.get('UnprocessedItems')
+            if request_items:
+                retries += 1
+                if retries > self.max_retries:
+                    raise RuntimeError('BatchWriteItem still had unprocessed items after {0} retries'.format(self.max_retries))
+                backoff(retries)
+
+        for (filename, record, dao) in puts:
+            os.remove(filename)
+            dao.changed()
+
+    def with_retries(self, call):
+        retries = 0
+        while True:
+            try:
+                return call()
+            except botocore.exceptions.ClientError as e:
+                retries += 1
+                if not retryable(e) or retries > self.max_retries:
+                    raise e
+                logging.warning('Retrying spooled write after %s', e)
+                backoff(retries)
+
+
+def retryable(e):
+    return (e.response['Error'].get('Code') in RETRYABLE_ERRORS
+            or e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) >= 500)
+
+
+def backoff(retries):
+    time.sleep(random.uniform(0, min(0.1 * 2 ** retries, 10)))
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
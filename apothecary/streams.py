@@ -0,0 +1,277 @@
+'''
+Pushes every change to the content tables, whichever process made it, into this process's caches: the DAO caches
+and page cache drop exactly the items and pages that changed, so they can keep everything else for a long time
+(DAO_CACHE_TTL, PAGE_CACHE_TTL) and still show an edit within a poll interval.
+
+A feed's poll() returns (dao_class, keys) for each item written since the last poll, or keys None when changes may
+have been missed and the class's caches should be dropped as a whole.
+
+    dynamodb                  the tables' DynamoDB Streams (StreamSpecification in the model; setup() enables it)
+    file:///<path>            an append-only file of changes, for the local backends and offline testing: processes
+                              importing the app append their own writes to it (publish_writes())
+
+    feed = streams.open_feed(url, dao_classes, dynamodb_manager)
+    ChangeConsumer(feed).ensure_worker()
+'''
+
+import logging
+import os
+import threading
+import time
+import boto3
+import botocore.exceptions
+import simplejson as json
+from boto3.dynamodb.types import TypeDeserializer
+from . import model
+from .connection import DynamoDBManager
+
+deserializer = TypeDeserializer()
+
+# Records asked for per GetRecords call, the most DynamoDB Streams returns
+GET_RECORDS_LIMIT = 1000
+# Seconds between looking for new shards; DynamoDB Streams starts new ones every few hours
+DISCOVER_INTERVAL = 60
+# Shard errors after which the records in between are gone, so the class's caches are dropped as a whole
+LOST_POSITION_ERRORS = ('ExpiredIteratorException', 'TrimmedDataAccessException', 'ResourceNotFoundException')
+
+
+def open_feed(url, dao_classes, dynamodb_manager, region_name=None):
+    '''
+    Open the feed of changes to dao_classes named by url (see above).
+    '''
+    if url == 'dynamodb':
+        if not isinstance(dynamodb_manager, DynamoDBManager):
+            raise ValueError('A dynamodb change feed needs the dynamodb storage backend; use file:///<path> locally')
+        return DynamoDBStreamFeed(dao_classes, dynamodb_manager, region_name=region_name)
+    if url.startswith('file:///'):
+        return FileFeed(url[len('file://'):], dao_classes)
+    raise ValueError('Unknown change feed {0!r}; expected dynamodb or file:///<path>'.format(url))
+
+
+class DynamoDBStreamFeed(object):
+    '''
+    Reads the KEYS_ONLY streams of dao_classes' tables.  Shards open when the feed first sees a stream are read from
+    their latest record, so earlier changes (already reflected in what's read from the table) aren't replayed;
+    shards that appear after that, e.g. a closed shard's children, are read from the start so nothing between them
+    is missed.
+    '''
+
+    def __init__(self, dao_classes, dynamodb_manager, region_name=None):
+        self.dao_classes = dao_classes
+        self.dynamodb_manager = dynamodb_manager
+        self.region_name = region_name
+        self.reset()
+
+    def reset(self):
+        self._client = None
+        self._pid = None
+        # table name -> (stream arn, {shard id: shard iterator, or None once the shard is read to its end})
+        self._streams = {}
+        self._discovered = 0
+
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            self._client = boto3.session.Session(region_name=self.region_name).client('dynamodbstreams')
+            self._pid = os.getpid()
+        return self._client
+
+    def poll(self):
+        if time.time() - self._discovered >= DISCOVER_INTERVAL:
+            for dao_class in self.dao_classes:
+                self.discover(dao_class)
+            self._discovered = time.time()
+
+        changes = []
+        for dao_class in self.dao_classes:
+            (stream_arn, shards) = self._streams.get(dao_class.schema['TableName'], (None, {}))
+            for (shard_id, iterator) in list(shards.items()):
+                if iterator is None:
+                    continue
+                try:
+                    from_stream = self.client().get_records(ShardIterator=iterator, Limit=GET_RECORDS_LIMIT)
+                except botocore.exceptions.ClientError as e:
+                    if e.response['Error']['Code'] not in LOST_POSITION_ERRORS:
+                        raise
+                    logging.warning('Lost position in shard %s of %s (%s); dropping its caches',
+                                    shard_id, dao_class, e.response['Error']['Code'])
+                    changes.append((dao_class, None))
+                    shards[shard_id] = self.shard_iterator(stream_arn, shard_id, 'LATEST')
+                    continue
+                for record in from_stream['Records']:
+                    keys = record['dynamodb']['Keys']
+                    changes.append((dao_class, {name: deserializer.deserialize(value) for (name, value) in keys.items()}))
+                # no NextShardIterator once a closed shard has been read to its end
+                shards[shard_id] = from_stream.get('NextShardIterator')
+        return changes
+
+    def discover(self, dao_class):
+        table_name = dao_class.schema['TableName']
+        table = self.dynamodb_manager.client().describe_table(TableName=table_name)['Table']
+        stream_arn = table.get('LatestStreamArn') if table.get('StreamSpecification', {}).get('StreamEnabled') else None
+        if stream_arn is None:
+            if table_name not in self._streams:
+                logging.warning('Table for %s has no stream; run setup_tables.py to enable it', dao_class)
+                self._streams[table_name] = (None, {})
+            return
+
+        (known_arn, shards) = self._streams.get(table_name, (None, {}))
+        first = known_arn != stream_arn
+        if first:
+            shards = {}
+            self._streams[table_name] = (stream_arn, shards)
+        for shard in self.describe_shards(stream_arn):
+            if shard['ShardId'] in shards:
+                continue
+            if first and 'EndingSequenceNumber' in shard['SequenceNumberRange']:
+                # closed before this feed started
+                shards[shard['ShardId']] = None
+                continue
+            shards[shard['ShardId']] = self.shard_iterator(stream_arn, shard['ShardId'],
+                                                           'LATEST' if first else 'TRIM_HORIZON')
+            logging.info('Reading shard %s of %s', shard['ShardId'], dao_class)
+
+    def describe_shards(self, stream_arn):
+        kwargs = {}
+        while True:
+            description = self.client().describe_stream(StreamArn=stream_arn, **kwargs)['StreamDescription']
+            for shard in description['Shards']:
+                yield shard
+            if 'LastEvaluatedShardId' not in description:
+                return
+            kwargs['ExclusiveStartShardId'] = description['LastEvaluatedShardId']
+
+    def shard_iterator(self, stream_arn, shard_id, iterator_type):
+        return self.client().get_shard_iterator(StreamArn=stream_arn, ShardId=shard_id,
+                                                ShardIteratorType=iterator_type)['ShardIterator']
+
+
+class FileFeed(object):
+    '''
+    Changes as JSON lines appended to path, by publish() in any process on the host.  Each line is one write of a
+    few hundred bytes at most, which O_APPEND keeps whole between processes.  A feed starts reading at the end of the
+    file, and from the start again if the file is truncated or replaced.
+    '''
+
+    def __init__(self, path, dao_classes):
+        self.path = path
+        self.dao_classes = dao_classes
+        self.reset()
+
+    def reset(self):
+        self._offset = None
+        self._inode = None
+
+    def publish(self, dao_class, keys):
+        line = json.dumps({'table': dao_class.schema['TableName'], 'keys': keys, 'time': time.time()},
+                          use_decimal=True)
+        with open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+    def poll(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._offset = 0
+            return []
+        if self._offset is None:
+            (self._offset, self._inode) = (stat.st_size, stat.st_ino)
+            return []
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            (self._offset, self._inode) = (0, stat.st_ino)
+        if stat.st_size == self._offset:
+            return []
+
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # leave a line still being written for the next poll
+        data = data[:data.rfind(b'\n') + 1]
+        self._offset += len(data)
+
+        classes = {dao_class.schema['TableName']: dao_class for dao_class in self.dao_classes}
+        changes = []
+        for line in data.decode('utf-8').splitlines():
+            try:
+                change = json.loads(line, use_decimal=True)
+            except ValueError:
+                logging.warning('Skipping unreadable change %r in %s', line, self.path)
+                continue
+            if change['table'] in classes:
+                changes.append((classes[change['table']], change['keys']))
+        return changes
+
+
+replaying = threading.local()
+
+
+def publish_writes(feed, dao_classes):
+    '''
+    Publish this process's writes to dao_classes on feed (a FileFeed), but not the changes it's replaying from it.
+    '''
+    def publish(dao_class, keys):
+        if getattr(replaying, 'active', False):
+            return
+        try:
+            feed.publish(dao_class, keys)
+        except Exception:
+            # the other processes catch up when their caches expire
+            logging.exception('Failed to publish change to %s %s', dao_class, keys)
+    model.on_change(publish, dao_classes)
+
+
+class ChangeConsumer(object):
+    '''
+    Polls a feed in a background thread of each process, started by ensure_worker() (again after a fork), and
+    applies each change with model.notify_changed, i.e. to the DAO caches and every change listener.
+    '''
+
+    def __init__(self, feed, poll_interval=1.0):
+        self.feed = feed
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_worker(self):
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid != pid:
+                self.feed.reset()
+                worker = threading.Thread(target=self.run, name='change-feed')
+                worker.daemon = True
+                worker.start()
+                self._pid = pid
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def run(self):
+        while True:
+            try:
+                self.apply(self.feed.poll())
+            except Exception:
+                logging.exception('Error reading change feed')
+            time.sleep(self.poll_interval)
+
+    def apply(self, changes):
+        '''
+        Apply changes, once per item however many times it changed.  Returns the distinct changes applied.
+        '''
+        distinct = []
+        seen = set()
+        for (dao_class, keys) in changes:
+            identity = (dao_class, None if keys is None else tuple(sorted(keys.items())))
+            if identity not in seen:
+                seen.add(identity)
+                distinct.append((dao_class, keys))
+        replaying.active = True
+        try:
+            for (dao_class, keys) in distinct:
+                model.notify_changed(dao_class, keys)
+        finally:
+            replaying.active = False
+        if distinct:
+            logging.info('Applied %s changes from the change feed', len(distinct))
+        return distinct
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Usage:
+  bench.py [options]
+
+Benchmark every route of apothecary against a local storage backend, seeded with model.setup's fresh data, and
+print per-route latency percentiles, throughput and backend calls per request as JSON.  Nothing touches AWS.
+Compare two runs (e.g. before and after a commit) with the same options.
+
+The moto backend is moto's in-process DynamoDB, reached through boto3 and botocore just as the real thing is;
+memory and sqlite:///<file> are the app's own local backends (see apothecary/backends.py).
+
+Each route is driven on its own, by --concurrency threads each with its own test client, after --warm-up
+untimed requests.  RSVP and save-the-date submissions are written straight to DynamoDB rather than spooled, so
+their writes count against the request that made them.
+
+Options:
+  -c --concurrency <n>    Threads sending requests at once [default: 4]
+  -n --requests <n>       Timed requests per route [default: 200]
+  --warm-up <n>           Untimed requests per route before timing [default: 10]
+  --routes <names>        Comma-separated routes to run, e.g. story,rsvp_post (default: all)
+  --backend <url>         moto, memory or sqlite:///<file> [default: moto]
+  --no-cache              Disable the DAO and page caches, so every request reads from storage
+  -o --output <file>      Write the JSON report here rather than to stdout
+  --log-level <level>     Log level [default: WARNING]
+"""
+
+import contextlib
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import simplejson as json
+from docopt import docopt
+
+# (name, method, path, form data) of each benchmarked request
+routes = [
+    ('index', 'GET', '/', None),
+    ('ping', 'GET', '/ping', None),
+    ('story', 'GET', '/story/', None),
+    ('event', 'GET', '/event/', None),
+    ('travel', 'GET', '/travel/', None),
+    ('area', 'GET', '/area/', None),
+    ('party', 'GET', '/party/', None),
+    ('registry', 'GET', '/registry/', None),
+    ('save_the_date', 'GET', '/save-the-date/', None),
+    ('save_the_date_post', 'POST', '/save-the-date/', {'name': 'Bench Guest', 'email': 'bench@example.com',
+                                                       'address': '1 Bench St', 'guests': '2',
+                                                       'hotel_preference': 'none', 'notes': 'bench'}),
+    ('rsvp', 'GET', '/rsvp/', None),
+    ('rsvp_post', 'POST', '/rsvp/', {'name': 'Bench Guest', 'guests': '2', 'notes': 'bench',
+                                     'meal_preference_Beef': '1', 'meal_preference_Vegetable': '1'}),
+]
+
+
+def start_moto():
+    '''
+    Start moto's in-process DynamoDB.  boto3 needs credentials and a region even when mocked, so fake ones are set
+    unless real ones are already in the environment (they're never used).
+    '''
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    try:
+        from moto import mock_aws
+    except ImportError:
+        sys.exit('bench.py needs moto for its DynamoDB stand-in: pip install moto')
+    mock = mock_aws()
+    mock.start()
+    return mock
+
+
+def percentile(ordered, fraction):
+    # nearest rank
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))]
+
+
+def backend_calls():
+    from apothecary.metrics import metrics
+    return sum(value for ((name, labels), value) in list(metrics.counters.items())
+               if name == 'apothecary_dynamodb_calls_total')
+
+
+def send(client, method, path, data):
+    if method == 'POST':
+        return client.post(path, data=data)
+    return client.get(path)
+
+
+def run_route(app, route, concurrency, requests, warm_up):
+    (name, method, path, data) = route
+    client = app.test_client()
+    for _ in range(warm_up):
+        send(client, method, path, data)
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    remaining = [requests]
+    start = threading.Barrier(concurrency + 1)
+
+    def worker():
+        client = app.test_client()
+        start.wait()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            sent = time.perf_counter()
+            response = send(client, method, path, data)
+            elapsed = time.perf_counter() - sent
+            with lock:
+                latencies.append(elapsed)
+                statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+    threads = [threading.Thread(target=worker, name='bench-{0}'.format(i)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    calls_before = backend_calls()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - began
+    calls = backend_calls() - calls_before
+
+    latencies.sort()
+    return {
+        'method': method,
+        'path': path,
+        'requests': len(latencies),
+        'statuses': statuses,
+        'seconds': wall,
+        'throughput_rps': len(latencies) / wall if wall else None,
+        'latency_ms': {
+            'mean': 1000 * sum(latencies) / len(latencies) if latencies else None,
+            'p50': 1000 * percentile(latencies, 0.50) if latencies else None,
+            'p95': 1000 * percentile(latencies, 0.95) if latencies else None,
+            'p99': 1000 * percentile(latencies, 0.99) if latencies else None,
+            'max': 1000 * latencies[-1] if latencies else None,
+        },
+        'backend_calls_per_request': calls / len(latencies) if latencies else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench(concurrency, requests, warm_up, names=None, cache=True, backend='moto'):
+    mock = start_moto() if backend == 'moto' else None
+    try:
+        import apothecary
+        from apothecary import model
+        from apothecary.backends import open_backend
+        if mock is None:
+            apothecary.dynamodb_manager = open_backend(backend)
+            model.setup(fresh_data=True, dynamodb=apothecary.dynamodb_manager.resource())
+        else:
+            model.setup(fresh_data=True)
+        if not cache:
+            for dao_class in model.all_subclasses(model.DAO):
+                dao_class.disable_cache()
+            apothecary.cached_endpoints = ()
+        # so a submission's writes are counted against it, not whichever route is running when the spool drains
+        apothecary.rsvp_spool = None
+
+        selected = [route for route in routes if names is None or route[0] in names]
+        unknown = set(names or ()) - set(route[0] for route in routes)
+        if unknown:
+            raise ValueError('Unknown routes: {0}'.format(', '.join(sorted(unknown))))
+
+        results = {}
+        for route in selected:
+            logging.info('Benchmarking %s %s', route[1], route[2])
+            results[route[0]] = run_route(apothecary.app, route, concurrency, requests, warm_up)
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'concurrency': concurrency,
+        'requests_per_route': requests,
+        'warm_up': warm_up,
+        'backend': backend,
+        'cache': cache,
+        'routes': results,
+    }
+
+
+if __name__ == '__main__':
+    options = docopt(__doc__)
+    logging.basicConfig(level=logging.getLevelName(options['--log-level'].upper()))
+    # anything the app prints goes to stderr, so stdout is only the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = bench(int(options['--concurrency']),
+                       int(options['--requests']),
+                       int(options['--warm-up']),
+                       names=options['--routes'].split(',') if options['--routes'] else None,
+                       cache=not options['--no-cache'],
+                       backend=options['--backend'])
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if options['--output']:
+        with open(options['--output'], 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+"""
+Usage:
+  build_assets.py [options]
+
+Fingerprint, minify and precompress everything in apothecary/static/ into apothecary/static/dist/, and write the
+manifest the app uses to point url_for('static', ...) at the fingerprinted files.  Rerun after changing any asset.
+
+Options:
+  --log-level <level>     Log level [default: INFO]
+"""
+
+import logging
+import os
+from apothecary import assets
+from docopt import docopt
+
+if __name__ == '__main__':
+    options = docopt(__doc__)
+    logging.basicConfig(level=logging.getLevelName(options['--log-level'].upper()))
+    assets.build(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apothecary', 'static'))
@@ -10,11 +10,12 @@
 #   cd apothecary
 #   ./deploy/autoscale.sh
 
-echo "installing python3.4 and some build tools"
+# apothecary needs Python 3.7 or later (os.register_at_fork); Amazon Linux 2023 packages 3.11
+echo "installing python3.11 and some build tools"
 yum -y install libffi-devel
 yum -y install gcc
-yum -y install python34
-yum -y install python34-virtualenv
+yum -y install python3.11
+yum -y install python3.11-devel
 
 echo "adding user 'apothecary'"
 adduser apothecary
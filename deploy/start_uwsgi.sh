@@ -13,11 +13,26 @@
 # This script preserves the virtualenv for uwsgi, but it can be run in the background
 
 source venv/bin/activate
+
+# Set APOTHECARY_ASYNC_CORES (e.g. 100) to serve that many requests at once in each worker on gevent.  boto3's
+# blocking DynamoDB calls become cooperative under --gevent-monkey-patch, so a worker isn't tied up by one round trip.
+# Raise DYNAMODB_MAX_POOL_CONNECTIONS in websiteconfig.py to match.
+async_options=""
+if [ -n "$APOTHECARY_ASYNC_CORES" ]; then
+  async_options="--gevent $APOTHECARY_ASYNC_CORES --gevent-monkey-patch"
+fi
+
+# The app (and its warm-up) is loaded once in the master and shared with the forked workers, so no --lazy-apps.
+# --cache2 is the cache the workers share content through (DAO_CACHE_BACKEND = 'uwsgi' in websiteconfig.py).
 uwsgi \
+  --master \
+  --cache2 name=apothecary,items=2048,blocksize=4096,bitmap=1 \
   -s /tmp/apothecary.sock \
   --manage-script-name \
   --mount /=apothecary:app \
   --virtualenv ./venv \
   --chmod-socket=766 \
+  --enable-threads \
   --plugin python3 \
-  --logto "$(pwd)/uwsgi.log"
+  --logto "$(pwd)/uwsgi.log" \
+  $async_options
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+Usage:
+  freeze.py [options]
+
+Pre-render the GET pages of apothecary to static HTML (plus precompressed .gz variants) so nginx can serve them
+without going through uWSGI or DynamoDB.  Only pages whose source items (or templates, or assets) changed since the last run
+are re-rendered.  With --watch, it then keeps re-rendering the pages of each item the change feed reports changed.
+
+Options:
+  -o --output <dir>       Directory to write pages to [default: build]
+  --prefix <prefix>       Prefix for dynamodb table names
+  --force                 Re-render every page, even if nothing changed
+  --watch                 Keep running, re-rendering pages as the change feed reports their items changed
+  --feed <url>            Change feed to watch, if not CHANGE_FEED in websiteconfig.py (see apothecary/streams.py)
+  --log-level <level>     Log level [default: INFO]
+"""
+
+import gzip
+import hashlib
+import logging
+import os
+import time
+import simplejson as json
+import apothecary
+from apothecary import (app, affected_paths, asset_manifest, common_sources, content_classes, dynamodb_manager, model,
+                        page_sources, responsive_images)
+from apothecary.streams import ChangeConsumer, open_feed
+from docopt import docopt
+
+manifest_name = '.freeze-manifest.json'
+
+
+def source_items(dynamodb, source):
+    if isinstance(source, tuple):
+        return [item.encode_item() for item in model.batch_get_many(dynamodb, [source]) if item is not None]
+    return sorted([item.encode_item() for item in source.scan(dynamodb)], key=lambda item: json.dumps(item, sort_keys=True))
+
+
+def templates_digest():
+    digest = hashlib.sha256()
+    for (dirpath, dirnames, filenames) in sorted(os.walk(os.path.join(app.root_path, app.template_folder))):
+        for filename in sorted(filenames):
+            with open(os.path.join(dirpath, filename), 'rb') as f:
+                digest.update(f.read())
+    # pages link to fingerprinted assets, so a rebuilt asset means a changed page
+    digest.update(json.dumps([asset_manifest, responsive_images], sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def page_digest(dynamodb, path, base_digest):
+    digest = hashlib.sha256(base_digest.encode('utf-8'))
+    for source in common_sources + page_sources[path]:
+        digest.update(json.dumps(source_items(dynamodb, source), sort_keys=True, use_decimal=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def page_file(output, path):
+    return os.path.join(output, path.strip('/'), 'index.html')
+
+
+def write_atomically(filename, data):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_filename, filename)
+
+
+def remove_page(filename):
+    for stale in (filename, filename + '.gz'):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+
+def freeze(output, force=False, paths=None):
+    manifest_file = os.path.join(output, manifest_name)
+    manifest = {}
+    if os.path.exists(manifest_file) and not force:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+
+    dynamodb = dynamodb_manager.resource()
+    base_digest = templates_digest()
+    client = app.test_client()
+    for path in sorted(paths or page_sources):
+        filename = page_file(output, path)
+        digest = page_digest(dynamodb, path, base_digest)
+        if manifest.get(path) == digest and os.path.exists(filename):
+            logging.info('Unchanged: %s', path)
+            continue
+
+        response = client.get(path)
+        if response.status_code != 200:
+            # leave it to uWSGI rather than serve a stale copy
+            logging.warning('Got %s rendering %s; not freezing it', response.status_code, path)
+            remove_page(filename)
+            manifest.pop(path, None)
+            continue
+
+        body = response.get_data()
+        write_atomically(filename, body)
+        write_atomically(filename + '.gz', gzip.compress(body, compresslevel=9, mtime=0))
+        manifest[path] = digest
+        logging.info('Froze %s to %s', path, filename)
+
+    write_atomically(manifest_file, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def watch(output, feed_url, force=False):
+    '''
+    Freeze every page, then re-freeze the pages rendering each item feed_url reports changed, until interrupted.
+    '''
+    # this process applies the feed itself, between renders, rather than in the app's background thread
+    apothecary.change_consumer = None
+    poll_interval = app.config['CHANGE_FEED_POLL_SECONDS']
+    feed = open_feed(feed_url, content_classes, dynamodb_manager, region_name=app.config['AWS_REGION'])
+    consumer = ChangeConsumer(feed, poll_interval)
+    # start reading from now, so a change made during the first freeze is seen afterwards
+    feed.poll()
+    freeze(output, force=force)
+    while True:
+        # drops the changed items and pages from the app's caches too, so they're rendered afresh
+        changes = consumer.apply(feed.poll())
+        paths = set(path for (dao_class, keys) in changes for path in affected_paths(dao_class, keys))
+        if paths:
+            freeze(output, paths=paths)
+        time.sleep(poll_interval)
+
+
+if __name__ == '__main__':
+    options = docopt(__doc__)
+    logging.basicConfig(level=logging.getLevelName(options['--log-level'].upper()))
+    if options['--prefix']:
+        for dao_class in model.all_subclasses(model.DAO):
+            dao_class.add_tablename_prefix(options['--prefix'])
+    if options['--watch']:
+        feed_url = options['--feed'] or app.config['CHANGE_FEED']
+        if not feed_url:
+            raise SystemExit('--watch needs a change feed: --feed <url>, or CHANGE_FEED in websiteconfig.py')
+        watch(options['--output'], feed_url, force=options['--force'])
+    else:
+        freeze(options['--output'], force=options['--force'])
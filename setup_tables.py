@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+"""
+Usage:
+  setup_tables.py [options]
+
+Utility for setting up data model in persistent storage (DynamoDB, or a local backend)
+
+Options:
+  --fresh-tables            Recreate fresh tables.  Will blow away any existing data.
+  --fresh-data              Add all of the data from setup.
+  -p --prefix <prefix>      Prefix table names (with <prefix>_).  Useful for dev environments; the site reads
+                            unprefixed tables, run.py <user>_ ones.
+  --backend <url>           dynamodb, or sqlite:///<file> for a local file [default: dynamodb]
+  --log-level <level>       Log level [default: INFO]
+
+"""
+
+import logging
+from apothecary import model
+from apothecary.backends import open_backend
+from docopt import docopt
+
+if __name__ == '__main__':
+    options = docopt(__doc__)
+    logging.basicConfig(level=logging.getLevelName(options['--log-level'].upper()))
+    model.setup(prefix=options['--prefix'] + '_' if options['--prefix'] else '',
+                fresh_data=options['--fresh-data'],
+                fresh_tables=options['--fresh-tables'],
+                dynamodb=None if options['--backend'] == 'dynamodb' else open_backend(options['--backend']).resource())
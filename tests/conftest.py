@@ -0,0 +1,55 @@
+import pytest
+from apothecary import model
+from apothecary.backends import open_backend
+
+
+@pytest.fixture
+def backend():
+    '''
+    A fresh memory backend with every table created, and nothing left cached from another test.
+    '''
+    backend = open_backend('memory')
+    model.setup(dynamodb=backend.resource())
+    clear_caches()
+    yield backend
+    clear_caches()
+
+
+@pytest.fixture
+def dynamodb(backend):
+    return backend.resource()
+
+
+@pytest.fixture
+def async_dynamodb(dynamodb):
+    return AsyncResource(dynamodb)
+
+
+def clear_caches():
+    for dao_class in model.all_subclasses(model.DAO):
+        if dao_class.cache is not None:
+            dao_class.cache.clear()
+
+
+class AsyncResource(object):
+    '''
+    The part of an aioboto3 DynamoDB resource that aio.py uses, over a local backend.
+    '''
+
+    def __init__(self, dynamodb):
+        self.dynamodb = dynamodb
+
+    async def Table(self, name):
+        return AsyncTable(self.dynamodb.Table(name))
+
+
+class AsyncTable(object):
+    def __init__(self, table):
+        self.table = table
+
+    def __getattr__(self, name):
+        method = getattr(self.table, name)
+
+        async def call(**kwargs):
+            return method(**kwargs)
+        return call
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+from apothecary import aio
+from apothecary.model import Accommodation, AccommodationGroup
+
+
+def accommodation(name, miles):
+    return Accommodation(name, 'https://example.com/' + name, 100, miles, miles * 2)
+
+
+def listed(dynamodb):
+    return [(stored.name, stored.miles_to_reception) for stored in AccommodationGroup.sorted_accommodations(dynamodb)]
+
+
+def group(dynamodb):
+    return AccommodationGroup.decode_item(
+        AccommodationGroup.table(dynamodb).get_item(Key=AccommodationGroup.key_dict(AccommodationGroup.ALL))['Item'])
+
+
+def test_nearest_first(dynamodb):
+    accommodation('Inn', 5).put(dynamodb)
+    accommodation('Hotel', 1).put(dynamodb)
+    accommodation('Motel', 5).put(dynamodb)
+    assert listed(dynamodb) == [('Hotel', 1), ('Inn', 5), ('Motel', 5)]
+
+
+def test_put_replaces_and_delete_removes(dynamodb):
+    accommodation('Inn', 5).put(dynamodb)
+    accommodation('Hotel', 1).put(dynamodb)
+    accommodation('Inn', 0).put(dynamodb)
+    assert listed(dynamodb) == [('Inn', 0), ('Hotel', 1)]
+
+    accommodation('Inn', 0).delete(dynamodb)
+    assert listed(dynamodb) == [('Hotel', 1)]
+    # setup() built it first
+    assert group(dynamodb).version == 5
+
+
+def test_first_write_starts_from_the_table(dynamodb):
+    # written before there was a group, e.g. by an older version
+    AccommodationGroup.table(dynamodb).delete_item(Key=AccommodationGroup.key_dict(AccommodationGroup.ALL))
+    Accommodation.table(dynamodb).put_item(Item=accommodation('Inn', 5).encode_item())
+    accommodation('Hotel', 1).put(dynamodb)
+    assert listed(dynamodb) == [('Hotel', 1), ('Inn', 5)]
+
+
+def test_concurrent_puts_are_all_kept(dynamodb):
+    threads = [threading.Thread(target=accommodation('Hotel {0}'.format(n), n).put, args=(dynamodb,))
+               for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert listed(dynamodb) == [('Hotel {0}'.format(n), n) for n in range(8)]
+    assert group(dynamodb).version == 9
+
+
+def test_rebuild(dynamodb):
+    accommodation('Inn', 5).put(dynamodb)
+    Accommodation.table(dynamodb).put_item(Item=accommodation('Hotel', 1).encode_item())
+    Accommodation.table(dynamodb).delete_item(Key=Accommodation.key_dict('Inn'))
+    assert listed(dynamodb) == [('Inn', 5)]
+
+    AccommodationGroup.rebuild(dynamodb)
+    assert listed(dynamodb) == [('Hotel', 1)]
+
+
+def test_async_api_keeps_the_group(dynamodb, async_dynamodb):
+    async def edit():
+        await aio.put(accommodation('Inn', 5), async_dynamodb)
+        await aio.put(accommodation('Hotel', 1), async_dynamodb)
+        await aio.delete(accommodation('Inn', 5), async_dynamodb)
+    asyncio.run(edit())
+
+    assert listed(dynamodb) == [('Hotel', 1)]
+
+
+def test_update_keeps_the_group(dynamodb):
+    accommodation('One Ocean', 3).put(dynamodb)
+    accommodation('Inn', 5).put(dynamodb)
+    stale = Accommodation.get(dynamodb, 'One Ocean')
+    stale.link = 'https://example.com/stale'
+
+    loaded = Accommodation.get(dynamodb, 'One Ocean')
+    loaded.price = '$999'
+    loaded.miles_to_reception = 9
+    loaded.update(dynamodb)
+    assert listed(dynamodb) == [('Inn', 5), ('One Ocean', 9)]
+    assert AccommodationGroup.sorted_accommodations(dynamodb)[1].price == '$999'
+
+    # only what was written reaches the group, not the rest of a stale object
+    stale.price = '$100'
+    stale.update(dynamodb, fields=['price'])
+    stored = AccommodationGroup.sorted_accommodations(dynamodb)[1]
+    assert (stored.price, stored.link, stored.miles_to_reception) == ('$100', 'https://example.com/One Ocean', 9)
+
+
+def test_async_update_keeps_the_group(dynamodb, async_dynamodb):
+    accommodation('Inn', 5).put(dynamodb)
+    inn = Accommodation.get(dynamodb, 'Inn')
+    inn.price = '$999'
+    asyncio.run(aio.update(inn, async_dynamodb))
+    assert AccommodationGroup.sorted_accommodations(dynamodb)[0].price == '$999'
@@ -0,0 +1,40 @@
+import botocore.exceptions
+import pytest
+from apothecary import model
+from apothecary.backends import SQLiteBackend
+from apothecary.model import Meal, RSVP
+
+
+@pytest.fixture
+def filename(tmp_path):
+    filename = str(tmp_path / 'apothecary.db')
+    model.setup(dynamodb=SQLiteBackend(filename))
+    return filename
+
+
+def test_sqlite_sees_another_process_update_a_table(filename):
+    worker = SQLiteBackend(filename)
+    assert worker.describe_table(TableName='RSVP')['Table']['GlobalSecondaryIndexes']
+
+    # as setup_tables.py run alongside the site would
+    SQLiteBackend(filename).update_table(TableName='RSVP', GlobalSecondaryIndexUpdates=[
+        {'Delete': {'IndexName': 'response_status-index'}}])
+    assert not worker.describe_table(TableName='RSVP')['Table'].get('GlobalSecondaryIndexes')
+
+
+def test_sqlite_sees_another_process_drop_a_table(filename):
+    worker = SQLiteBackend(filename)
+    Meal('Beef').put(worker)
+    assert Meal._get(worker, 'Beef').name == 'Beef'
+
+    Meal.table(SQLiteBackend(filename)).delete()
+    with pytest.raises(botocore.exceptions.ClientError) as raised:
+        Meal._get(worker, 'Beef')
+    assert raised.value.response['Error']['Code'] == 'ResourceNotFoundException'
+
+
+def test_sqlite_query_on_a_secondary_index(filename):
+    backend = SQLiteBackend(filename)
+    RSVP('Ann', '', '', 1, '', '', meal_preference={'Beef': 1}).put(backend)
+    RSVP('Bob', '', '', 0, '', '').put(backend)
+    assert [rsvp.rsvp_id for rsvp in RSVP.responses(backend)] == ['ann']
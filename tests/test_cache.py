@@ -0,0 +1,221 @@
+import threading
+import time
+import flask
+from apothecary.cache import LocalCache
+from apothecary.model import Meal
+from apothecary.pagecache import PageCache
+from apothecary.sharedcache import MemoryStore, TieredCache, serializers
+
+
+def blocked_loader(value, calls):
+    '''
+    A loader that waits for release.set(), so the test can act while it runs.
+    '''
+    started = threading.Event()
+    release = threading.Event()
+
+    def loader():
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value
+    return (loader, started, release)
+
+
+def test_single_flight():
+    cache = LocalCache('test')
+    calls = []
+    (loader, started, release) = blocked_loader('loaded', calls)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load('key', loader))) for n in range(5)]
+    for thread in threads:
+        thread.start()
+    started.wait(5)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ['loaded']
+    assert results == ['loaded'] * 5
+    assert cache.get('key') == 'loaded'
+
+
+def test_load_overtaken_by_invalidation_is_not_cached():
+    cache = LocalCache('test')
+
+    def loader():
+        # another thread's write lands while this one reads
+        cache.invalidate('key')
+        return 'stale'
+
+    assert cache.get_or_load('key', loader) == 'stale'
+    assert cache.get('key') is None
+    assert cache.get_or_load('key', lambda: 'fresh') == 'fresh'
+    assert cache.get('key') == 'fresh'
+
+
+def test_miss_after_invalidation_does_not_wait_for_the_earlier_load():
+    cache = LocalCache('test')
+    calls = []
+    (loader, started, release) = blocked_loader('stale', calls)
+    leader = threading.Thread(target=cache.get_or_load, args=('key', loader))
+    leader.start()
+    started.wait(5)
+
+    cache.invalidate('key')
+    assert cache.get_or_load('key', lambda: 'fresh') == 'fresh'
+    release.set()
+    leader.join()
+
+    assert cache.get('key') == 'fresh'
+
+
+def test_clear_overtaking_a_load():
+    cache = LocalCache('test')
+
+    def loader():
+        cache.clear()
+        return 'stale'
+
+    cache.get_or_load('key', loader)
+    assert cache.get('key') is None
+
+
+def test_tiered_cache_does_not_share_an_overtaken_load(monkeypatch):
+    store = MemoryStore()
+    cache = TieredCache('test', store, serializers['pickle'])
+
+    invalidations = cache.invalidations()
+    cache.invalidate('key')
+    assert cache.set('key', 'stale', invalidations) is False
+
+    # nor does another worker's cache, reading the store
+    other = TieredCache('test', store, serializers['pickle'])
+    assert other.get('key') is None
+
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 5)
+    assert cache.set('key', 'fresh', cache.invalidations()) is True
+    assert other.get('key') == 'fresh'
+
+
+def test_dao_get_overtaken_by_a_write(dynamodb, monkeypatch):
+    monkeypatch.setattr(Meal, 'cache', LocalCache('Meal'))
+    Meal('Beef', 'Steak').put(dynamodb)
+    _get = Meal._get
+    writes = [Meal('Beef', 'Brisket')]
+
+    def racing_get(dynamodb, hash_key, range_key=None):
+        loaded = _get(dynamodb, hash_key, range_key)
+        while writes:
+            writes.pop().put(dynamodb)
+        return loaded
+    monkeypatch.setattr(Meal, '_get', racing_get)
+
+    assert Meal.get(dynamodb, 'Beef').description == 'Steak'
+    assert Meal.get(dynamodb, 'Beef').description == 'Brisket'
+
+
+def test_page_render_overtaken_by_an_invalidation_is_not_stored():
+    pages = PageCache()
+    token = pages.token('/travel/')
+    pages.invalidate(['/travel/'])
+    page = pages.store('/travel/', flask.Response('stale'), token)
+
+    assert page.body == b'stale'
+    assert pages.get('/travel/') is None
+
+    pages.store('/travel/', flask.Response('fresh'), pages.token('/travel/'))
+    assert pages.get('/travel/').body == b'fresh'
+
+
+def test_page_render_overtaken_by_a_purge_is_not_stored():
+    pages = PageCache()
+    token = pages.token('/story/')
+    pages.purge()
+    pages.store('/story/', flask.Response('stale'), token)
+    assert pages.get('/story/') is None
+
+
+def test_page_invalidations_from_many_threads_all_count():
+    pages = PageCache()
+    token = pages.token('/travel/')
+    threads = [threading.Thread(target=lambda: [pages.invalidate(['/travel/']) for n in range(500)])
+               for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert pages.token('/travel/') == (token[0], token[1] + 4000)
+
+
+def worker(store):
+    # a worker process's cache of the store the workers share
+    return TieredCache('test', store, serializers['pickle'])
+
+
+def test_tiered_cache_load_overtaken_in_another_process_is_not_shared():
+    store = MemoryStore()
+    (loading, writing, other) = (worker(store), worker(store), worker(store))
+
+    invalidations = loading.invalidations()
+    # another worker writes the item, and invalidates it, while this one reads it
+    writing.invalidate('key')
+    assert loading.set('key', 'stale', invalidations) is False
+
+    assert other.get('key') is None
+    assert loading.get('key') is None
+
+
+def test_tiered_cache_load_overtaken_by_a_clear_in_another_process_is_not_shared():
+    store = MemoryStore()
+    (loading, clearing, other) = (worker(store), worker(store), worker(store))
+
+    invalidations = loading.invalidations()
+    clearing.clear()
+    assert loading.set('key', 'stale', invalidations) is False
+    assert other.get('key') is None
+
+
+def test_tiered_cache_get_or_load_racing_another_process():
+    store = MemoryStore()
+    (loading, writing, other) = (worker(store), worker(store), worker(store))
+
+    def loader():
+        writing.invalidate('key')
+        return 'stale'
+
+    assert loading.get_or_load('key', loader) == 'stale'
+    assert other.get('key') is None
+
+
+def test_tiered_cache_shares_a_load_nothing_overtook(monkeypatch):
+    store = MemoryStore()
+    (loading, writing, other) = (worker(store), worker(store), worker(store))
+    writing.invalidate('key')
+
+    # long enough after the invalidation that the clocks of different hosts can't have it the wrong way round
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 5)
+    assert loading.get_or_load('key', lambda: 'fresh') == 'fresh'
+    assert other.get('key') == 'fresh'
+
+
+def test_tiered_cache_hit_in_the_store_invalidated_while_read_is_not_kept(monkeypatch):
+    store = MemoryStore()
+    (reading, writing) = (worker(store), worker(store))
+    writing.set('key', 'stale')
+    shared_key = reading.shared_key('key')
+    get = store.get
+
+    def racing_get(key):
+        data = get(key)
+        if key == shared_key:
+            # the write lands in this process while the store is read
+            reading.invalidate('key')
+        return data
+    monkeypatch.setattr(store, 'get', racing_get)
+
+    assert reading.get('key') == 'stale'
+    assert LocalCache.get(reading, 'key') is None
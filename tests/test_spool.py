@@ -0,0 +1,156 @@
+import os
+import threading
+import time
+import pytest
+import apothecary
+from apothecary import spool
+from apothecary.backends import LocalTable, client_error
+from apothecary.model import RSVP, Meal
+from apothecary.spool import WriteSpool
+
+
+@pytest.fixture
+def write_spool(backend, tmp_path, monkeypatch):
+    monkeypatch.setattr(spool, 'backoff', lambda retries: None)
+    write_spool = WriteSpool(str(tmp_path), backend, max_retries=2)
+    # drained by the tests rather than a worker thread
+    write_spool._pid = os.getpid()
+    write_spool._wake = threading.Event()
+    return write_spool
+
+
+def rsvp(name, meal_preference=None):
+    return RSVP(name, name + '@example.com', '1 Main St', 1, 'none', '', meal_preference=meal_preference or {'Beef': 1})
+
+
+def drain(write_spool):
+    while write_spool.drain():
+        pass
+
+
+def spooled(write_spool, subdirectory):
+    path = os.path.join(write_spool.directory, subdirectory)
+    return sorted(os.listdir(path)) if os.path.exists(path) else []
+
+
+def fail_put_item(monkeypatch, code, should_fail):
+    put_item = LocalTable.put_item
+    calls = []
+
+    def failing_put_item(self, Item, **kwargs):
+        calls.append(Item)
+        if should_fail(Item):
+            raise client_error('PutItem', code, 'Failed by the test')
+        return put_item(self, Item, **kwargs)
+    monkeypatch.setattr(LocalTable, 'put_item', failing_put_item)
+    return calls
+
+
+def test_throttled_write_is_retried(write_spool, dynamodb, monkeypatch):
+    calls = fail_put_item(monkeypatch, 'ProvisionedThroughputExceededException',
+                          lambda item: item.get('rsvp_id') == 'ann' and len(calls) <= 2)
+    write_spool.submit('put', rsvp('Ann'))
+    drain(write_spool)
+
+    assert RSVP.get(dynamodb, 'ann').meal_preference == {'Beef': 1}
+    assert spooled(write_spool, 'new') == []
+    assert spooled(write_spool, 'failed') == []
+
+
+def test_write_still_throttled_after_retries_stays_spooled(write_spool, dynamodb, monkeypatch):
+    fail_put_item(monkeypatch, 'ThrottlingException', lambda item: item.get('rsvp_id') == 'ann')
+    write_spool.submit('put', rsvp('Ann'))
+
+    assert write_spool.drain() is False
+    assert len(spooled(write_spool, 'new')) == 1
+    assert spooled(write_spool, 'failed') == []
+
+    monkeypatch.undo()
+    monkeypatch.setattr(spool, 'backoff', lambda retries: None)
+    drain(write_spool)
+    assert spooled(write_spool, 'new') == []
+    assert RSVP.get(dynamodb, 'ann').name == 'Ann'
+
+
+def test_rejected_write_is_set_aside(write_spool, dynamodb, monkeypatch):
+    calls = fail_put_item(monkeypatch, 'ValidationException', lambda item: item.get('rsvp_id') == 'bad')
+    for name in ('Ann', 'Bad', 'Cat'):
+        write_spool.submit('put', rsvp(name))
+    drain(write_spool)
+
+    # not retried, and not holding up the others
+    assert len([item for item in calls if item.get('rsvp_id') == 'bad']) == 1
+    assert len(spooled(write_spool, 'failed')) == 1
+    assert spooled(write_spool, 'new') == []
+    assert RSVP.get(dynamodb, 'ann').name == 'Ann'
+    assert RSVP.get(dynamodb, 'cat').name == 'Cat'
+    with pytest.raises(KeyError):
+        RSVP.get(dynamodb, 'bad')
+
+
+def test_unreadable_submission_is_set_aside(write_spool, dynamodb):
+    write_spool.submit('put', rsvp('Ann'))
+    with open(os.path.join(write_spool.directory, 'new', '0-garbage.json'), 'w') as f:
+        f.write('{not json')
+    drain(write_spool)
+
+    assert spooled(write_spool, 'failed') == ['0-garbage.json']
+    assert RSVP.get(dynamodb, 'ann').name == 'Ann'
+
+
+def test_puts_of_batch_put_classes_are_batched(write_spool, backend, dynamodb, monkeypatch):
+    batches = []
+    batch_write_item = backend.batch_write_item
+
+    def recording_batch_write_item(RequestItems, **kwargs):
+        batches.append({name: len(requests) for (name, requests) in RequestItems.items()})
+        return batch_write_item(RequestItems=RequestItems, **kwargs)
+    monkeypatch.setattr(backend, 'batch_write_item', recording_batch_write_item)
+
+    write_spool.submit('put', Meal('Beef', 'Steak'))
+    write_spool.submit('put', Meal('Fish', 'Salmon'))
+    write_spool.submit('put', Meal('Beef', 'Brisket'))
+    write_spool.submit('put', rsvp('Ann'))
+    drain(write_spool)
+
+    # only the latest put of each Meal, and none of the RSVP, which keeps its totals
+    assert batches == [{'Meal': 2}]
+    assert Meal.get(dynamodb, 'Beef').description == 'Brisket'
+    assert RSVP.get(dynamodb, 'ann').name == 'Ann'
+    assert spooled(write_spool, 'new') == []
+
+
+def test_rejected_batch_sets_aside_only_the_bad_puts(write_spool, dynamodb, monkeypatch):
+    fail_put_item(monkeypatch, 'ValidationException', lambda item: item.get('name') == 'Bad')
+    for name in ('Beef', 'Bad', 'Fish'):
+        write_spool.submit('put', Meal(name))
+    drain(write_spool)
+
+    assert len(spooled(write_spool, 'failed')) == 1
+    assert spooled(write_spool, 'new') == []
+    assert Meal.get(dynamodb, 'Beef').name == 'Beef'
+    assert Meal.get(dynamodb, 'Fish').name == 'Fish'
+
+
+def test_first_request_drains_what_was_left_spooled(backend, dynamodb, tmp_path, monkeypatch):
+    left = WriteSpool(str(tmp_path), backend, poll_interval=0.05)
+    left._pid = os.getpid()
+    left._wake = threading.Event()
+    left.submit('put', rsvp('Ann'))
+    # and one a worker that has since died had claimed
+    dead = os.path.join(str(tmp_path), 'claimed', '999999999')
+    os.makedirs(dead)
+    left.submit('put', rsvp('Bob'))
+    name = spooled(left, 'new')[-1]
+    os.rename(os.path.join(str(tmp_path), 'new', name), os.path.join(dead, name))
+
+    restarted = WriteSpool(str(tmp_path), backend, poll_interval=0.05)
+    monkeypatch.setattr(apothecary, 'rsvp_spool', restarted)
+    apothecary.app.test_client().get('/metrics')
+
+    for attempt in range(100):
+        if not spooled(restarted, 'new') and not os.listdir(dead):
+            break
+        time.sleep(0.05)
+    assert RSVP.get(dynamodb, 'ann').name == 'Ann'
+    assert RSVP.get(dynamodb, 'bob').name == 'Bob'
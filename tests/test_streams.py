@@ -0,0 +1,87 @@
+import pytest
+from apothecary import model, streams
+from apothecary.model import Couple, Meal
+from apothecary.streams import ChangeConsumer, FileFeed, publish_writes
+
+
+@pytest.fixture
+def notified(monkeypatch):
+    notified = []
+    monkeypatch.setattr(model, 'notify_changed', lambda dao_class, keys: notified.append((dao_class, keys)))
+    return notified
+
+
+@pytest.fixture
+def feed(tmp_path):
+    return FileFeed(str(tmp_path / 'changes'), (Meal, Couple))
+
+
+def test_apply_once_per_item(feed, notified):
+    changes = [(Meal, {'name': 'Beef'}), (Couple, {'couple_id': '0'}), (Meal, {'name': 'Beef'}), (Meal, None),
+               (Meal, {'name': 'Fish'}), (Meal, None)]
+    distinct = ChangeConsumer(feed).apply(changes)
+
+    assert distinct == [(Meal, {'name': 'Beef'}), (Couple, {'couple_id': '0'}), (Meal, None), (Meal, {'name': 'Fish'})]
+    assert notified == distinct
+
+
+def test_feed_starts_at_the_end(feed):
+    feed.publish(Meal, {'name': 'Beef'})
+    assert feed.poll() == []
+
+    feed.publish(Meal, {'name': 'Fish'})
+    feed.publish(Couple, {'couple_id': '0'})
+    assert feed.poll() == [(Meal, {'name': 'Fish'}), (Couple, {'couple_id': '0'})]
+    assert feed.poll() == []
+
+
+def test_feed_reads_from_the_start_of_a_new_file(feed):
+    assert feed.poll() == []
+    feed.publish(Meal, {'name': 'Beef'})
+    assert feed.poll() == [(Meal, {'name': 'Beef'})]
+
+
+def test_feed_leaves_a_partial_line_for_the_next_poll(feed):
+    feed.poll()
+    feed.publish(Meal, {'name': 'Beef'})
+    with open(feed.path, 'a') as f:
+        f.write('{"table": "Meal", "keys": {"name": "Fi')
+    assert feed.poll() == [(Meal, {'name': 'Beef'})]
+
+    with open(feed.path, 'a') as f:
+        f.write('sh"}, "time": 0}\n')
+    assert feed.poll() == [(Meal, {'name': 'Fish'})]
+
+
+def test_feed_skips_other_tables_and_unreadable_lines(feed):
+    feed.poll()
+    with open(feed.path, 'a') as f:
+        f.write('{"table": "RSVP", "keys": {"rsvp_id": "ann"}, "time": 0}\n')
+        f.write('not json\n')
+    feed.publish(Meal, {'name': 'Beef'})
+    assert feed.poll() == [(Meal, {'name': 'Beef'})]
+
+
+def test_feed_starts_over_when_the_file_is_truncated(feed):
+    feed.poll()
+    for name in ('Beef', 'Fish', 'Veg'):
+        feed.publish(Meal, {'name': name})
+    assert len(feed.poll()) == 3
+
+    open(feed.path, 'w').close()
+    feed.publish(Meal, {'name': 'Lamb'})
+    assert feed.poll() == [(Meal, {'name': 'Lamb'})]
+
+
+def test_replayed_changes_are_not_published_again(feed, dynamodb, monkeypatch):
+    monkeypatch.setattr(model, 'change_listeners', list(model.change_listeners))
+    publish_writes(feed, (Meal,))
+    feed.poll()
+
+    Meal('Beef').put(dynamodb)
+    changes = feed.poll()
+    assert changes == [(Meal, {'name': 'Beef'})]
+
+    ChangeConsumer(feed).apply(changes)
+    assert feed.poll() == []
+    assert not getattr(streams.replaying, 'active', False)
@@ -0,0 +1,147 @@
+import asyncio
+from apothecary import aio
+from apothecary.model import RSVP, RSVPTotals
+
+
+def rsvp(name, guests=0, meal_preference=None, declined=False):
+    return RSVP(name, name + '@example.com', '1 Main St', guests, 'none', '', declined=declined,
+                meal_preference=meal_preference or {})
+
+
+def totals(dynamodb):
+    stored = RSVPTotals.get(dynamodb)
+    return (stored.responses, stored.declined, stored.guests,
+            {meal: number for (meal, number) in stored.meals.items() if number})
+
+
+def test_no_rsvps(dynamodb):
+    assert totals(dynamodb) == (0, 0, 0, {})
+
+
+def test_save_the_date_adds_nothing(dynamodb):
+    rsvp('Ann').put(dynamodb)
+    assert totals(dynamodb) == (0, 0, 0, {})
+
+
+def test_put_resubmit_decline_and_delete(dynamodb):
+    rsvp('Ann', 2, {'Beef': 1, 'Fish': 1}).put(dynamodb)
+    rsvp('Bob', 1, {'Beef': 1}).put(dynamodb)
+    assert totals(dynamodb) == (2, 0, 3, {'Beef': 2, 'Fish': 1})
+
+    # a resubmission replaces the earlier answer rather than counting again
+    rsvp('Ann', 1, {'Fish': 1}).put(dynamodb)
+    assert totals(dynamodb) == (2, 0, 2, {'Beef': 1, 'Fish': 1})
+
+    rsvp('Bob', declined=True).put(dynamodb)
+    assert totals(dynamodb) == (2, 1, 1, {'Fish': 1})
+
+    rsvp('Ann').delete(dynamodb)
+    assert totals(dynamodb) == (1, 1, 0, {})
+
+
+def test_update_for_rsvp(dynamodb):
+    rsvp('Ann').put(dynamodb)
+    rsvp('Ann', 2, {'Beef': 2}).update_for_rsvp(dynamodb)
+    assert totals(dynamodb) == (1, 0, 2, {'Beef': 2})
+
+    rsvp('Ann', 3, {'Beef': 1, 'Veg': 2}).update_for_rsvp(dynamodb)
+    assert totals(dynamodb) == (1, 0, 3, {'Beef': 1, 'Veg': 2})
+
+    rsvp('Ann', declined=True).update_for_rsvp(dynamodb)
+    assert totals(dynamodb) == (1, 1, 0, {})
+
+
+def test_recount_matches_running_totals(dynamodb):
+    rsvp('Ann', 2, {'Beef': 2}).put(dynamodb)
+    rsvp('Bob', 1, {'Fish': 1}).update_for_rsvp(dynamodb)
+    rsvp('Cat', declined=True).put(dynamodb)
+    rsvp('Dan').put(dynamodb)
+    rsvp('Bob', 2, {'Fish': 1, 'Veg': 1}).put(dynamodb)
+    running = totals(dynamodb)
+
+    RSVPTotals.recount(dynamodb)
+    assert totals(dynamodb) == running == (3, 1, 4, {'Beef': 2, 'Fish': 1, 'Veg': 1})
+
+
+def test_async_api_keeps_the_same_totals(dynamodb, async_dynamodb):
+    async def respond():
+        await aio.put(rsvp('Ann', 2, {'Beef': 2}), async_dynamodb)
+        await aio.update_for_rsvp(rsvp('Bob', 1, {'Fish': 1}), async_dynamodb)
+        await aio.update_for_rsvp(rsvp('Ann', 1, {'Fish': 1}), async_dynamodb)
+        await aio.update_for_rsvp(rsvp('Bob', declined=True), async_dynamodb)
+    asyncio.run(respond())
+    assert totals(dynamodb) == (2, 1, 1, {'Fish': 1})
+
+    asyncio.run(aio.delete(rsvp('Bob'), async_dynamodb))
+    assert totals(dynamodb) == (1, 0, 1, {'Fish': 1})
+
+
+def test_update(dynamodb):
+    rsvp('Ann', 2, {'Beef': 2}).put(dynamodb)
+    ann = RSVP.get(dynamodb, 'ann')
+    ann.declined = True
+    ann.update(dynamodb)
+    assert totals(dynamodb) == (1, 1, 0, {})
+
+    ann.declined = False
+    ann.meal_preference = {'Fish': 1}
+    ann.guests = 1
+    ann.update(dynamodb, fields=['declined', 'meal_preference'])
+    # guests is written later
+    assert totals(dynamodb) == (1, 0, 2, {'Fish': 1})
+    ann.update(dynamodb)
+    assert totals(dynamodb) == (1, 0, 1, {'Fish': 1})
+
+
+def test_update_of_a_document_path(dynamodb):
+    rsvp('Ann', 2, {'Beef': 2}).put(dynamodb)
+    ann = RSVP.get(dynamodb, 'ann')
+    ann.meal_preference['Beef'] = 1
+    ann.update(dynamodb, fields=['meal_preference.Beef'])
+    assert totals(dynamodb) == (1, 0, 2, {'Beef': 1})
+
+
+def test_update_returns_what_was_asked_for(dynamodb):
+    rsvp('Ann', 2, {'Beef': 2}).put(dynamodb)
+    ann = RSVP.get(dynamodb, 'ann')
+    ann.guests = 3
+    assert ann.update(dynamodb, return_values='UPDATED_OLD') == {'guests': 2}
+    ann.guests = 4
+    assert ann.update(dynamodb, return_values='ALL_NEW')['guests'] == 4
+    assert ann.update(dynamodb, fields=['guests']) == {}
+
+
+def test_async_update(dynamodb, async_dynamodb):
+    rsvp('Ann', 2, {'Beef': 2}).put(dynamodb)
+    ann = RSVP.get(dynamodb, 'ann')
+    ann.declined = True
+    asyncio.run(aio.update(ann, async_dynamodb))
+    assert totals(dynamodb) == (1, 1, 0, {})
+
+
+def test_responses_reads_only_those_that_responded(dynamodb):
+    rsvp('Ann', 1, {'Beef': 1}).put(dynamodb)
+    rsvp('Bob', declined=True).put(dynamodb)
+    rsvp('Cat').put(dynamodb)
+
+    assert sorted(response.rsvp_id for response in RSVP.responses(dynamodb)) == ['ann', 'bob']
+    assert [response.rsvp_id for response in RSVP.responses(dynamodb, statuses=[RSVP.DECLINED])] == ['bob']
+
+
+def test_update_keeps_response_status(dynamodb):
+    rsvp('Ann', 1, {'Beef': 1}).put(dynamodb)
+    ann = RSVP.get(dynamodb, 'ann')
+    ann.declined = True
+    assert ann.update(dynamodb, return_values='ALL_NEW')['response_status'] == RSVP.DECLINED
+    assert [response.rsvp_id for response in RSVP.responses(dynamodb, statuses=[RSVP.DECLINED])] == ['ann']
+    assert list(RSVP.responses(dynamodb, statuses=[RSVP.ATTENDING])) == []
+
+    ann.declined = False
+    ann.meal_preference = {}
+    ann.update(dynamodb)
+    assert 'response_status' not in RSVP.get(dynamodb, 'ann').as_dict()
+    assert list(RSVP.responses(dynamodb)) == []
+
+    ann.meal_preference = {'Fish': 2}
+    ann.update(dynamodb, fields=['meal_preference'])
+    assert RSVP.get(dynamodb, 'ann').response_status == RSVP.ATTENDING
@@ -0,0 +1,42 @@
+import pytest
+from apothecary.model import Meal, RSVP
+
+
+def rsvp(name):
+    return RSVP(name, name + '@example.com', '1 Main St', 1, 'none', '', meal_preference={'Beef': 1})
+
+
+def test_update_of_a_new_object_writes_all_but_the_key(dynamodb):
+    Meal('Fish', 'Salmon').update(dynamodb)
+    assert Meal.get(dynamodb, 'Fish').description == 'Salmon'
+
+
+def test_naming_a_key_attribute_is_an_error(dynamodb):
+    with pytest.raises(ValueError):
+        Meal('Fish', 'Salmon').update(dynamodb, fields=['name'])
+
+
+def test_update_writes_only_what_was_assigned(dynamodb):
+    rsvp('Ann').put(dynamodb)
+    stale = RSVP.get(dynamodb, 'ann')
+    loaded = RSVP.get(dynamodb, 'ann')
+    stale.notes = 'stale'
+    stale.put(dynamodb)
+
+    loaded.email = 'ann@example.org'
+    loaded.update(dynamodb)
+    stored = RSVP.get(dynamodb, 'ann')
+    assert (stored.email, stored.notes) == ('ann@example.org', 'stale')
+
+
+def test_fields_not_written_stay_dirty(dynamodb):
+    loaded = rsvp('Ann')
+    loaded.put(dynamodb)
+    loaded.email = 'ann@example.org'
+    loaded.notes = 'vegetarian'
+    loaded.update(dynamodb, fields=['email'])
+    assert loaded.dirty_fields() == ['notes']
+
+    loaded.update(dynamodb)
+    assert loaded.dirty_fields() == []
+    assert RSVP.get(dynamodb, 'ann').notes == 'vegetarian'
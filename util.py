@@ -1,70 +1,96 @@
 #!/usr/bin/env python
 """
 Usage:
-  util.py [options] ( dump_rsvp | dump_save_the_date | cleanup_rsvp | raw_dump_rsvp | dump_meal_rsvps )
+  util.py [options] ( dump_rsvp | dump_save_the_date | cleanup_rsvp | raw_dump_rsvp | dump_meal_rsvps | backfill_rsvp_status )
 
 Options:
   --prefix <prefix>       Prefix for dynamodb table names
   --log-level <level>     Log level [default: INFO]
   --log-file <file>       Log file
+  --segments <n>          Scan each table in this many parallel segments [default: 1]
+  --capacity <units>      Read capacity units per second each scan or query may consume (default: unlimited)
+  --format <format>       Format of dump_rsvp and dump_save_the_date: csv, csv.gz or parquet [default: csv]
+  --output <file>         File to dump to (default: stdout)
+  --columns <names>       Comma-separated fields to dump (default: all)
+  --recount               Rebuild the RSVP totals dump_meal_rsvps reads from a scan of every RSVP first
 """
 
 import __main__
 import sys
-import boto3
 import logging
 import simplejson as json
-from apothecary import model
+from apothecary import export, model
+from apothecary.connection import DynamoDBManager
 from docopt import docopt
-from functools import reduce
+
+def connect(options):
+    # a pooled connection for each segment scanning at once
+    return DynamoDBManager(max_pool_connections=max(10, int(options['--segments']))).resource()
+
+
+def scan_options(options):
+    return {
+        'segments': int(options['--segments']),
+        'capacity_per_second': float(options['--capacity']) if options['--capacity'] else None
+    }
+
+
+def query_options(options):
+    return {
+        'capacity_per_second': float(options['--capacity']) if options['--capacity'] else None
+    }
+
 
 def dump_rsvp(options):
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = connect(options)
     if options['--prefix']:
         model.RSVP.add_tablename_prefix(options['--prefix'])
         options['--prefix'] = None
+    columns = export.columns(model.RSVP, options['--columns'].split(',') if options['--columns'] else None)
     if options['dump_rsvp']:
         logging.info('ONLY DUMPING RSVPS')
-        rsvps = model.RSVP.scan_for_rsvp(dynamodb)
+        # only the columns being dumped, of only the RSVPs that have responded
+        rsvps = model.RSVP.responses(dynamodb, projection=columns if options['--columns'] else None,
+                                     **query_options(options))
     else:
-        rsvps = model.RSVP.scan(dynamodb)
-    header_rsvp = model.RSVP('name',
-                             'email',
-                             'address',
-                             'guests',
-                             'hotel_preference',
-                             'notes',
-                             declined=False,
-                             meal_preference={"meal": "pref"},
-                             rsvp_notes='rsvp_notes')
-    print(header_rsvp.dump_csv_header())
-    for rsvp in rsvps:
-        print(rsvp.dump_csv(ref_obj=header_rsvp))
+        rsvps = model.RSVP.scan(dynamodb, ordered=True, **scan_options(options))
+    count = export.export(rsvps, columns, options['--output'] or '-', options['--format'])
+    logging.info('Dumped %s rows', count)
 
 
 def dump_meal_rsvps(options):
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = connect(options)
     if options['--prefix']:
         model.RSVP.add_tablename_prefix(options['--prefix'])
+        model.RSVPTotals.add_tablename_prefix(options['--prefix'])
+        model.Meal.add_tablename_prefix(options['--prefix'])
         options['--prefix'] = None
-    rsvps = model.RSVP.scan_for_rsvp(dynamodb)
-    meals = model.Meal.scan(dynamodb)
-    meal_names = [meal.name for meal in meals]
+    if options['--recount']:
+        totals = model.RSVPTotals.recount(dynamodb, **query_options(options))
+    else:
+        totals = model.RSVPTotals.get(dynamodb)
+    meal_names = [meal.name for meal in model.Meal.scan(dynamodb)]
+    # and any meal chosen that's since been taken off the menu
+    meal_names += sorted(name for name in totals.meals if name not in meal_names)
 
-    def reduce_meal_pref(meal_names, acc, meal_pref):
-        for meal_name in meal_names:
-            acc[meal_name] = int(acc.get(meal_name, 0))
-            acc[meal_name] += int(meal_pref.get(meal_name, 0))
-        return acc
+    print(model.DAO.quotes_csv(meal_names + ['guests', 'declined', 'responses']))
+    print(model.DAO.quotes_csv([totals.meals.get(name, 0) for name in meal_names]
+                               + [totals.guests, totals.declined, totals.responses]))
 
-    meal_counts = reduce(lambda acc, rsvp : reduce_meal_pref(meal_names, acc, rsvp), [rsvp.meal_preference for rsvp in rsvps if rsvp.meal_preference])
 
-    print(model.DAO.quotes_csv(meal_counts.keys()))
-    print(model.DAO.quotes_csv(meal_counts.values()))
+def backfill_rsvp_status(options):
+    dynamodb = connect(options)
+    if options['--prefix']:
+        model.RSVP.add_tablename_prefix(options['--prefix'])
+        # writes to RSVPs add to the totals, which have to be the prefixed ones too
+        model.RSVPTotals.add_tablename_prefix(options['--prefix'])
+        options['--prefix'] = None
+    count = model.RSVP.backfill_response_status(dynamodb, **scan_options(options))
+    logging.info('Set response_status on %s RSVPs', count)
 
 
 def raw_dump_rsvp(options):
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = connect(options)
     if options['--prefix']:
         model.RSVP.add_tablename_prefix(options['--prefix'])
         options['--prefix'] = None
@@ -74,7 +100,7 @@ def raw_dump_rsvp(options):
     while True:
         last_key = from_dynamo.get('LastEvaluatedKey')
         for item in from_dynamo.get('Items'):
-            logging.debug('loaded: {0}'.format(item))
+            logging.debug('loaded: %s', item)
             print(json.dumps(item, use_decimal=True))
         if not last_key:
             break
@@ -84,18 +110,20 @@ def raw_dump_rsvp(options):
 
 
 def cleanup_rsvp(options):
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = connect(options)
     if options['--prefix']:
         model.RSVP.add_tablename_prefix(options['--prefix'])
+        # writes to RSVPs add to the totals, which have to be the prefixed ones too
+        model.RSVPTotals.add_tablename_prefix(options['--prefix'])
         options['--prefix'] = None
-    rsvps = model.RSVP.scan(dynamodb, FilterExpression=Attr('meal_preference').exists())
+    rsvps = model.RSVP.scan(dynamodb, FilterExpression=Attr('meal_preference').exists(), **scan_options(options))
     for rsvp in rsvps:
         try:
             if isinstance(rsvp, model.RSVP):
-                logging.info('Skipping RSVP that already looks healthy: "{0}"'.format(rsvp))
+                logging.info('Skipping RSVP that already looks healthy: "%s"', rsvp)
                 continue
         except TypeError:
-            logging.info('TypeError on RSVP "{0}".  Maybe it\'s already been cleaned up?'.format(rsvp))
+            logging.info('TypeError on RSVP "%s".  Maybe it\'s already been cleaned up?', rsvp)
             continue
 
         new_rsvp = model.RSVP(rsvp['rsvp_id'], 'email', 'address', 0, 'hotel', 'notes')
@@ -103,69 +131,71 @@ def cleanup_rsvp(options):
         try:
             new_rsvp.meal_preference = rsvp['meal_preference']
         except:
-            logging.warning('Error on RSVP "{0}" "meal_preference": {1}'.format(new_rsvp.rsvp_id, sys.exc_info()[0]))
+            logging.warning('Error on RSVP "%s" "meal_preference": %s', new_rsvp.rsvp_id, sys.exc_info()[0])
             safe_to_update = False
         try:
             new_rsvp.declined = rsvp['declined']['N']
         except:
-            logging.warning('Error on RSVP "{0}" "declined": {1}'.format(new_rsvp.rsvp_id, sys.exc_info()[0]))
+            logging.warning('Error on RSVP "%s" "declined": %s', new_rsvp.rsvp_id, sys.exc_info()[0])
             safe_to_update = False
         try:
             new_rsvp.guests = rsvp['guests']['N']
         except:
-            logging.warning('Error on RSVP "{0}" "guests": {1}'.format(new_rsvp.rsvp_id, sys.exc_info()[0]))
+            logging.warning('Error on RSVP "%s" "guests": %s', new_rsvp.rsvp_id, sys.exc_info()[0])
             safe_to_update = False
         try:
             new_rsvp.rsvp_notes = rsvp['rsvp_notes']['S']
         except:
-            logging.warning('Error on RSVP "{0}" "rsvp_notes": {1}'.format(new_rsvp.rsvp_id, sys.exc_info()[0]))
+            logging.warning('Error on RSVP "%s" "rsvp_notes": %s', new_rsvp.rsvp_id, sys.exc_info()[0])
             safe_to_update = False
         if safe_to_update:
-            logging.info('Updating RSVP {0}'.format(rsvp))
+            logging.info('Updating RSVP %s', rsvp)
             new_rsvp.update_for_rsvp(dynamodb)
 
 
 def cleanup_old_rsvp(options):
-    dynamodb = boto3.resource('dynamodb')
+    dynamodb = connect(options)
     if options['--prefix']:
         model.RSVP.add_tablename_prefix(options['--prefix'])
+        # writes to RSVPs add to the totals, which have to be the prefixed ones too
+        model.RSVPTotals.add_tablename_prefix(options['--prefix'])
         options['--prefix'] = None
-    rsvps = model.RSVP.scan(dynamodb, FilterExpression=Attr('meal_preference').exists())
+    rsvps = model.RSVP.scan(dynamodb, FilterExpression=Attr('meal_preference').exists(), **scan_options(options))
     for rsvp in rsvps:
         try:
             if not isinstance(rsvp, model.RSVP):
-                logging.info('Skipping RSVP that isn\'t old: "{0}"'.format(rsvp))
+                logging.info('Skipping RSVP that isn\'t old: "%s"', rsvp)
                 continue
         except TypeError:
-            logging.info('TypeError on RSVP "{0}".  Maybe it\'s already been cleaned up?'.format(rsvp))
+            logging.info('TypeError on RSVP "%s".  Maybe it\'s already been cleaned up?', rsvp)
             continue
         except KeyError:
-            logging.info('KeyError on RSVP "{0}".  Maybe it\'s already been cleaned up?'.format(rsvp))
+            logging.info('KeyError on RSVP "%s".  Maybe it\'s already been cleaned up?', rsvp)
             continue
 
         safe_to_update = True
         try:
             rsvp.meal_preference = rsvp.meal_preference
         except:
-            logging.warning('Error on RSVP "{0}" "meal_preference": {1}'.format(rsvp.rsvp_id, sys.exc_info()[0]))
+            logging.warning('Error on RSVP "%s" "meal_preference": %s', rsvp.rsvp_id, sys.exc_info()[0])
             safe_to_update = False
         try:
             rsvp.declined = rsvp.declined['N']
         except:
-            logging.warning('Error on RSVP "{0}" "declined": {1}'.format(rsvp.rsvp_id, sys.exc_info()[0]))
+            logging.warning('Error on RSVP "%s" "declined": %s', rsvp.rsvp_id, sys.exc_info()[0])
             safe_to_update = False
         try:
             rsvp.guests = rsvp.guests['N']
         except:
-            logging.warning('Error on RSVP "{0}" "guests": {1}'.format(rsvp.rsvp_id, sys.exc_info()[0]))
+            logging.warning('Error on RSVP "%s" "guests": %s', rsvp.rsvp_id, sys.exc_info()[0])
             safe_to_update = False
         try:
             rsvp.rsvp_notes = rsvp.rsvp_notes['S']
         except:
-            logging.warning('Error on RSVP "{0}" "rsvp_notes": {1}'.format(rsvp.rsvp_id, sys.exc_info()[0]))
+            logging.warning('Error on RSVP "%s" "rsvp_notes": %s', rsvp.rsvp_id, sys.exc_info()[0])
             safe_to_update = False
         if safe_to_update:
-            logging.info('Updating RSVP {0}'.format(rsvp))
+            logging.info('Updating RSVP %s', rsvp)
             rsvp.update_for_rsvp(dynamodb)
 
 
@@ -184,6 +214,8 @@ if __name__ == '__main__':
         dump_rsvp(options)
     if options['dump_meal_rsvps']:
         dump_meal_rsvps(options)
+    if options['backfill_rsvp_status']:
+        backfill_rsvp_status(options)
     if options['cleanup_rsvp']:
         cleanup_rsvp(options)
         cleanup_old_rsvp(options)
@@ -1,2 +1,58 @@
 DEBUG = False
-AWS_REGION = "us-east-1"
\ No newline at end of file
+AWS_REGION = "us-east-1"
+
+# Where the content and RSVPs are kept: 'dynamodb', 'sqlite:///<file>' (a local file, for a small single-host
+# deployment; seed it with `./setup_tables.py --backend sqlite:///<file> --fresh-data`) or 'memory' (per
+# process and empty until seeded, so only for tests and benchmarks).  The local backends (apothecary/backends.py)
+# implement only what the DAO calls, with these limits:
+#  - condition and filter expressions must be boto3 Attr/Key objects, as the DAO builds them, and only the update
+#    and projection expressions are parsed only as far as the DAO writes them
+#  - a query on a secondary index reads the whole table, which is fine for a wedding's worth of items and no more
+#  - no consumed capacity and no streams: use CHANGE_FEED = 'file:///<path>' to share changes between processes
+#  - a sqlite file is shared by the processes on one host only
+STORAGE_BACKEND = 'dynamodb'
+
+# Level of the app log written to apothecary.log (as JSON lines) when not in debug mode
+LOG_LEVEL = "INFO"
+
+# HTTP connections kept alive to DynamoDB by each worker process
+DYNAMODB_MAX_POOL_CONNECTIONS = 10
+
+# Threads per worker for running a page's independent DynamoDB reads in parallel.  0 runs them one after another.
+FAN_OUT_MAX_WORKERS = 4
+
+# Under uWSGI, load content and compile templates before forking workers; /ping is unhealthy until that's done
+WARM_UP = True
+
+# Seconds to cache near-static content (nav, couple, sections, meals, accommodations) in each worker.  0 disables.
+DAO_CACHE_TTL = 60
+DAO_CACHE_MAX_ENTRIES = 256
+
+# Where the workers on a host share that content and rendered markdown, so one read serves them all: 'uwsgi' (the
+# cache deploy/start_uwsgi.sh creates; outside uWSGI, the same as 'local'), 'memcached://127.0.0.1:11211' (needs
+# pymemcache), 'local' (each worker caches on its own) or 'memory' (a stand-in for tests)
+DAO_CACHE_BACKEND = 'uwsgi'
+# How content is kept in the shared cache: 'pickle', or 'json' if anything but this site can write to the cache
+DAO_CACHE_SERIALIZER = 'pickle'
+# Seconds each worker keeps its own copy of what it reads from the shared cache, i.e. how long a change made by
+# another worker can take to show
+DAO_CACHE_LOCAL_TTL = 5
+
+# Where changes to that content are read from, so each worker drops exactly the cached items and pages that changed:
+# 'dynamodb' (the tables' DynamoDB Streams), 'file:///<path>' (an append-only file the processes on one host publish
+# their writes to; for the local backends) or None.  With a feed, DAO_CACHE_TTL and PAGE_CACHE_TTL can be hours.
+CHANGE_FEED = None
+# Seconds between reads of the change feed in each worker.  DynamoDB Streams allows 5 reads a second per shard,
+# shared by every worker on every host.
+CHANGE_FEED_POLL_SECONDS = 2
+
+# Seconds to keep rendered content pages in each worker, and the max-age sent to browsers for them.  0 disables.
+PAGE_CACHE_TTL = 60
+PAGE_CACHE_MAX_AGE = 300
+
+# Distinct markdown texts kept rendered in each worker
+MARKDOWN_CACHE_MAX_ENTRIES = 256
+
+# Directory where RSVP and save-the-date submissions are spooled before a background thread writes them to
+# DynamoDB.  None writes them synchronously while the guest waits.
+RSVP_SPOOL_DIR = 'rsvp_spool'